@@ -0,0 +1,378 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager, nullcontext
+from tempfile import mkdtemp
+from urllib.request import Request, urlopen
+
+from pywps import configuration
+
+from .download import check_size, download
+
+logger = logging.getLogger("PYWPS")
+
+STATS_FILE = "stats.json"
+LOCK_FILE = ".lock"
+AGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_age(age):
+    """Convert an age such as 90s, 12h or 7d to seconds. Plain numbers are seconds."""
+    age = str(age).strip().lower()
+    if age[-1:] in AGE_UNITS:
+        return float(age[:-1]) * AGE_UNITS[age[-1]]
+    return float(age)
+
+
+def remote_version(url, timeout=10):
+    """
+    Return the ETag or, failing that, the Last-Modified header a server
+    reports for url, or None when it reports neither or cannot be reached.
+    """
+    try:
+        with urlopen(Request(url, method="HEAD"), timeout=timeout) as response:
+            return response.headers.get("ETag") or response.headers.get("Last-Modified")
+    except (OSError, ValueError):
+        return None
+
+
+def file_identity(path):
+    """
+    Identify a local file by its device, inode, size and modification time.
+    The identity is the same for every symbolic or hard link to the file and
+    changes when the file is rewritten, without reading the file.
+    """
+    stat = os.stat(path)
+    return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def hash_file(path, digest=None, blocksize=2**20, max_content=None):
+    """
+    Feed the content of a file to a hashlib digest and return the digest.
+    Local files larger than max_content bytes are identified by
+    file_identity instead of being read. Remote resources (e.g. OPeNDAP
+    urls) cannot be read byte by byte, so their address is hashed instead,
+    with the version the server reports for the DDS of the dataset when it
+    reports one.
+    """
+    digest = digest or hashlib.sha256()
+    if os.path.isfile(path):
+        if max_content is not None and os.path.getsize(path) > max_content:
+            digest.update(file_identity(path).encode("utf-8"))
+            return digest
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(blocksize), b""):
+                digest.update(block)
+    else:
+        digest.update(str(path).encode("utf-8"))
+        if str(path).startswith(("http://", "https://")):
+            version = remote_version(f"{path}.dds")
+            if version:
+                digest.update(version.encode("utf-8"))
+    return digest
+
+
+def download_key(url):
+    """
+    Build a cache key from a url and the version the server reports for it,
+    so a new version of the resource gets a new key.
+    """
+    digest = hashlib.sha256(url.encode("utf-8"))
+    version = remote_version(url)
+    if version:
+        digest.update(version.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def hash_inputs(files, config):
+    """
+    Build a cache key from the content of a set of input files and a
+    configuration dictionary.
+    Parameters
+        1. files (list): Paths or urls of the input files
+        2. config (dict): Any json serializable set of key-value pairs
+    """
+    digest = hashlib.sha256()
+    for path in files:
+        hash_file(path, digest)
+    digest.update(json.dumps(config, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class FileCache:
+    """
+    Size-bounded, least-recently-used cache of files stored on disk.
+
+    Every entry is a directory named after its key holding one or more files.
+    Entries are written to a temporary directory first and renamed into
+    place, so concurrent workers never see half written entries. Hit and miss
+    counters are kept in a json file next to the entries so they survive
+    across processes. The files of an entry carry the time it was made and
+    its directory the time it was last used; with max_age, entries older
+    than max_age seconds are dropped.
+    """
+
+    def __init__(self, cache_dir, max_size, max_age=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, name):
+        """
+        Return the cache called name as set up in the [osprey] section of the
+        pywps configuration, or None when caching is disabled.
+        """
+        cache_dir = configuration.get_config_value("osprey", "cache_dir")
+        if not cache_dir:
+            return None
+
+        max_size = configuration.get_config_value(
+            "osprey", f"{name}_cache_size"
+        ) or configuration.get_config_value("osprey", "cache_size", "1gb")
+        max_age = configuration.get_config_value(
+            "osprey", f"{name}_cache_age"
+        ) or configuration.get_config_value("osprey", "cache_age")
+        return cls(
+            os.path.join(cache_dir, name),
+            int(configuration.get_size_mb(max_size) * 1024**2),
+            parse_age(max_age) if max_age else None,
+        )
+
+    @contextmanager
+    def lock(self, key=None):
+        """Hold the lock of the whole cache or, with key, of a single entry."""
+        path = os.path.join(self.cache_dir, f"{LOCK_FILE}-{key}" if key else LOCK_FILE)
+        while True:
+            lock_file = open(path, "w")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # The lock file of an entry may have been removed with the entry
+            # while waiting for it, see _remove_lock; lock the one in its place
+            try:
+                if os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def entry(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """
+        Return the entry directory for key, or None on a cache miss. Other
+        workers may evict or replace the entry once it is returned; read it
+        within open to keep it in place.
+        """
+        return self._lookup(key, held=False)
+
+    @contextmanager
+    def open(self, key):
+        """
+        Hold the lock of the entry for key and yield its directory, or None
+        on a cache miss. The entry is neither evicted nor replaced while it
+        is held, so its files can be read in the meantime.
+        """
+        with self.lock(key):
+            yield self._lookup(key, held=True)
+
+    def _lookup(self, key, held):
+        path = self.entry(key)
+        with self.lock():
+            hit = os.path.isdir(path)
+            if hit and self._expired(path) and (held or not self._in_use(key)):
+                self._remove(path, "expirations")
+                hit = False
+            if hit:
+                # Refresh the entry's position in the LRU order
+                os.utime(path)
+            self._count("hits" if hit else "misses")
+
+        logger.debug(f"Cache {'hit' if hit else 'miss'} for {key} in {self.cache_dir}")
+        return path if hit else None
+
+    def put(self, key, files, replace=False, move=False):
+        """
+        Copy files into the entry for key and return the entry directory.
+        An existing entry for key is left in place unless replace is set.
+        With move the files are moved into the cache instead of copied.
+        """
+        staging = mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+        for path in files:
+            staged = os.path.join(staging, os.path.basename(path))
+            if move:
+                shutil.move(path, staged)
+            else:
+                shutil.copy2(path, staged)
+            os.utime(staged)
+
+        path = self.entry(key)
+        # An entry is only replaced once no worker reads it, see open
+        with self.lock(key) if replace else nullcontext(), self.lock():
+            if os.path.isdir(path) and not replace:
+                shutil.rmtree(staging)
+            else:
+                if os.path.isdir(path):
+                    # Directories cannot be renamed over each other
+                    old = mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+                    os.replace(path, os.path.join(old, key))
+                    shutil.rmtree(old)
+                os.replace(staging, path)
+            self._evict(keep=key)
+
+        return path
+
+    def fetch(self, url, local_file, progress=None, max_size=None):
+        """
+        Make local_file the content of url, served from the entry for the
+        version of url the server reports and downloaded into it first on a
+        miss. Workers fetching the same url wait for each other, so it is
+        downloaded once. Entries are hard linked to local_file when it is on
+        the same file system and copied otherwise. Returns local_file.
+        progress and max_size are handed to download; cached files larger
+        than max_size are refused as well.
+        """
+        key = download_key(url)
+        with self.open(key) as entry:
+            if not entry:
+                download_dir = mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+                try:
+                    path = download(
+                        url,
+                        os.path.join(download_dir, "download"),
+                        progress=progress,
+                        max_size=max_size,
+                    )
+                    # Linked entries are shared by every job using them
+                    os.chmod(path, 0o444)
+                    entry = self.put(key, [path], move=True)
+                finally:
+                    shutil.rmtree(download_dir, ignore_errors=True)
+
+            cached = os.path.join(entry, "download")
+            check_size(url.split("#")[0], os.path.getsize(cached), max_size, local_file)
+            if os.path.lexists(local_file):
+                os.remove(local_file)
+            try:
+                os.link(cached, local_file)
+            except OSError:
+                shutil.copyfile(cached, local_file)
+        return local_file
+
+    def stats(self):
+        with self.lock():
+            stats = self._read_stats()
+        entries = self._entries()
+        stats["entries"] = len(entries)
+        stats["size"] = sum(size for _, _, size in entries)
+        return stats
+
+    def _entries(self):
+        """List (key, last access, size) for every complete entry."""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            path = self.entry(key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(root, name))
+                for root, _, names in os.walk(path)
+                for name in names
+            )
+            entries.append((key, os.path.getmtime(path), size))
+        return entries
+
+    def _expired(self, path):
+        if not self.max_age:
+            return False
+        made = min(
+            (
+                os.path.getmtime(os.path.join(root, name))
+                for root, _, names in os.walk(path)
+                for name in names
+            ),
+            default=os.path.getmtime(path),
+        )
+        return time.time() - made > self.max_age
+
+    def _in_use(self, key):
+        """Whether a worker holds the lock of the entry for key, see open."""
+        try:
+            with open(os.path.join(self.cache_dir, f"{LOCK_FILE}-{key}")) as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        except FileNotFoundError:
+            return False
+        except BlockingIOError:
+            return True
+        return False
+
+    def _remove_lock(self, key):
+        """
+        Remove the lock file of the entry for key unless a worker holds it.
+        The file is removed while locked, so workers waiting for it lock a
+        new one instead, see lock.
+        """
+        path = os.path.join(self.cache_dir, f"{LOCK_FILE}-{key}")
+        try:
+            with open(path) as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(path)
+        except (FileNotFoundError, BlockingIOError):
+            pass
+
+    def _remove(self, path, counter):
+        shutil.rmtree(path, ignore_errors=True)
+        self._remove_lock(os.path.basename(path))
+        self._count(counter)
+        logger.debug(f"Removed {os.path.basename(path)} from {self.cache_dir}")
+
+    def _evict(self, keep=None):
+        entries = []
+        # The new entry and the entries being read are left in place
+        pinned = 0
+        for key, used, size in self._entries():
+            if key == keep or self._in_use(key):
+                pinned += size
+            elif self._expired(self.entry(key)):
+                self._remove(self.entry(key), "expirations")
+            else:
+                entries.append((key, used, size))
+        entries.sort(key=lambda entry: entry[1])
+        total = pinned + sum(size for _, _, size in entries)
+        for key, _, size in entries:
+            if total <= self.max_size:
+                break
+            self._remove(self.entry(key), "evictions")
+            total -= size
+
+        # Lock files left by misses and by entries removed while they were
+        # held, see open
+        for name in os.listdir(self.cache_dir):
+            key = name[len(LOCK_FILE) + 1 :]
+            if name.startswith(f"{LOCK_FILE}-") and not os.path.isdir(self.entry(key)):
+                self._remove_lock(key)
+
+    def _read_stats(self):
+        try:
+            with open(os.path.join(self.cache_dir, STATS_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def _count(self, counter):
+        stats = self._read_stats()
+        stats[counter] = stats.get(counter, 0) + 1
+        stats["updated"] = time.time()
+        with open(os.path.join(self.cache_dir, STATS_FILE), "w") as f:
+            json.dump(stats, f)
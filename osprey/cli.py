@@ -12,6 +12,7 @@ from jinja2 import Environment, PackageLoader
 from pywps import configuration
 
 from . import wsgi
+from .engine import warm_up
 from urllib.parse import urlparse
 
 PID_FILE = os.path.abspath(os.path.join(os.path.curdir, "pywps.pid"))
@@ -80,6 +81,8 @@ def _run(application, bind_host=None, daemon=False):
     bind_host = bind_host or host
     # need to serve the wps outputs
     static_files = {"/outputs": configuration.get_config_value("server", "outputpath")}
+    # Compile the numba kernel now rather than in the first request
+    warm_up()
     run_simple(
         hostname=bind_host,
         port=port,
@@ -105,6 +105,8 @@ convolve_config_template = OrderedDict(
             "DATL_LIQ_FLDS": ["RUNOFF", "BASEFLOW"],
             "START": None,
             "END": None,
+            # timesteps the numpy and numba engines read at once, 0 for all
+            "SLAB_STEPS": 365,
         },
     }
 )
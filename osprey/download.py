@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import os
+import time
+from http.client import HTTPException
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+logger = logging.getLogger("PYWPS")
+
+CHUNK_SIZE = 2**20
+RETRIES = 5
+# Seconds to wait before the first retry, doubled for every further retry
+BACKOFF = 1
+# Seconds between two progress reports
+REPORT_INTERVAL = 5
+# Client errors that are worth retrying
+RETRY_CODES = (408, 429)
+
+
+def split_checksum(url):
+    """
+    Split a url ending in a #<algorithm>=<hex digest> fragment, e.g.
+    #sha256=..., into the url to fetch and the (algorithm, digest) the file
+    must have. The checksum is None for urls without such a fragment.
+    """
+    address, _, fragment = url.partition("#")
+    algorithm, _, digest = fragment.partition("=")
+    if digest and algorithm.lower() in hashlib.algorithms_available:
+        return address, (algorithm.lower(), digest.lower())
+    return url, None
+
+
+def expected_size(response, offset):
+    """Total size of a resource from the headers of a (partial) response."""
+    content_range = response.headers.get("Content-Range")
+    if content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    return int(length) + offset if length and length.isdigit() else None
+
+
+def file_digest(path, algorithm, blocksize=CHUNK_SIZE):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def check_size(address, size, max_size, part):
+    """Remove the partial download part and raise when size exceeds max_size."""
+    if max_size is not None and size > max_size:
+        if os.path.exists(part):
+            os.remove(part)
+        raise ValueError(f"{address} is larger than the limit of {max_size} bytes")
+
+
+def download(url, path, retries=RETRIES, timeout=60, progress=None, max_size=None):
+    """
+    Stream url to path in chunks. An interrupted transfer is retried up to
+    retries times with exponential backoff and picks up where it stopped with
+    an HTTP Range request, falling back to the start when the server does not
+    support ranges. The file is only moved to path once its size matches the
+    one the server reported and, for urls with a #<algorithm>=<digest>
+    fragment, its checksum matches.
+    Parameters
+        1. url (str): Address of the file, optionally with a checksum fragment
+        2. path (str): Where to write the file
+        3. retries (int): Number of retries after a failed attempt
+        4. timeout (float): Seconds to wait for the server on every read
+        5. progress (callable): Called as progress(url, done, total, rate)
+            every REPORT_INTERVAL seconds and at the end, with the bytes
+            written, the total bytes or None when unknown, and the transfer
+            rate in bytes per second
+        6. max_size (int): Largest file in bytes, None for any size. Larger
+            files are refused when the server reports their size and aborted
+            once that many bytes arrived otherwise
+    Returns path.
+    """
+    address, checksum = split_checksum(url)
+    part = f"{path}.part"
+    done, total, attempt = 0, None, 0
+    started = reported = time.monotonic()
+    received = 0
+
+    while True:
+        try:
+            headers = {"Range": f"bytes={done}-"} if done else {}
+            with urlopen(
+                Request(address, headers=headers), timeout=timeout
+            ) as response:
+                if done and response.status != 206:
+                    # The server sends the whole file again
+                    done = 0
+                total = expected_size(response, done)
+                check_size(address, total or 0, max_size, part)
+                with open(part, "ab" if done else "wb") as f:
+                    for block in iter(lambda: response.read(CHUNK_SIZE), b""):
+                        f.write(block)
+                        done += len(block)
+                        received += len(block)
+                        check_size(address, done, max_size, part)
+                        now = time.monotonic()
+                        if progress and now - reported >= REPORT_INTERVAL:
+                            progress(url, done, total, received / (now - started))
+                            reported = now
+            if total is not None and done != total:
+                raise HTTPException(f"Got {done} of {total} bytes")
+            break
+        except (OSError, HTTPException) as e:
+            if isinstance(e, HTTPError) and e.code == 416 and done == total:
+                # The connection dropped after the last byte
+                break
+            attempt += 1
+            client_error = isinstance(e, HTTPError) and e.code < 500
+            if attempt > retries or (client_error and e.code not in RETRY_CODES):
+                if os.path.exists(part):
+                    os.remove(part)
+                raise
+            wait = BACKOFF * 2 ** (attempt - 1)
+            logger.warning(
+                f"Download of {address} failed after {done} bytes ({e}), "
+                f"retrying in {wait}s"
+            )
+            time.sleep(wait)
+
+    if progress:
+        progress(url, done, total, received / max(time.monotonic() - started, 1e-9))
+    if checksum:
+        algorithm, digest = checksum
+        if file_digest(part, algorithm) != digest:
+            os.remove(part)
+            raise ValueError(f"{algorithm} checksum of {address} does not match")
+    os.replace(part, path)
+    return path
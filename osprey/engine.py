@@ -0,0 +1,829 @@
+import getpass
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+from netCDF4 import Dataset, date2index, date2num, num2date
+from pywps import configuration
+
+from .param_file import index_window, read_unit_hydrograph
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+logger = logging.getLogger("PYWPS")
+
+# RVIC's conventions for the time axis of history and restart files
+TIMEUNITS = "days since 0001-1-1 0:0:0"
+SECSPERDAY = 86400.0
+WATERDENSITY = 1000.0
+EARTHRADIUS = 6.37122e6
+
+FLUX_UNITS = ("kg/m2*s", "kg m-2 s-1", "kg m^-2 s^-1", "kg*m-2*s-1", "kg s-1 m-2")
+
+# kg m-2 of water per unit of forcing fields given as a depth per timestep
+DEPTH_UNITS = {
+    ("mm", "MM", "milimeters", "Milimeters"): WATERDENSITY / 1000.0,
+    ("m", "M", "meters", "Meters"): WATERDENSITY,
+    ("cm", "CM", "centimeters", "Centimeters"): WATERDENSITY / 100.0,
+}
+
+AREA_UNITS = {
+    (
+        "rad2",
+        "radians2",
+        "radian2",
+        "radian^2",
+        "rad^2",
+        "radians^2",
+        "rads^2",
+        "radians squared",
+        "square-radians",
+    ): EARTHRADIUS
+    ** 2,
+    ("m2", "m^2", "meters^2", "meters2", "square-meters", "meters squared"): 1.0,
+    (
+        "km2",
+        "km^2",
+        "kilometers^2",
+        "kilometers2",
+        "square-kilometers",
+        "kilometers squared",
+    ): 1000.0
+    ** 2,
+    ("mi2", "mi^2", "miles^2", "miles", "square-miles", "miles squared"): 1609.34**2,
+}
+
+# Bytes of spectra held at once by fft_convolve, at most
+FFT_BLOCK_BYTES = 2**28
+
+# The netCDF library is not thread safe, slabs are read on another thread
+NETCDF_LOCK = threading.Lock()
+
+
+def unsupported(config):
+    """
+    Return why a convolution config cannot be run by the engines of this
+    module, or None when it can. They cover single history tapes of array
+    output written every timestep, as Osprey's processes produce them.
+    """
+    options, history = config["OPTIONS"], config["HISTORY"]
+    forcings = config["INPUT_FORCINGS"]
+    if options["RUN_TYPE"] not in ("drystart", "startup"):
+        return f"RUN_TYPE {options['RUN_TYPE']}"
+    if options["STOP_OPTION"] != "date":
+        return f"STOP_OPTION {options['STOP_OPTION']}"
+    if options["REST_OPTION"] != "date":
+        return f"REST_OPTION {options['REST_OPTION']}"
+    if forcings["START"]:
+        return "forcings split over several files"
+    if (
+        int(history["RVICHIST_NTAPES"]) != 1
+        or int(history["RVICHIST_NHTFRQ"]) != 1
+        or history["RVICHIST_AVGFLAG"] != "A"
+        or history["RVICHIST_OUTTYPE"] != "array"
+    ):
+        return "history tapes other than one averaged array tape per timestep"
+
+    forcing_file = os.path.join(forcings["DATL_PATH"], forcings["DATL_FILE"])
+    with Dataset(forcing_file) as ds:
+        times = ds.variables[forcings["TIME_VAR"]][:2]
+        units = ds.variables[forcings["TIME_VAR"]].units
+    with Dataset(config["PARAM_FILE"]["FILE_NAME"]) as ds:
+        uh_dt = float(ds.variables["unit_hydrograph_dt"][...])
+    forcing_dt = np.diff(date2num(num2date(times, units), TIMEUNITS)) * SECSPERDAY
+    if len(forcing_dt) != 1 or not np.isclose(forcing_dt[0], uh_dt):
+        return "forcing timesteps other than the unit hydrograph timestep"
+    return None
+
+
+def read_params(param_file):
+    """
+    Read the arrays of an RVIC parameter file used in convolution. The unit
+    hydrographs of sparse parameter files are expanded.
+    """
+    with Dataset(param_file) as ds:
+        ds.set_auto_mask(False)
+        params = {
+            name: ds.variables[name][...]
+            for name in (
+                "full_time_length",
+                "subset_length",
+                "unit_hydrograph_dt",
+                "source_y_ind",
+                "source_x_ind",
+                "source_time_offset",
+                "source2outlet_ind",
+                "outlet_lon",
+                "outlet_lat",
+                "outlet_x_ind",
+                "outlet_y_ind",
+                "outlet_decomp_ind",
+            )
+        }
+        uh = read_unit_hydrograph(ds)
+        # The tracers axis only holds the liquid tracer
+        params["unit_hydrograph"] = uh[..., 0] if uh.ndim == 3 else uh
+        ds.variables["outlet_name"].set_auto_chartostring(False)
+        params["outlet_name"] = ds.variables["outlet_name"][...]
+        params["outlet_upstream_area"] = (
+            ds.variables["outlet_upstream_area"][...]
+            if "outlet_upstream_area" in ds.variables
+            else None
+        )
+        params["attrs"] = {att: ds.getncattr(att) for att in ds.ncattrs()}
+    return params
+
+
+def params_window(params):
+    """Same as source_window for the arrays of a parameter file."""
+    return index_window(
+        np.r_[params["source_y_ind"], params["outlet_y_ind"]],
+        np.r_[params["source_x_ind"], params["outlet_x_ind"]],
+    )
+
+
+def crop_params(params, window):
+    """
+    Return a copy of the arrays of a parameter file with the source and
+    outlet indices moved onto a window of the domain grid, as
+    crop_param_file does for the file.
+    """
+    rows, cols = window
+    cropped = dict(params)
+    for point in ("source", "outlet"):
+        cropped[f"{point}_y_ind"] = params[f"{point}_y_ind"] - rows.start
+        cropped[f"{point}_x_ind"] = params[f"{point}_x_ind"] - cols.start
+    return cropped
+
+
+def unit_hydrographs(params):
+    """
+    Return the unit hydrograph of every source over the full time length,
+    shifted by the travel time of the source, as a (timesteps, sources)
+    array.
+    """
+    sub = params["unit_hydrograph"]
+    length = int(params["full_time_length"])
+    n_sources = sub.shape[1]
+    rows = params["source_time_offset"][None, :] + np.arange(sub.shape[0])[:, None]
+    cols = np.broadcast_to(np.arange(n_sources), rows.shape)
+    uh = np.zeros((length, n_sources))
+    inside = rows < length
+    uh[rows[inside], cols[inside]] = sub[inside]
+    return uh
+
+
+def fft_convolve(
+    runoff, uh, outlets, n_outlets, n_flows=None, max_bytes=FFT_BLOCK_BYTES
+):
+    """
+    Convolve the runoff of every source with its unit hydrograph and sum
+    the flows of the sources of each outlet.
+    Parameters
+        1. runoff (array): Runoff of the sources, (timesteps, sources)
+        2. uh (array): Unit hydrographs of the sources, (lags, sources)
+        3. outlets (array): Outlet index of every source
+        4. n_outlets (int): Number of outlets
+        5. n_flows (int): Number of timesteps of flow to return, at most
+            the timesteps of runoff and lags of uh less one. Defaults to
+            the timesteps of runoff
+        6. max_bytes (int): Bytes of spectra to hold at once, see
+            slab_size. A block always holds one source
+    Returns the flow at the outlets for n_flows timesteps from the first
+    timestep of runoff.
+    """
+    n_steps = runoff.shape[0]
+    n_flows = n_flows or n_steps
+    # Pad to a power of two, long enough that the convolution does not wrap
+    nfft = 1 << (n_steps + uh.shape[0] - 2).bit_length()
+    block = max(1, max_bytes // (nfft * 8 * 3))
+    order = np.argsort(outlets, kind="stable")
+    flows = np.zeros((n_flows, n_outlets))
+    for first in range(0, len(order), block):
+        sources = order[first : first + block]
+        spectra = np.fft.rfft(runoff[:, sources], nfft, axis=0)
+        spectra *= np.fft.rfft(uh[:, sources], nfft, axis=0)
+        # Sum the sources of each outlet before transforming back
+        block_outlets = outlets[sources]
+        starts = np.flatnonzero(np.r_[True, block_outlets[1:] != block_outlets[:-1]])
+        spectra = np.add.reduceat(spectra, starts, axis=1)
+        flows[:, block_outlets[starts]] += np.fft.irfft(spectra, nfft, axis=0)[:n_flows]
+    return flows
+
+
+def _accumulate(runoff, uh, first, last, outlets, flows):
+    # Timesteps run in the outer loop so runoff is read in its file layout;
+    # the rows of flows written at a timestep stay in cache
+    n_flows = flows.shape[0]
+    for t in range(min(runoff.shape[0], n_flows)):
+        for s in range(runoff.shape[1]):
+            x = runoff[t, s]
+            outlet = outlets[s]
+            for i in range(first[s], min(last[s], n_flows - t)):
+                flows[t + i, outlet] += uh[s, i] * x
+
+
+if njit:
+    # Cached on disk so worker processes load the compiled kernel
+    _accumulate = njit(cache=True, nogil=True)(_accumulate)
+
+
+def direct_convolve(runoff, uh, outlets, n_outlets, n_flows=None):
+    """
+    Same as fft_convolve, accumulating the flow of every source over the
+    lags of its unit hydrograph that are not zero in a compiled loop. Cheaper
+    than FFTs for short unit hydrographs over many outlets.
+    """
+    nonzero = uh != 0
+    first = nonzero.argmax(axis=0)
+    last = np.where(nonzero.any(axis=0), uh.shape[0] - nonzero[::-1].argmax(axis=0), 0)
+    flows = np.zeros((n_flows or runoff.shape[0], n_outlets))
+    # Unit hydrographs are read per source
+    _accumulate(
+        np.ascontiguousarray(runoff),
+        np.ascontiguousarray(uh.T),
+        first,
+        last,
+        np.asarray(outlets, dtype=np.int64),
+        flows,
+    )
+    return flows
+
+
+def warm_up():
+    """Compile the kernel of the numba engine, if numba is installed."""
+    if njit:
+        direct_convolve(np.ones((2, 1)), np.ones((2, 1)), np.zeros(1, int), 1)
+
+
+def route(slabs, uh, outlets, n_outlets, kernel, ring_step=None):
+    """
+    Route the runoff of a run given in slabs of consecutive timesteps. Only
+    the flow still due from earlier slabs, one unit hydrograph long, is
+    carried from one slab to the next, so the run is never held at once.
+    Parameters
+        1. slabs (iterable): First timestep and runoff of every slab, in order
+        2. uh, outlets, n_outlets: See fft_convolve
+        3. kernel (function): Computes the flow at the outlets, see
+            fft_convolve
+        4. ring_step (int): Timestep a slab ends at to return the ring of
+    Yields the first timestep and the flow at the outlets of every slab,
+    and the convolution ring RVIC holds after ring_step when the slab ends
+    there (None otherwise): the flow at the outlets over the next lags that
+    is due to the runoff up to ring_step.
+    """
+    length = uh.shape[0]
+    due = np.zeros((length - 1, n_outlets))
+    for first, runoff in slabs:
+        n_steps = len(runoff)
+        flows = kernel(runoff, uh, outlets, n_outlets, n_steps + length - 1)
+        flows[: length - 1] += due
+        due = flows[n_steps:].copy()
+        ring = flows[n_steps - 1 :].copy() if ring_step == first + n_steps - 1 else None
+        yield first, flows[:n_steps], ring
+
+
+def memory_budget():
+    """
+    Return the bytes a numpy or numba convolution may hold, as set by
+    convolution_memory in the [osprey] section of the pywps configuration,
+    or None when it is not bounded.
+    """
+    size = configuration.get_config_value("osprey", "convolution_memory")
+    return int(configuration.get_size_mb(size) * 1024**2) if size else None
+
+
+def slab_size(config, params, n_steps):
+    """
+    Return the number of timesteps to read at once: SLAB_STEPS, or fewer
+    when two slabs, the one routed and the one read, would not fit in the
+    memory budget next to the unit hydrographs and the spectra of one
+    source. Also returns the bytes fft_convolve may hold for its spectra:
+    what the slabs and unit hydrographs leave of the budget, at most
+    FFT_BLOCK_BYTES.
+    """
+    slab = int(config["INPUT_FORCINGS"].get("SLAB_STEPS") or 0) or n_steps
+    budget = memory_budget()
+    if not budget:
+        return slab, FFT_BLOCK_BYTES
+
+    ys, xs = params["source_y_ind"], params["source_x_ind"]
+    n_cells = int(ys.max() - ys.min() + 1) * int(xs.max() - xs.min() + 1)
+    n_sources, n_outlets = len(ys), len(params["outlet_y_ind"])
+    length = int(params["full_time_length"])
+    # read_runoff reads a field over the bounding box of the sources and
+    # converts it to float64; kernels return the flows of the slab
+    step_bytes = 8 * (2 * (2 * n_cells + n_sources) + 2 * n_outlets)
+    uh_bytes = 2 * 8 * length * n_sources
+    # The spectra of a source are padded to at most twice the timesteps of
+    # the slab and the lags, see fft_convolve
+    source_bytes = 2 * 8 * 3
+    steps = (budget - uh_bytes - source_bytes * length) // (step_bytes + source_bytes)
+    if steps < 1:
+        logger.warning(
+            f"convolution_memory of {budget} bytes is too small, reading one "
+            "timestep at a time"
+        )
+    slab = int(max(1, min(slab, steps)))
+    fft_bytes = budget - uh_bytes - step_bytes * slab
+    return slab, int(min(FFT_BLOCK_BYTES, max(fft_bytes, 0)))
+
+
+def slab_bounds(n_steps, slab_steps, breaks=()):
+    """
+    Split n_steps timesteps into slabs of at most slab_steps timesteps
+    (all of them at once for 0) that also end before every step in breaks.
+    Returns the first and stop timestep of every slab.
+    """
+    edges = set(range(0, n_steps, slab_steps or n_steps)) | {n_steps}
+    edges |= {stop for stop in breaks if 0 < stop < n_steps}
+    edges = sorted(edges)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def read_slabs(config, params, start_ord, bounds):
+    """
+    Yield the first timestep and runoff of every slab of a run starting at
+    start_ord, reading the next slab on a background thread while the
+    current one is routed. See read_runoff.
+    """
+    calendar = config["OPTIONS"]["CALENDAR"]
+    step = float(params["unit_hydrograph_dt"]) / SECSPERDAY
+
+    def read(first, stop):
+        start = num2date(start_ord + first * step, TIMEUNITS, calendar)
+        with NETCDF_LOCK:
+            return read_runoff(config, params, start, stop - first)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(read, *bounds[0])
+        for i, (first, stop) in enumerate(bounds):
+            runoff = pending.result()
+            if i + 1 < len(bounds):
+                pending = executor.submit(read, *bounds[i + 1])
+            yield first, runoff
+
+
+def lats_ascend(lats):
+    return lats.ndim == 1 and lats[-1] > lats[0]
+
+
+def grid_rows(ys, lats):
+    """Convert rows counted from the north edge to rows of a grid with lats."""
+    if lats_ascend(lats):
+        return len(lats) - 1 - ys
+    return ys
+
+
+def forcing_file(config):
+    forcings = config["INPUT_FORCINGS"]
+    return os.path.join(forcings["DATL_PATH"], forcings["DATL_FILE"])
+
+
+def read_runoff(config, params, start, n_steps):
+    """
+    Read the liquid runoff of the source cells of params from the forcing
+    file of config, in kg m-2 s-1, for n_steps timesteps from start.
+    Returns the runoff as a (timesteps, sources) array.
+    """
+    forcings = config["INPUT_FORCINGS"]
+    fields = forcings["DATL_LIQ_FLDS"]
+    fields = fields if isinstance(fields, list) else [fields]
+    dt = float(params["unit_hydrograph_dt"])
+
+    with Dataset(forcing_file(config)) as ds:
+        time_var = ds.variables[forcings["TIME_VAR"]]
+        calendar = getattr(time_var, "calendar", "standard")
+        first = int(date2index(start, time_var, calendar=calendar))
+        if first + n_steps > len(time_var):
+            raise ValueError("Timestamp is exceeds date range in input files")
+        times = date2num(
+            num2date(time_var[first : first + n_steps], time_var.units, calendar),
+            TIMEUNITS,
+            calendar,
+        )
+        expected = date2num(start, TIMEUNITS, calendar) + np.arange(n_steps) * (
+            dt / SECSPERDAY
+        )
+        if not np.allclose(times, expected):
+            raise ValueError("The forcing timesteps do not follow each other")
+
+        ys = grid_rows(
+            params["source_y_ind"], ds.variables[forcings["LATITUDE_VAR"]][:]
+        )
+        xs = params["source_x_ind"]
+        rows, cols = slice(ys.min(), ys.max() + 1), slice(xs.min(), xs.max() + 1)
+        runoff = np.zeros((n_steps, len(ys)))
+        for field in fields:
+            var = ds.variables[field]
+            var.set_auto_maskandscale(False)
+            data = var[first : first + n_steps, rows, cols][
+                :, ys - rows.start, xs - cols.start
+            ].astype(np.float64)
+            fill = getattr(var, "_FillValue", None)
+            if fill is not None:
+                if (data[0] == fill).any():
+                    raise ValueError(
+                        "Exiting now due to fill values being inside the domain "
+                        "defined by the RVIC parameter file"
+                    )
+                data[data == fill] = np.nan
+            runoff += data * forcing_multiplier(var.units, dt)
+    return runoff
+
+
+def forcing_multiplier(units, dt):
+    """Return the factor from forcing units to kg m-2 s-1 for timesteps of dt."""
+    if units in FLUX_UNITS:
+        return 1.0
+    for names, mult in DEPTH_UNITS.items():
+        if units in names:
+            return mult / dt
+    raise ValueError(f"unknown forcing units: {units}")
+
+
+def units_multiplier(config, params):
+    """
+    Return the factor of every outlet from kg m-2 s-1 to the history units
+    of config, from the area of the outlet cells in the domain file.
+    """
+    units = config["HISTORY"]["RVICHIST_UNITS"]
+    if units in ("kg/m2/s",) + FLUX_UNITS[1:]:
+        return np.ones(len(params["outlet_y_ind"]))
+
+    domain = config["DOMAIN"]
+    with Dataset(domain["FILE_NAME"]) as ds:
+        lats = ds.variables[domain["LATITUDE_VAR"]][:]
+        area_var = ds.variables[domain["AREA_VAR"]]
+        ys = grid_rows(params["outlet_y_ind"], lats)
+        area = np.asarray(area_var[...], dtype=np.float64)[ys, params["outlet_x_ind"]]
+        area *= next(
+            mult for names, mult in AREA_UNITS.items() if area_var.units in names
+        )
+
+    if units in ("m3/s", "m^3/s", "m3 s-1"):
+        return area / WATERDENSITY
+    if units in ("mm/day", "mm d-1", "mm d^-1"):
+        return area * SECSPERDAY / WATERDENSITY / params["outlet_upstream_area"]
+    if units in ("gal/day", "gpd", "gal d-1"):
+        return area / WATERDENSITY * 2.28e7
+    if units in ("cfs", "ft^3 s-1", "f3/s"):
+        return area / WATERDENSITY * 35.3
+    if units in ("acre-ft/d",):
+        return area / WATERDENSITY * 70.0
+    raise ValueError(f"{units} is not a valid units string")
+
+
+def global_attrs(config, params, title):
+    """Global attributes of the files RVIC writes in a convolution run."""
+    attrs = params["attrs"]
+    return {
+        "title": title,
+        "comment": "Output from the RVIC Streamflow Routing Model.",
+        "Conventions": "CF-1.6",
+        "history": f"Created: {time.ctime(time.time())}",
+        "source": "osprey",
+        "hostname": socket.gethostname(),
+        "username": getpass.getuser(),
+        "casename": config["OPTIONS"]["CASEID"],
+        "casestr": config["OPTIONS"]["CASESTR"],
+        "references": "Based on the initial model of Lohmann, et al., "
+        "1996, Tellus, 48(A), 708-721",
+        "RvicPourPointsFile": os.path.basename(attrs["RvicPourPointsFile"]),
+        "RvicUHFile": os.path.basename(attrs["RvicUHFile"]),
+        "RvicFdrFile": os.path.basename(attrs["RvicFdrFile"]),
+        "RvicDomainFile": os.path.basename(config["DOMAIN"]["FILE_NAME"]),
+    }
+
+
+def read_initial_state(config, params):
+    """Read the convolution ring of the INITIAL_STATE file of a startup run."""
+    with Dataset(config["INITIAL_STATE"]["FILE_NAME"]) as ds:
+        if ds.variables["unit_hydrograph_dt"][...] != params["unit_hydrograph_dt"]:
+            raise ValueError(
+                "Timestep in Statefile does not match timestep in ParamFile"
+            )
+        if not np.array_equal(
+            ds.variables["outlet_decomp_ind"][:], params["outlet_decomp_ind"]
+        ):
+            raise ValueError("outlet_decomp_ind in Statefile does not match ParamFile")
+        if ds.RvicDomainFile != params["attrs"]["RvicDomainFile"]:
+            raise ValueError("RvicDomainFile in StateFile does not match ParamFile")
+        return np.asarray(ds.variables["LIQ_ring"][...], dtype=np.float64)
+
+
+def write_history(hist_file, config, params, outlet_y_ind):
+    """
+    Create an RVIC history file of array output for the outlets of params.
+    The flows are added with append_history.
+    Parameters
+        1. hist_file (str): Path of the history file
+        2. config (dict): Convolution config of the run
+        3. params (dict): Arrays of the parameter file, see read_params
+        4. outlet_y_ind (array): Rows of the outlets in the forcing grid
+    """
+    history = config["HISTORY"]
+    prec = "f4" if int(history["RVICHIST_NDENS"]) == 1 else "f8"
+    names = params["outlet_name"]
+
+    with Dataset(hist_file, "w", format=history["RVICHIST_NCFORM"]) as out:
+        out.createDimension("time", None)
+        out.createDimension("nv", 2)
+        out.createDimension("outlets", len(outlet_y_ind))
+        out.createDimension("nc_chars", names.shape[1])
+
+        time_var = out.createVariable("time", prec, ("time",))
+        time_var.setncatts(
+            {
+                "units": TIMEUNITS,
+                "long_name": "time",
+                "calendar": config["OPTIONS"]["CALENDAR"],
+                "bounds": "time_bnds",
+            }
+        )
+        out.createVariable("time_bnds", prec, ("time", "nv"))
+
+        for name, values, dtype, attrs in (
+            (
+                "lon",
+                params["outlet_lon"],
+                prec,
+                {
+                    "units": "degrees_east",
+                    "long_name": "Longitude coordinate of outlet grid cell",
+                },
+            ),
+            (
+                "lat",
+                params["outlet_lat"],
+                prec,
+                {
+                    "units": "degrees_north",
+                    "long_name": "Latitude coordinate of outlet grid cell",
+                },
+            ),
+            (
+                "outlet_x_ind",
+                params["outlet_x_ind"],
+                "i4",
+                {
+                    "units": "unitless",
+                    "long_name": "x grid coordinate of outlet grid cell",
+                },
+            ),
+            (
+                "outlet_y_ind",
+                outlet_y_ind,
+                "i4",
+                {
+                    "units": "unitless",
+                    "long_name": "y grid coordinate of outlet grid cell",
+                },
+            ),
+            (
+                "outlet_decomp_ind",
+                params["outlet_decomp_ind"],
+                "i4",
+                {
+                    "units": "unitless",
+                    "long_name": "1d grid location of outlet grid cell",
+                },
+            ),
+        ):
+            var = out.createVariable(name, dtype, ("outlets",))
+            var[:] = values
+            var.setncatts(attrs)
+
+        var = out.createVariable("outlet_name", "S1", ("outlets", "nc_chars"))
+        var[:] = names
+        var.setncatts({"units": "unitless", "long_name": "Outlet guage name"})
+
+        var = out.createVariable("streamflow", prec, ("time", "outlets"))
+        var.setncatts(
+            {
+                "units": history["RVICHIST_UNITS"],
+                "long_name": "Streamflow at outlet grid cell",
+            }
+        )
+
+        out.setncatts(global_attrs(config, params, "RVIC history file"))
+        out.featureType = "timeSeries"
+    return hist_file
+
+
+def append_history(hist_file, params, times, flows):
+    """
+    Add timesteps to a history file made by write_history.
+    Parameters
+        1. hist_file (str): Path of the history file
+        2. params (dict): Arrays of the parameter file, see read_params
+        3. times (array): Start of every timestep, in days since 0001-1-1
+        4. flows (array): Flow at the outlets in the history units,
+            (timesteps, outlets)
+    """
+    step = float(params["unit_hydrograph_dt"]) / SECSPERDAY
+    bounds = np.stack([times, times + step], axis=1)
+    with Dataset(hist_file, "a") as out:
+        first = len(out.dimensions["time"])
+        records = slice(first, first + len(times))
+        out.variables["time"][records] = bounds.mean(axis=1)
+        out.variables["time_bnds"][records] = bounds
+        out.variables["streamflow"][records] = flows
+
+
+def write_restart(restart_dir, config, params, timestamp, ring):
+    """
+    Write the convolution ring at timestamp to an RVIC state file and point
+    the rpointer file of restart_dir to it. Only the variables RVIC reads
+    back in startup and restart runs are written.
+    """
+    options = config["OPTIONS"]
+    calendar = options["CALENDAR"]
+    restart_file = os.path.join(
+        restart_dir, timestamp.strftime(f"{options['CASEID']}.r.%Y-%m-%d-%H-%M-%S.nc")
+    )
+    with Dataset(restart_file, "w", format=options["REST_NCFORM"]) as out:
+        out.createDimension("time", 1)
+        out.createDimension("timesteps", ring.shape[0])
+        out.createDimension("outlets", ring.shape[1])
+
+        var = out.createVariable("time", "f8", ("time",))
+        var[:] = date2num(timestamp, TIMEUNITS, calendar)
+        var.setncatts({"long_name": "time", "units": TIMEUNITS, "calendar": calendar})
+        var = out.createVariable("timesteps", "f8", ("timesteps",))
+        var[:] = np.arange(ring.shape[0])
+        var.setncatts(
+            {
+                "long_name": "Series of timesteps",
+                "timestep_length": "unit_hydrograph_dt",
+            }
+        )
+        var = out.createVariable("unit_hydrograph_dt", "f8", ())
+        var[...] = params["unit_hydrograph_dt"]
+        var.setncatts({"long_name": "Unit hydrograph timestep", "units": "seconds"})
+
+        for name in ("outlet_y_ind", "outlet_x_ind", "outlet_decomp_ind"):
+            out.createVariable(name, "i4", ("outlets",))[:] = params[name]
+        var = out.createVariable("LIQ_ring", "f8", ("timesteps", "outlets"))
+        var[:] = ring
+        var.setncatts({"long_name": "Convolution Ring", "units": "kg m-2 s-1"})
+
+        out.setncatts(global_attrs(config, params, "RVIC restart file"))
+        out.RvicDomainFile = params["attrs"]["RvicDomainFile"]
+
+    pointer = ConfigParser()
+    pointer.optionxform = str
+    pointer["RESTART"] = {
+        "FILE_NAME": restart_file,
+        "TIMESTAMP": timestamp.strftime("%Y-%m-%d-%H"),
+    }
+    with open(os.path.join(restart_dir, "rpointer"), "w") as f:
+        pointer.write(f)
+    return restart_file
+
+
+def numpy_convolution(config, params=None):
+    """
+    Run the convolution of an RVIC config with batched NumPy operations
+    instead of RVIC's loop over timesteps. The runoff of the whole run is
+    convolved with the unit hydrographs of all sources in the frequency
+    domain. params are the arrays of the parameter file of config, when
+    they have been read already.
+    """
+    run_engine(config, fft_convolve, params)
+
+
+def numba_convolution(config, params=None):
+    """
+    Run the convolution of an RVIC config with a compiled loop over the
+    sources and lags. Uses the numpy engine when numba is not installed.
+    See numpy_convolution for params.
+    """
+    if not njit:
+        logger.warning("numba is not installed, convolving with the numpy engine")
+    run_engine(config, direct_convolve if njit else fft_convolve, params)
+
+
+def run_engine(config, kernel, params=None):
+    """
+    Read the runoff of config in slabs of SLAB_STEPS timesteps, bounded by
+    the memory budget, route it to the outlets with kernel and write the
+    history, restart and rpointer files RVIC would write for config. The
+    history is written after every slab. See unsupported for the configs
+    covered.
+    Parameters
+        1. config (dict): Convolution config
+        2. kernel (function): Computes the flow at the outlets, see
+            fft_convolve
+        3. params (dict): Arrays of the parameter file, see read_params.
+            Read from the parameter file of config when not given
+    """
+    options = config["OPTIONS"]
+    params = params or read_params(config["PARAM_FILE"]["FILE_NAME"])
+    if (
+        os.path.basename(config["DOMAIN"]["FILE_NAME"])
+        != params["attrs"]["RvicDomainFile"]
+    ):
+        raise ValueError("dom files do not match in parameter and domain file")
+
+    calendar = options["CALENDAR"]
+    dt = float(params["unit_hydrograph_dt"])
+    step = dt / SECSPERDAY
+    start = datetime.strptime(options["RUN_STARTDATE"], "%Y-%m-%d-%H")
+    start_ord = date2num(start, TIMEUNITS, calendar)
+    # RVIC runs up to and including the first timestep at or after STOP_DATE
+    stop_ord = date2num(
+        datetime.strptime(options["STOP_DATE"], "%Y-%m-%d"), TIMEUNITS, calendar
+    )
+    n_steps = max(1, int(np.ceil(round((stop_ord - start_ord) / step, 6)))) + 1
+    times = start_ord + np.arange(n_steps) * step
+
+    rest_ord = date2num(
+        datetime.strptime(options["REST_DATE"], "%Y-%m-%d"), TIMEUNITS, calendar
+    )
+    rest_step = (rest_ord - start_ord) / step
+    if rest_step == round(rest_step) and 1 <= rest_step < n_steps:
+        rest_step = int(round(rest_step))
+    else:
+        rest_step = None
+
+    initial = None
+    if options["RUN_TYPE"] == "startup":
+        initial = read_initial_state(config, params)
+
+    case_dir = options["CASE_DIR"]
+    for name in ("hist", "restarts"):
+        os.makedirs(os.path.join(case_dir, name), exist_ok=True)
+
+    with Dataset(config["DOMAIN"]["FILE_NAME"]) as ds:
+        ysize = ds.variables[config["DOMAIN"]["LAND_MASK_VAR"]].shape[0]
+    with Dataset(forcing_file(config)) as ds:
+        lats = ds.variables[config["INPUT_FORCINGS"]["LATITUDE_VAR"]][:]
+    outlet_y_ind = params["outlet_y_ind"]
+    if lats_ascend(lats):
+        outlet_y_ind = ysize - 1 - outlet_y_ind
+    end = num2date(start_ord + n_steps * step, TIMEUNITS, calendar)
+    hist_format = "%Y-%m-%d" if dt == SECSPERDAY else "%Y-%m-%d-%H"
+    hist_file = write_history(
+        os.path.join(
+            case_dir,
+            "hist",
+            end.strftime(f"{options['CASEID']}.rvic.h0a.{hist_format}.nc"),
+        ),
+        config,
+        params,
+        outlet_y_ind,
+    )
+
+    slab_steps, fft_bytes = slab_size(config, params, n_steps)
+    if kernel is fft_convolve:
+        # The spectra take what the slabs leave of the memory budget
+        kernel = partial(fft_convolve, max_bytes=fft_bytes)
+    # Slabs end at the restart step so the ring is taken after routing it
+    bounds = slab_bounds(
+        n_steps, slab_steps, [rest_step + 1] if rest_step is not None else []
+    )
+    multiplier = units_multiplier(config, params)
+    for first, flows, ring in route(
+        read_slabs(config, params, start_ord, bounds),
+        unit_hydrographs(params),
+        params["source2outlet_ind"],
+        len(params["outlet_y_ind"]),
+        kernel,
+        rest_step,
+    ):
+        if initial is not None:
+            # The ring holds the flow due after the last timestep of the state
+            carried = initial[first + 1 : first + 1 + len(flows)]
+            flows[: len(carried)] += carried
+        if ring is not None:
+            if initial is not None:
+                carried = initial[rest_step + 1 :]
+                ring[: len(carried)] += carried
+            with NETCDF_LOCK:
+                write_restart(
+                    os.path.join(case_dir, "restarts"),
+                    config,
+                    params,
+                    num2date(times[rest_step] + step, TIMEUNITS, calendar),
+                    ring,
+                )
+
+        flows *= multiplier
+        if np.isnan(flows).any():
+            raise ValueError(
+                "nan found in output field: streamflow, most likely there is a "
+                "nan/missing/fill value in the input forcings"
+            )
+        with NETCDF_LOCK:
+            append_history(hist_file, params, times[first : first + len(flows)], flows)
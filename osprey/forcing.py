@@ -0,0 +1,107 @@
+import numpy as np
+from datetime import timedelta
+from cftime import datetime as cfdatetime
+from netCDF4 import Dataset, date2num
+
+from .param_file import copy_variable
+
+
+def file_rows(rows, lats):
+    """
+    Convert a slice of rows counted from the north edge of a grid, as RVIC
+    counts them, to a slice of the rows of a file with latitudes lats.
+    """
+    if lats[-1] > lats[0]:
+        return slice(len(lats) - rows.stop, len(lats) - rows.start)
+    return rows
+
+
+def time_window(time_var, start=None, stop=None):
+    """
+    Return the slice of the records of time_var from start up to the end of
+    the day stop. start and stop are RVIC's RUN_STARTDATE (yyyy-mm-dd-hh)
+    and STOP_DATE (yyyy-mm-dd); either may be None to leave that end open.
+    """
+    calendar = getattr(time_var, "calendar", "standard")
+    times = time_var[:]
+    first, last = 0, len(times)
+    if start:
+        start = cfdatetime.strptime(start, "%Y-%m-%d-%H", calendar=calendar)
+        first = np.searchsorted(times, date2num(start, time_var.units, calendar))
+    if stop:
+        # Include the first record of the next day as a margin for the
+        # last timestep of the run
+        stop = cfdatetime.strptime(stop, "%Y-%m-%d", calendar=calendar)
+        stop_num = date2num(stop + timedelta(days=1), time_var.units, calendar)
+        last = np.searchsorted(times, stop_num, side="right")
+    return slice(int(first), int(max(last, first)))
+
+
+def write_forcing_subset(
+    forcing_file,
+    out_file,
+    fields,
+    time_var,
+    lat_var,
+    window,
+    start=None,
+    stop=None,
+    max_bytes=None,
+):
+    """
+    Copy the cells of a window of a forcing file's grid and the records from
+    start to stop, as far as RVIC convolution reads them: the time variable,
+    the forcing fields and the variables without a time axis. With an
+    OPeNDAP url only the subset is transferred. Time series are copied in
+    blocks of records of at most max_bytes.
+    Parameters
+        1. forcing_file (str): Path or url of the forcing file
+        2. out_file (str): Path of the subset
+        3. fields (list): Names of the forcing fields
+        4. time_var (str): Name of the time variable
+        5. lat_var (str): Name of the latitude variable
+        6. window (tuple): Row and column slices of the grid, with rows
+            counted from the north edge, or None for the whole grid
+        7. start, stop (str): RUN_STARTDATE and STOP_DATE of the run
+        8. max_bytes (int): Size of the blocks of records, None to copy
+            every variable at once
+    """
+    with Dataset(forcing_file) as ds:
+        y_dim, x_dim = ds.variables[fields[0]].dimensions[-2:]
+        time_dim = ds.variables[time_var].dimensions[0]
+        slices = {time_dim: time_window(ds.variables[time_var], start, stop)}
+        if window:
+            rows, cols = window
+            slices[y_dim] = file_rows(rows, ds.variables[lat_var][:])
+            slices[x_dim] = cols
+
+        with Dataset(out_file, "w", format=ds.data_model) as out:
+            out.setncatts({att: ds.getncattr(att) for att in ds.ncattrs()})
+            for name, dim in ds.dimensions.items():
+                size = len(range(len(dim))[slices.get(name, slice(None))])
+                out.createDimension(name, None if dim.isunlimited() else size)
+
+            for name, var in ds.variables.items():
+                # Other time series are left out
+                if time_dim in var.dimensions and name not in fields + [time_var]:
+                    continue
+                index = tuple(slices.get(dim, slice(None)) for dim in var.dimensions)
+                if time_dim not in var.dimensions:
+                    copy_variable(out, var, var[index] if index else var[...])
+                    continue
+
+                new = copy_variable(out, var, None)
+                axis = var.dimensions.index(time_dim)
+                records = range(len(ds.dimensions[time_dim]))[slices[time_dim]]
+                block = len(records) or 1
+                if max_bytes:
+                    cells = np.prod([n for i, n in enumerate(new.shape) if i != axis])
+                    block = max(1, int(max_bytes // (var.dtype.itemsize * cells)))
+                for first in range(0, len(records), block):
+                    block_records = records[first : first + block]
+                    source = slice(block_records.start, block_records.stop)
+                    target = slice(first, first + len(block_records))
+                    new[(slice(None),) * axis + (target,)] = var[
+                        index[:axis] + (source,) + index[axis + 1 :]
+                    ]
+    return out_file
@@ -0,0 +1,8 @@
+"""Gunicorn settings of the Docker image, see the Dockerfile."""
+
+from .engine import warm_up
+
+
+def post_worker_init(worker):
+    # Compile the numba kernel before the worker takes its first request
+    warm_up()
@@ -0,0 +1,185 @@
+import os
+
+import numpy as np
+from netCDF4 import Dataset, chartostring
+
+from .param_file import copy_variable
+
+
+def along(axis, index):
+    """Index of a variable that takes index along axis and all of the others."""
+    return (slice(None),) * axis + (index,)
+
+
+def record_blocks(var, axis, n_records, max_bytes=None):
+    """
+    Yield slices splitting n_records records of var along axis into blocks
+    of at most max_bytes, or a single block when max_bytes is None.
+    """
+    block = n_records or 1
+    if max_bytes:
+        cells = np.prod([n for i, n in enumerate(var.shape) if i != axis])
+        block = max(1, int(max_bytes // (var.dtype.itemsize * cells)))
+    for first in range(0, n_records, block):
+        yield slice(first, min(first + block, n_records))
+
+
+def concat_hist_files(hist_files, out_file, max_bytes=None):
+    """
+    Join RVIC history files covering consecutive, possibly overlapping,
+    periods along their time axis. Records of a file that are not later than
+    the last record already taken from the previous files are dropped, so a
+    run's spin up period is replaced by the previous run's output.
+    Parameters
+        1. hist_files (list): Paths to the history files, in time order
+        2. out_file (str): Path of the joined history file
+        3. max_bytes (int): Size of the blocks of records copied at once,
+            None to copy every variable at once
+    """
+    datasets = [Dataset(hist_file) for hist_file in hist_files]
+    try:
+        keep = []
+        last = -np.inf
+        for ds in datasets:
+            times = ds.variables["time"][:]
+            keep.append(times > last)
+            if len(times):
+                last = max(last, times.max())
+
+        # Metadata is taken from the latest file
+        latest = datasets[-1]
+        with Dataset(out_file, "w", format=latest.data_model) as out:
+            out.setncatts({att: latest.getncattr(att) for att in latest.ncattrs()})
+            for name, dim in latest.dimensions.items():
+                out.createDimension(name, None if dim.isunlimited() else len(dim))
+
+            for name, var in latest.variables.items():
+                if "time" not in var.dimensions:
+                    copy_variable(out, var, var[...])
+                    continue
+
+                new = copy_variable(out, var, None)
+                axis = var.dimensions.index("time")
+                done = 0
+                for ds, records in zip(datasets, keep):
+                    source = ds.variables[name]
+                    # Records are kept from the first one later than the
+                    # previous files on, as history times ascend
+                    first = int(np.argmax(records)) if records.any() else len(records)
+                    for block in record_blocks(
+                        source, axis, len(records) - first, max_bytes
+                    ):
+                        block = slice(first + block.start, first + block.stop)
+                        data = np.ma.compress(
+                            records[block], source[along(axis, block)], axis
+                        )
+                        new[along(axis, slice(done, done + data.shape[axis]))] = data
+                        done += data.shape[axis]
+    finally:
+        for ds in datasets:
+            ds.close()
+
+    return out_file
+
+
+def stack_hist_files(hist_files, out_file, members, max_bytes=None):
+    """
+    Stack RVIC history files of the same run driven by different forcings
+    into one file with an ensemble dimension.
+    Parameters
+        1. hist_files (list): Paths to the history files of the members
+        2. out_file (str): Path of the stacked history file
+        3. members (list): Names of the ensemble members
+        4. max_bytes (int): Size of the blocks of records copied at once,
+            None to copy every variable at once
+    """
+    datasets = [Dataset(hist_file) for hist_file in hist_files]
+    try:
+        first = datasets[0]
+        for ds in datasets[1:]:
+            if not np.array_equal(ds.variables["time"][:], first.variables["time"][:]):
+                raise ValueError(
+                    f"Cannot stack history files with different times: "
+                    f"{first.filepath()}, {ds.filepath()}"
+                )
+
+        with Dataset(out_file, "w", format=first.data_model) as out:
+            out.setncatts({att: first.getncattr(att) for att in first.ncattrs()})
+            for name, dim in first.dimensions.items():
+                out.createDimension(name, None if dim.isunlimited() else len(dim))
+
+            names = np.array(members, dtype="S")
+            names = names.view("S1").reshape(len(members), -1)
+            out.createDimension("ensemble", len(members))
+            out.createDimension("member_chars", names.shape[1])
+            member = out.createVariable(
+                "ensemble_member", "S1", ("ensemble", "member_chars")
+            )
+            member.long_name = "Name of the forcing dataset of the ensemble member"
+            member[:] = names
+
+            for name, var in first.variables.items():
+                if "time" in var.dimensions and not name.startswith("time"):
+                    # Routed fields get a leading ensemble axis
+                    new = copy_variable(out, var, None, ("ensemble",) + var.dimensions)
+                    axis = var.dimensions.index("time")
+                    for i, ds in enumerate(datasets):
+                        source = ds.variables[name]
+                        for block in record_blocks(
+                            source, axis, source.shape[axis], max_bytes
+                        ):
+                            new[(i,) + along(axis, block)] = source[along(axis, block)]
+                else:
+                    copy_variable(out, var, var[...])
+    finally:
+        for ds in datasets:
+            ds.close()
+
+    return out_file
+
+
+def unstack_hist_file(hist_file, out_dir, max_bytes=None):
+    """
+    Split a history file stacked by stack_hist_files into one history file
+    per ensemble member, named after the stacked file and the member. Routed
+    fields are copied in blocks of records of at most max_bytes.
+    Returns the paths of the member files, in ensemble order.
+    """
+    stem = os.path.splitext(os.path.basename(hist_file))[0]
+    os.makedirs(out_dir, exist_ok=True)
+    out_files = []
+    with Dataset(hist_file) as ds:
+        members = chartostring(ds.variables["ensemble_member"][:])
+        for i, member in enumerate(members):
+            out_file = os.path.join(out_dir, f"{stem}.{member}.nc")
+            with Dataset(out_file, "w", format=ds.data_model) as out:
+                out.setncatts({att: ds.getncattr(att) for att in ds.ncattrs()})
+                for name, dim in ds.dimensions.items():
+                    if name not in ("ensemble", "member_chars"):
+                        out.createDimension(
+                            name, None if dim.isunlimited() else len(dim)
+                        )
+
+                for name, var in ds.variables.items():
+                    if name == "ensemble_member":
+                        continue
+                    if var.dimensions[:1] == ("ensemble",):
+                        dimensions = var.dimensions[1:]
+                        new = copy_variable(out, var, None, dimensions)
+                        axis = dimensions.index("time")
+                        for block in record_blocks(
+                            new, axis, var.shape[axis + 1], max_bytes
+                        ):
+                            new[along(axis, block)] = var[(i,) + along(axis, block)]
+                    else:
+                        copy_variable(out, var, var[...])
+            out_files.append(out_file)
+    return out_files
+
+
+def set_outlet_indices(hist_file, outlet_y_ind, outlet_x_ind):
+    """Overwrite the grid indices of the outlets in a history file."""
+    with Dataset(hist_file, "a") as ds:
+        ds.variables["outlet_y_ind"][:] = outlet_y_ind
+        ds.variables["outlet_x_ind"][:] = outlet_x_ind
+    return hist_file
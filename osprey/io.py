@@ -42,9 +42,10 @@ case_id = LiteralInput(
 input_forcings = ComplexInput(
     "input_forcings",
     "Input Forcings",
-    abstract="Path to land data netCDF forcings",
+    abstract="Path to land data netCDF forcings. Several forcings are routed as an"
+    " ensemble and stacked along an ensemble dimension",
     min_occurs=1,
-    max_occurs=1,
+    max_occurs=100,
     supported_formats=[FORMATS.NETCDF, FORMATS.DODS],
 )
 
@@ -100,6 +101,71 @@ np = LiteralInput(
     data_type="integer",
 )
 
+split_basins = LiteralInput(
+    "split_basins",
+    "Split Basins",
+    default=False,
+    abstract="Develop parameters separately for every basin of the routing file's Basin_ID,"
+    " using np processors, and merge them into one parameter file",
+    data_type="boolean",
+)
+
+sparse_params = LiteralInput(
+    "sparse_params",
+    "Sparse Parameters",
+    default=False,
+    abstract="Store only the non-zero span of every unit hydrograph in the parameter file."
+    " Convolution reads both layouts",
+    data_type="boolean",
+)
+
+chunk_days = LiteralInput(
+    "chunk_days",
+    "Chunk Days",
+    default=0,
+    abstract="Split the convolution period into chunks of this many days convolved on np"
+    " processors. 0 convolves the whole period at once",
+    data_type="integer",
+)
+
+continue_run = LiteralInput(
+    "continue_run",
+    "Continue Run",
+    default=False,
+    abstract="Continue from the latest restart state kept for this case and parameter file."
+    " Only the period after it is convolved and the output holds the earlier history as well",
+    data_type="boolean",
+)
+
+convolution_engine = LiteralInput(
+    "convolution_engine",
+    "Convolution Engine",
+    default="rvic",
+    abstract="Engine running the convolution: rvic, numpy to convolve the forcings with"
+    " FFTs, or numba to accumulate them in a compiled loop, which suits short unit"
+    " hydrographs. Runs the other engines do not support are run by rvic",
+    allowed_values=["rvic", "numpy", "numba"],
+    data_type="string",
+)
+
+bypass_cache = LiteralInput(
+    "bypass_cache",
+    "Bypass Cache",
+    default=False,
+    abstract="Convolve even when an identical request has been convolved before, and"
+    " replace the cached output with the new one",
+    data_type="boolean",
+)
+
+param_file = ComplexInput(
+    "param_file",
+    "Parameter File",
+    abstract="Path to RVIC parameter file",
+    min_occurs=1,
+    max_occurs=1,
+    supported_formats=[FORMATS.NETCDF, FORMATS.DODS],
+)
+
 grid_id = LiteralInput(
     "grid_id",
     "GRID ID",
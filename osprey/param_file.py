@@ -0,0 +1,309 @@
+import shutil
+import numpy as np
+from netCDF4 import Dataset
+
+# Sparse parameter files store the non-zero span of every source's unit
+# hydrograph, one source after the other, instead of the padded array
+SPARSE_DIM = "unit_hydrograph_values"
+SPARSE_VARS = ("unit_hydrograph_start", "unit_hydrograph_count", SPARSE_DIM)
+
+# Dimensions that grow when parameter files for different outlets are merged
+OUTLET_DIMS = ("outlets", "sources", SPARSE_DIM)
+
+
+def read_outlets(param_file):
+    """Return the latitudes and longitudes of the outlets in a parameter file."""
+    with Dataset(param_file) as ds:
+        return ds.variables["outlet_lat"][:], ds.variables["outlet_lon"][:]
+
+
+def read_uh_length(param_file):
+    """Return the length in seconds of the unit hydrographs of a parameter file."""
+    with Dataset(param_file) as ds:
+        return float(
+            ds.variables["full_time_length"][...]
+            * ds.variables["unit_hydrograph_dt"][...]
+        )
+
+
+def merge_param_files(param_files, out_file, **global_atts):
+    """
+    Merge RVIC parameter files developed for separate sets of outlets into a
+    single parameter file. The files must share their unit hydrograph time
+    base, i.e. they were developed with the same ROUTING and SUBSET options.
+    Parameters
+        1. param_files (list): Paths to the parameter files to merge
+        2. out_file (str): Path of the merged parameter file
+        3. global_atts: Global attributes overriding those of the first file
+    """
+    datasets = [Dataset(param_file) for param_file in param_files]
+    try:
+        first = datasets[0]
+        for ds in datasets[1:]:
+            if is_sparse(ds) != is_sparse(first):
+                raise ValueError(
+                    "Cannot merge sparse and dense parameter files: "
+                    f"{first.filepath()}, {ds.filepath()}"
+                )
+            for dim in set(first.dimensions) - set(OUTLET_DIMS):
+                if len(ds.dimensions[dim]) != len(first.dimensions[dim]):
+                    raise ValueError(
+                        f"Cannot merge parameter files with different {dim} "
+                        f"dimensions: {first.filepath()}, {ds.filepath()}"
+                    )
+
+        with Dataset(out_file, "w", format=first.data_model) as out:
+            out.setncatts({att: first.getncattr(att) for att in first.ncattrs()})
+            out.setncatts(global_atts)
+
+            for name, dim in first.dimensions.items():
+                if name in OUTLET_DIMS:
+                    out.createDimension(
+                        name, sum(len(ds.dimensions[name]) for ds in datasets)
+                    )
+                else:
+                    out.createDimension(name, len(dim))
+
+            for name, var in first.variables.items():
+                copy_variable(out, var, merge_variable(datasets, name))
+    finally:
+        for ds in datasets:
+            ds.close()
+
+    return out_file
+
+
+def merge_variable(datasets, name):
+    """Stack one variable of a set of parameter files along its outlet axis."""
+    var = datasets[0].variables[name]
+    stacked = [dim for dim in var.dimensions if dim in OUTLET_DIMS]
+    if not stacked:
+        return var[...]
+
+    parts = []
+    n_outlets = 0
+    for ds in datasets:
+        data = ds.variables[name][...]
+        if name == "source2outlet_ind":
+            data = data + n_outlets
+        elif name == "outlet_number":
+            data = np.arange(len(data)) + n_outlets
+        parts.append(data)
+        n_outlets += len(ds.dimensions["outlets"])
+
+    return np.ma.concatenate(parts, axis=var.dimensions.index(stacked[0]))
+
+
+def copy_param_file(param_file, out_file):
+    """
+    Copy a parameter file to out_file through netCDF, so that parameter
+    files served over OPeNDAP can be copied as well as local ones.
+    """
+    with (
+        Dataset(param_file) as ds,
+        Dataset(out_file, "w", format=ds.data_model) as out,
+    ):
+        out.setncatts({att: ds.getncattr(att) for att in ds.ncattrs()})
+        for name, dim in ds.dimensions.items():
+            out.createDimension(name, None if dim.isunlimited() else len(dim))
+        for var in ds.variables.values():
+            copy_variable(out, var, var[...])
+    return out_file
+
+
+def copy_variable(out, var, data, dimensions=None, name=None, fill_value=None):
+    atts = {att: var.getncattr(att) for att in var.ncattrs() if att != "_FillValue"}
+    filters = var.filters() or {}
+    new = out.createVariable(
+        name or var.name,
+        var.datatype,
+        dimensions or var.dimensions,
+        zlib=filters.get("zlib", False),
+        complevel=filters.get("complevel", 4),
+        fill_value=(
+            fill_value if fill_value is not None else getattr(var, "_FillValue", None)
+        ),
+    )
+    new.setncatts(atts)
+    if data is not None:
+        new[...] = data
+    return new
+
+
+def uncrop_param_file(param_file, window, shape, lats_ascending):
+    """
+    Move the source and outlet indices of a parameter file developed on a
+    cropped domain back onto the full domain grid.
+    Parameters
+        1. param_file (str): Path of the parameter file, updated in place
+        2. window (tuple): Row and column slices of the crop in the domain file
+        3. shape (tuple): Shape of the full domain grid
+        4. lats_ascending (bool): Whether the domain file's latitudes ascend
+    """
+    rows, cols = window
+    # RVIC numbers rows from the north and decomposition indices from the
+    # first row of the file
+    y_offset = shape[0] - rows.stop if lats_ascending else rows.start
+    with Dataset(param_file, "a") as ds:
+        for point in ("source", "outlet"):
+            y_var, x_var, decomp_var = (
+                ds.variables[f"{point}_{ind}"]
+                for ind in ("y_ind", "x_ind", "decomp_ind")
+            )
+            ys = y_var[:].astype(np.int64) + y_offset
+            xs = x_var[:].astype(np.int64) + cols.start
+            file_ys = shape[0] - 1 - ys if lats_ascending else ys
+            y_var[:] = ys.astype(y_var.dtype)
+            x_var[:] = xs.astype(x_var.dtype)
+            decomp_var[:] = (file_ys * shape[1] + xs).astype(decomp_var.dtype)
+    return param_file
+
+
+def source_window(param_file):
+    """
+    Return the row and column slices of the smallest window of the domain
+    grid holding every source and outlet of a parameter file. Rows are
+    counted from the north edge of the grid, as RVIC stores them.
+    """
+    with Dataset(param_file) as ds:
+        ys = np.r_[ds.variables["source_y_ind"][:], ds.variables["outlet_y_ind"][:]]
+        xs = np.r_[ds.variables["source_x_ind"][:], ds.variables["outlet_x_ind"][:]]
+    return index_window(ys, xs)
+
+
+def index_window(ys, xs):
+    """Return the row and column slices of the smallest window holding ys, xs."""
+    return slice(int(ys.min()), int(ys.max()) + 1), slice(
+        int(xs.min()), int(xs.max()) + 1
+    )
+
+
+def crop_param_file(param_file, out_file, window):
+    """
+    Copy a parameter file, moving its source and outlet indices onto a
+    window of the domain grid given by source_window. Decomposition indices
+    are kept, RVIC only uses them to match state files to parameter files.
+    """
+    rows, cols = window
+    shutil.copyfile(param_file, out_file)
+    with Dataset(out_file, "a") as ds:
+        for point in ("source", "outlet"):
+            ds.variables[f"{point}_y_ind"][:] -= rows.start
+            ds.variables[f"{point}_x_ind"][:] -= cols.start
+    return out_file
+
+
+def is_sparse(ds):
+    """Whether an open parameter file stores its unit hydrographs sparsely."""
+    return SPARSE_DIM in ds.variables
+
+
+def is_sparse_param_file(param_file):
+    with Dataset(param_file) as ds:
+        return is_sparse(ds)
+
+
+def span_indices(start, count):
+    """
+    Return the timestep and source of every value of the spans starting at
+    start with count values each, in the order they are stored.
+    """
+    sources = np.repeat(np.arange(len(count)), count)
+    first_value = np.cumsum(count) - count
+    timesteps = np.arange(len(sources)) + np.repeat(start - first_value, count)
+    return timesteps, sources
+
+
+def read_unit_hydrograph(ds):
+    """
+    Return the (timesteps, sources, tracers) unit hydrographs of an open
+    parameter file, expanding them from a sparse file.
+    """
+    if not is_sparse(ds):
+        name = (
+            "unit_hydrograph_LIQ"
+            if "unit_hydrograph_LIQ" in ds.variables
+            else "unit_hydrograph"
+        )
+        return ds.variables[name][...]
+
+    start = np.asarray(ds.variables["unit_hydrograph_start"][:], dtype=np.int64)
+    count = np.asarray(ds.variables["unit_hydrograph_count"][:], dtype=np.int64)
+    values = np.ma.filled(ds.variables[SPARSE_DIM][...], 0)
+    uh = np.zeros(
+        (len(ds.dimensions["timesteps"]), len(start), values.shape[1]), values.dtype
+    )
+    uh[span_indices(start, count)] = values
+    return uh
+
+
+def sparsify_param_file(param_file, out_file):
+    """
+    Copy an RVIC parameter file, storing only the span between the first and
+    last non-zero timestep of every source's unit hydrograph. Each source
+    gets the timestep its span starts at and its length, the values of all
+    spans are stored one after the other. read_unit_hydrograph expands them.
+    """
+    with Dataset(param_file) as ds:
+        if is_sparse(ds):
+            shutil.copyfile(param_file, out_file)
+            return out_file
+
+        var = ds.variables["unit_hydrograph"]
+        uh = np.ma.filled(var[...], 0)
+        nonzero = (uh != 0).any(axis=2)
+        used = nonzero.any(axis=0)
+        start = np.where(used, nonzero.argmax(axis=0), 0)
+        stop = np.where(used, len(nonzero) - nonzero[::-1].argmax(axis=0), 0)
+        count = stop - start
+
+        with Dataset(out_file, "w", format=ds.data_model) as out:
+            out.setncatts({att: ds.getncattr(att) for att in ds.ncattrs()})
+            for name, dim in ds.dimensions.items():
+                out.createDimension(name, None if dim.isunlimited() else len(dim))
+            out.createDimension(SPARSE_DIM, int(count.sum()))
+            for name, other in ds.variables.items():
+                if name != "unit_hydrograph":
+                    copy_variable(out, other, other[...])
+
+            for name, data in (
+                ("unit_hydrograph_start", start),
+                ("unit_hydrograph_count", count),
+            ):
+                new = out.createVariable(name, "i4", ("sources",))
+                new[:] = data
+            copy_variable(
+                out,
+                var,
+                uh[span_indices(start, count)],
+                (SPARSE_DIM, var.dimensions[2]),
+                SPARSE_DIM,
+            )
+    return out_file
+
+
+def densify_param_file(param_file, out_file):
+    """Write the padded unit hydrograph array RVIC reads for a sparse parameter file."""
+    with Dataset(param_file) as ds:
+        if not is_sparse(ds):
+            shutil.copyfile(param_file, out_file)
+            return out_file
+
+        with Dataset(out_file, "w", format=ds.data_model) as out:
+            out.setncatts({att: ds.getncattr(att) for att in ds.ncattrs()})
+            for name, dim in ds.dimensions.items():
+                if name != SPARSE_DIM:
+                    out.createDimension(name, None if dim.isunlimited() else len(dim))
+            for name, var in ds.variables.items():
+                if name not in SPARSE_VARS:
+                    copy_variable(out, var, var[...])
+
+            var = ds.variables[SPARSE_DIM]
+            copy_variable(
+                out,
+                var,
+                read_unit_hydrograph(ds),
+                ("timesteps", "sources", var.dimensions[1]),
+                "unit_hydrograph",
+            )
+    return out_file
@@ -2,10 +2,12 @@ from .wps_convert import Convert
 from .wps_convolution import Convolution
 from .wps_parameters import Parameters
 from .wps_full_rvic import FullRVIC
+from .wps_extend_parameters import ExtendParameters
 
 processes = [
     Convert(),
     Convolution(),
     Parameters(),
     FullRVIC(),
+    ExtendParameters(),
 ]
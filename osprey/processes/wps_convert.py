@@ -9,8 +9,10 @@ from wps_tools.logging import log_handler, common_status_percentages
 from wps_tools.io import nc_output, log_level
 from osprey.utils import (
     logger,
+    check_unmodified,
     get_outfile,
     collect_args_wrapper,
+    input_fingerprints,
 )
 from osprey.io import domain
 import os
@@ -68,9 +70,14 @@ class Convert(Process):
         )
 
     def edit_config_file(self, config_file, uhs_files, station_file, domain):
+        # Inputs are read in place, so copies in the work directory are edited
+        edit_dir = os.path.join(self.workdir, "edited")
+        os.makedirs(edit_dir, exist_ok=True)
+
         with open(station_file, "r") as f:
             data = f.readlines()
         data[1] = uhs_files
+        station_file = os.path.join(edit_dir, os.path.basename(station_file))
         with open(station_file, "w") as f:
             f.writelines(data)
 
@@ -93,7 +100,10 @@ class Convert(Process):
                 f"{type(e).__name__}: Invalid header or config key in config file"
             )
 
-        processed = ".".join(unprocessed.split(".")[:-1]) + "_edited.cfg"
+        processed = os.path.join(
+            edit_dir,
+            ".".join(os.path.basename(unprocessed).split(".")[:-1]) + "_edited.cfg",
+        )
         with open(processed, "w") as cfg:
             parser.write(cfg)
 
@@ -101,7 +111,11 @@ class Convert(Process):
 
     def _handler(self, request, response):
         loglevel, uhs_files, station_file, domain, config_file = collect_args_wrapper(
-            request, self.workdir
+            request, self.workdir, response=response
+        )
+        # Local inputs are read in place and must not change during the run
+        fingerprints = input_fingerprints(
+            [uhs_files, station_file, domain, config_file]
         )
 
         log_handler(
@@ -135,6 +149,7 @@ class Convert(Process):
         )
         try:
             convert(config_file)
+            check_unmodified(fingerprints)
         except Exception as e:
             raise ProcessError(f"{type(e).__name__}: {e}")
 
@@ -1,4 +1,4 @@
-from pywps import Process, ComplexInput, LiteralInput, ComplexOutput, Format, FORMATS
+from pywps import Process, LiteralInput, ComplexOutput, Format
 from pywps.app.Common import Metadata
 from pywps.app.exceptions import ProcessError
 
@@ -11,8 +11,14 @@ from osprey.utils import (
     get_outfile,
     collect_args_wrapper,
     convolve_config_handler,
+    input_paths,
+    input_fingerprints,
+    check_unmodified,
+    download_status,
+    run_convolution,
 )
 from osprey import io
+import os
 
 
 class Convolution(Process):
@@ -23,18 +29,16 @@ class Convolution(Process):
         )
         inputs = [
             log_level,
+            io.np,
+            io.chunk_days,
+            io.continue_run,
+            io.convolution_engine,
+            io.bypass_cache,
             io.case_id,
             io.run_startdate,
             io.stop_date,
             io.domain,
-            ComplexInput(
-                "param_file",
-                "Parameter File",
-                abstract="Path to RVIC parameter file",
-                min_occurs=1,
-                max_occurs=1,
-                supported_formats=[FORMATS.NETCDF, FORMATS.DODS],
-            ),
+            io.param_file,
             io.input_forcings,
             io.convolve_config_file,
             io.convolve_config_dict,
@@ -58,15 +62,31 @@ class Convolution(Process):
     def _handler(self, request, response):
         (
             loglevel,
+            np,
+            chunk_days,
+            continue_run,
+            convolution_engine,
+            bypass_cache,
             case_id,
             run_startdate,
             stop_date,
             domain,
             param_file,
-            input_forcings,
             convolve_config_file,
             convolve_config_dict,
-        ) = collect_args_wrapper(request, self.workdir, modules=[convolution.__name__])
+        ) = collect_args_wrapper(
+            request,
+            self.workdir,
+            modules=[convolution.__name__],
+            response=response,
+            deferred=["input_forcings"],
+        )
+        # Every occurrence of input_forcings is an ensemble member
+        input_forcings = input_paths(
+            request.inputs["input_forcings"],
+            os.path.join(self.workdir, "forcings"),
+            download_status(response),
+        )
 
         log_handler(
             self,
@@ -92,7 +112,7 @@ class Convolution(Process):
             stop_date,
             domain,
             param_file,
-            input_forcings,
+            input_forcings[0],
             convolve_config_file,
             convolve_config_dict,
         )
@@ -105,8 +125,19 @@ class Convolution(Process):
             log_level=loglevel,
             process_step="process",
         )
+        # Local inputs are read in place and must not change during the run
+        fingerprints = input_fingerprints([domain, param_file, *input_forcings])
         try:
-            convolution(config)
+            run_convolution(
+                config,
+                np,
+                chunk_days,
+                input_forcings,
+                continue_run,
+                convolution_engine,
+                bypass_cache,
+            )
+            check_unmodified(fingerprints)
         except Exception as e:
             raise ProcessError(f"{type(e).__name__}: {e}")
 
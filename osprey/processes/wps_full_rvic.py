@@ -13,15 +13,25 @@ from rvic.convolution import convolution
 from rvic.parameters import parameters
 
 from tempfile import NamedTemporaryFile
+import os
 from pywps.app.Common import Metadata
 from pywps.app.exceptions import ProcessError
 from osprey.utils import (
     logger,
+    check_unmodified,
+    input_fingerprints,
     get_outfile,
     collect_args_wrapper,
     convolve_config_handler,
+    download_status,
     params_config_handler,
+    read_params,
+    run_convolution,
+    run_parameters,
     prep_csv,
+    scenario_meta_link,
+    snap_pour_points,
+    stage_forcings,
 )
 from osprey import io
 from wps_tools.logging import log_handler, common_status_percentages
@@ -44,6 +54,10 @@ class FullRVIC(Process):
             log_level,
             io.version,
             io.np,
+            io.split_basins,
+            io.chunk_days,
+            io.convolution_engine,
+            io.bypass_cache,
             io.case_id,
             io.grid_id,
             io.run_startdate,
@@ -60,6 +74,13 @@ class FullRVIC(Process):
         ]
         outputs = [
             nc_output,
+            ComplexOutput(
+                "scenario_outputs",
+                "Scenario Outputs",
+                abstract="Metalink listing one history file for every forcing scenario",
+                as_reference=True,
+                supported_formats=[FORMATS.META4],
+            ),
         ]
 
         super(FullRVIC, self).__init__(
@@ -82,6 +103,10 @@ class FullRVIC(Process):
             loglevel,
             version,
             np,
+            split_basins,
+            chunk_days,
+            convolution_engine,
+            bypass_cache,
             case_id,
             grid_id,
             run_startdate,
@@ -90,13 +115,25 @@ class FullRVIC(Process):
             uh_box,
             routing,
             domain,
-            input_forcings,
             params_config_file,
             params_config_dict,
             convolve_config_file,
             convolve_config_dict,
         ) = collect_args_wrapper(
-            request, self.workdir, modules=[parameters.__name__, convolution.__name__]
+            request,
+            self.workdir,
+            modules=[parameters.__name__, convolution.__name__],
+            response=response,
+            deferred=["input_forcings"],
+        )
+        # Local inputs are read in place and must not change during the run
+        fingerprints = input_fingerprints([routing, domain])
+        # Every occurrence of input_forcings is an ensemble member, fetched
+        # while the parameters are developed
+        staged_forcings = stage_forcings(
+            request.inputs["input_forcings"],
+            os.path.join(self.workdir, "forcings"),
+            download_status(response),
         )
 
         log_handler(
@@ -142,6 +179,7 @@ class FullRVIC(Process):
                 params_config_file,
                 params_config_dict,
             )
+            snap_pour_points(params_config)
 
             log_handler(
                 self,
@@ -152,7 +190,9 @@ class FullRVIC(Process):
                 process_step="params_process",
             )
             try:
-                parameters(params_config, np)
+                # A resubmitted request gets the parameter file of the failed
+                # one from the parameters cache
+                run_parameters(params_config, np, split_basins)
             except Exception as e:
                 raise ProcessError(f"{type(e).__name__}: {e}")
 
@@ -174,6 +214,12 @@ class FullRVIC(Process):
             log_level=loglevel,
             process_step="convolve_config_rebuild",
         )
+        try:
+            input_forcings = staged_forcings.result()
+        except Exception as e:
+            raise ProcessError(f"{type(e).__name__}: {e}")
+        fingerprints.update(input_fingerprints(input_forcings))
+
         convolve_config = convolve_config_handler(
             self.workdir,
             case_id,
@@ -181,7 +227,7 @@ class FullRVIC(Process):
             stop_date,
             domain,
             params_file,
-            input_forcings,
+            input_forcings[0],
             convolve_config_file,
             convolve_config_dict,
         )
@@ -194,8 +240,30 @@ class FullRVIC(Process):
             log_level=loglevel,
             process_step="convolution_process",
         )
+        first = self.status_percentage_steps["convolution_process"]
+        last = self.status_percentage_steps["build_output"]
+
+        def scenario_progress(done, total, name):
+            response.update_status(
+                f"Convolved scenario {name or case_id} ({done} of {total})",
+                first + (last - first) * done // total,
+            )
+
         try:
-            convolution(convolve_config)
+            # The parameter file RVIC wrote is read back once for the numpy and
+            # numba engines, rather than cropped and read by every member and chunk
+            params = read_params(params_file) if convolution_engine != "rvic" else None
+            run_convolution(
+                convolve_config,
+                np,
+                chunk_days,
+                input_forcings,
+                engine=convolution_engine,
+                bypass_cache=bypass_cache,
+                params=params,
+                progress=scenario_progress,
+            )
+            check_unmodified(fingerprints)
         except Exception as e:
             raise ProcessError(f"{type(e).__name__}: {e}")
 
@@ -207,7 +275,11 @@ class FullRVIC(Process):
             log_level=loglevel,
             process_step="build_output",
         )
-        response.outputs["output"].file = get_outfile(convolve_config, "hist")
+        hist_file = get_outfile(convolve_config, "hist")
+        response.outputs["output"].file = hist_file
+        response.outputs["scenario_outputs"].data = scenario_meta_link(
+            self.workdir, hist_file, len(input_forcings)
+        )
 
         log_handler(
             self,
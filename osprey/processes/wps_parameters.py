@@ -20,10 +20,14 @@ from wps_tools.io import (
 )
 from osprey.utils import (
     logger,
+    check_unmodified,
     get_outfile,
     collect_args_wrapper,
+    input_fingerprints,
     params_config_handler,
+    run_parameters,
     prep_csv,
+    snap_pour_points,
 )
 from osprey import io
 
@@ -40,6 +44,8 @@ class Parameters(Process):
         inputs = [
             log_level,
             io.np,
+            io.split_basins,
+            io.sparse_params,
             io.version,
             io.case_id,
             io.grid_id,
@@ -74,6 +80,8 @@ class Parameters(Process):
         (
             loglevel,
             np,
+            split_basins,
+            sparse_params,
             version,
             case_id,
             grid_id,
@@ -83,7 +91,11 @@ class Parameters(Process):
             domain,
             params_config_file,
             params_config_dict,
-        ) = collect_args_wrapper(request, self.workdir, modules=[parameters.__name__])
+        ) = collect_args_wrapper(
+            request, self.workdir, modules=[parameters.__name__], response=response
+        )
+        # Local inputs are read in place and must not change during the run
+        fingerprints = input_fingerprints([routing, domain, params_config_file])
 
         log_handler(
             self,
@@ -128,6 +140,7 @@ class Parameters(Process):
                 params_config_file,
                 params_config_dict,
             )
+            snap_pour_points(config)
 
             log_handler(
                 self,
@@ -138,7 +151,8 @@ class Parameters(Process):
                 process_step="process",
             )
             try:
-                parameters(config, np)
+                run_parameters(config, np, split_basins, sparse_params)
+                check_unmodified(fingerprints)
             except Exception as e:
                 raise ProcessError(f"{type(e).__name__}: {e}")
 
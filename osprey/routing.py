@@ -0,0 +1,479 @@
+import csv
+import json
+import os
+import numpy as np
+from collections import OrderedDict
+from netCDF4 import Dataset, default_fillvals
+from tempfile import TemporaryDirectory
+
+from .cache import FileCache, hash_file
+from .param_file import copy_variable, read_outlets
+
+GRID_INDEX_FILE = "grid_index.npz"
+
+# Row and column offsets of RVIC's flow directions on a grid with descending
+# latitudes, keyed by VIC (1-8) and ARCMAP (1-128) direction codes
+VIC_DIRECTIONS = {
+    1: (-1, 0),
+    2: (-1, 1),
+    3: (0, 1),
+    4: (1, 1),
+    5: (1, 0),
+    6: (1, -1),
+    7: (0, -1),
+    8: (-1, -1),
+}
+ARCMAP_DIRECTIONS = {
+    64: (-1, 0),
+    128: (-1, 1),
+    1: (0, 1),
+    2: (1, 1),
+    4: (1, 0),
+    8: (1, -1),
+    16: (0, -1),
+    32: (-1, -1),
+}
+
+
+def read_pour_points(pour_points_file):
+    """
+    Read an RVIC pour points file.
+    Returns the header and the rows of the file; comment lines are skipped.
+    """
+    with open(pour_points_file, newline="") as f:
+        lines = [line for line in f if line.strip() and not line.startswith("#")]
+    if not lines:
+        raise ValueError(f"Pour Points File {pour_points_file} is empty")
+    header, *rows = list(csv.reader(lines))
+    return [name.strip() for name in header], rows
+
+
+def nearest_index(axis, values):
+    """
+    Return the index of the nearest coordinate on a monotonic axis for every
+    value. Uses a binary search so large grids and many values stay cheap.
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(axis) == 1:
+        return np.zeros(values.shape, dtype=int)
+
+    descending = axis[0] > axis[-1]
+    ordered = axis[::-1] if descending else axis
+    right = np.clip(np.searchsorted(ordered, values), 1, len(ordered) - 1)
+    left = right - 1
+    index = np.where(values - ordered[left] <= ordered[right] - values, left, right)
+    return len(axis) - 1 - index if descending else index
+
+
+def astronomical_lons(lons):
+    """Use negative longitudes west of Greenwich, as RVIC does."""
+    lons = np.array(lons, dtype=np.float64)
+    lons[lons > 180] -= 360
+    return lons
+
+
+class GridIndex:
+    """
+    Grid hash over the valid cells of a routing or domain file.
+
+    Regular lat/lon grids are indexed by their axes, so finding the cell of a
+    point is a binary search. Points falling on invalid cells are snapped to
+    the nearest valid cell within a search window. The index is small enough
+    to be persisted next to the cache entry of the file it was built from.
+    """
+
+    def __init__(self, lats, lons, valid):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = astronomical_lons(lons)
+        self.valid = np.asarray(valid, dtype=bool)
+        self.resolution = np.abs(self.lons[1] - self.lons[0]) if len(lons) > 1 else 1
+
+    @classmethod
+    def from_netcdf(cls, nc_file, lat_var, lon_var, valid_var):
+        """Index the cells of nc_file where valid_var is positive."""
+        with Dataset(nc_file) as ds:
+            valid = np.ma.filled(ds.variables[valid_var][:], 0) > 0
+            return cls(ds.variables[lat_var][:], ds.variables[lon_var][:], valid)
+
+    @classmethod
+    def load(cls, directory):
+        with np.load(os.path.join(directory, GRID_INDEX_FILE)) as index:
+            return cls(
+                index["lats"],
+                index["lons"],
+                np.unpackbits(index["valid"], count=index["shape"].prod()).reshape(
+                    index["shape"]
+                ),
+            )
+
+    def save(self, directory):
+        index_file = os.path.join(directory, GRID_INDEX_FILE)
+        np.savez_compressed(
+            index_file,
+            lats=self.lats,
+            lons=self.lons,
+            valid=np.packbits(self.valid),
+            shape=np.array(self.valid.shape),
+        )
+        return [index_file]
+
+    def cells(self, plats, plons):
+        """Return the (y, x) indices of the cells containing the points."""
+        return nearest_index(self.lats, plats), nearest_index(
+            self.lons, astronomical_lons(plons)
+        )
+
+    def snap(self, plats, plons, max_cells=1.5):
+        """
+        Move every point to the centre of the nearest valid cell.
+        Returns the y and x indices of the snapped cells and a mask of the
+        points that have no valid cell within max_cells grid cells.
+        """
+        plats = np.asarray(plats, dtype=np.float64)
+        plons = astronomical_lons(plons)
+        ys, xs = self.cells(plats, plons)
+        radius = int(np.ceil(max_cells))
+
+        for i in np.nonzero(~self.valid[ys, xs])[0]:
+            y0, x0 = max(ys[i] - radius, 0), max(xs[i] - radius, 0)
+            window = self.valid[y0 : ys[i] + radius + 1, x0 : xs[i] + radius + 1]
+            wys, wxs = np.nonzero(window)
+            if len(wys):
+                nearest = np.hypot(
+                    self.lats[wys + y0] - plats[i], self.lons[wxs + x0] - plons[i]
+                ).argmin()
+                ys[i], xs[i] = wys[nearest] + y0, wxs[nearest] + x0
+
+        # Points off the edge of the grid are clamped to an edge cell, so the
+        # distance to the chosen cell is checked for every point
+        distance = np.hypot(self.lats[ys] - plats, self.lons[xs] - plons)
+        rejected = ~self.valid[ys, xs] | (distance > max_cells * self.resolution)
+        return ys, xs, rejected
+
+
+class UpstreamIndex:
+    """
+    Flow network of a routing file: the downstream cell and the basin of every
+    cell and the set of cells upstream of it.
+
+    Cells are numbered in row-major order of the routing file. The cells are
+    stored in depth-first order of the flow network, so the cells upstream of
+    cell c (c included) are order[start[c]:end[c]] and the whole index takes
+    a few integers per cell. The arrays are saved as .npy files and memory
+    mapped on load, so only the pages of the queried basins are read.
+
+    Flow paths follow RVIC's catchment search: a path stops where it leaves
+    the grid or the basin of its cell, or at a cell without a flow direction.
+    """
+
+    ARRAYS = ("shape", "downstream", "basin", "order", "start", "end")
+
+    def __init__(self, shape, downstream, basin, order, start, end):
+        self.shape = tuple(int(n) for n in shape)
+        self.downstream = downstream
+        self.basin = basin
+        self.order = order
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def from_netcdf(cls, nc_file, lat_var, flow_direction_var, basin_id_var):
+        with Dataset(nc_file) as ds:
+            lats = ds.variables[lat_var][:]
+            fdr_var = ds.variables[flow_direction_var]
+            fdr = np.ma.filled(fdr_var[:], 0).astype(np.int64)
+            basin = np.ma.filled(ds.variables[basin_id_var][:], -1).astype(np.int64)
+            vic = "VIC" in fdr_var.ncattrs() or fdr.max() < 10
+
+        # RVIC's direction offsets assume latitudes run north to south
+        flip = -1 if lats[-1] > lats[0] else 1
+        directions = VIC_DIRECTIONS if vic else ARCMAP_DIRECTIONS
+        ny, nx = fdr.shape
+        ys, xs = np.indices(fdr.shape)
+        to_y, to_x = np.full(fdr.shape, -1), np.full(fdr.shape, -1)
+        for code, (dy, dx) in directions.items():
+            cells = fdr == code
+            to_y[cells] = ys[cells] + flip * dy
+            to_x[cells] = xs[cells] + dx
+
+        on_grid = (to_y >= 0) & (to_y < ny) & (to_x >= 0) & (to_x < nx)
+        to_cell = np.where(on_grid, to_y * nx + to_x, 0)
+        basin = basin.ravel()
+        downstream = np.where(
+            on_grid.ravel() & (basin >= 0) & (basin[to_cell.ravel()] == basin),
+            to_cell.ravel(),
+            -1,
+        )
+        return cls(fdr.shape, downstream, basin, *flow_tree(downstream))
+
+    @classmethod
+    def load(cls, directory):
+        return cls(
+            *(
+                np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+                for name in cls.ARRAYS
+            )
+        )
+
+    def save(self, directory):
+        paths = []
+        for name in self.ARRAYS:
+            paths.append(os.path.join(directory, f"{name}.npy"))
+            np.save(paths[-1], np.asarray(getattr(self, name)))
+        return paths
+
+    def upstream(self, y, x):
+        """Return the (y, x) indices of the cells draining to cell (y, x)."""
+        cell = y * self.shape[1] + x
+        return np.unravel_index(
+            np.asarray(self.order[self.start[cell] : self.end[cell]]), self.shape
+        )
+
+    def upstream_count(self, ys, xs):
+        """Return the number of cells draining to every cell (ys, xs)."""
+        cells = np.ravel_multi_index((ys, xs), self.shape)
+        return np.asarray(self.end[cells]) - np.asarray(self.start[cells])
+
+    def catchment_mask(self, ys, xs):
+        """Return a grid mask of the cells draining to any of the cells (ys, xs)."""
+        cells = np.ravel_multi_index((ys, xs), self.shape)
+        depth = np.zeros(len(self.order) + 1, dtype=np.int64)
+        np.add.at(depth, self.start[cells], 1)
+        np.add.at(depth, self.end[cells], -1)
+        mask = np.zeros(len(self.order), dtype=bool)
+        mask[np.asarray(self.order)[np.cumsum(depth[:-1]) > 0]] = True
+        return mask.reshape(self.shape)
+
+
+def flow_tree(downstream):
+    """
+    Lay out the flow network given by each cell's downstream cell (-1 for
+    outlets) in depth-first order. Returns order, start and end such that the
+    cells upstream of cell c are order[start[c]:end[c]].
+    """
+    n = len(downstream)
+    has_downstream = downstream >= 0
+
+    # Distance to the outlet of every cell, by pointer jumping
+    depth = has_downstream.astype(np.int64)
+    jump = downstream.copy()
+    for _ in range(int(np.log2(max(n, 2))) + 2):
+        jumping = jump >= 0
+        if not jumping.any():
+            break
+        depth[jumping] += depth[jump[jumping]]
+        jump[jumping] = jump[jump[jumping]]
+    else:
+        raise ValueError("Flow directions form a loop")
+
+    # Sort every level by downstream cell so that siblings are adjacent
+    levels = np.lexsort((downstream, depth))
+    level_bounds = np.searchsorted(depth[levels], np.arange(depth.max() + 2))
+
+    size = np.ones(n, dtype=np.int64)
+    for level in range(depth.max(), 0, -1):
+        cells = levels[level_bounds[level] : level_bounds[level + 1]]
+        np.add.at(size, downstream[cells], size[cells])
+
+    start = np.zeros(n, dtype=np.int64)
+    roots = levels[: level_bounds[1]]
+    start[roots] = np.cumsum(size[roots]) - size[roots]
+    for level in range(1, depth.max() + 1):
+        cells = levels[level_bounds[level] : level_bounds[level + 1]]
+        parents = downstream[cells]
+        # Offset of every cell after its earlier siblings
+        offset = np.cumsum(size[cells]) - size[cells]
+        first = np.r_[True, parents[1:] != parents[:-1]]
+        offset -= np.maximum.accumulate(np.where(first, offset, 0))
+        start[cells] = start[parents] + 1 + offset
+
+    order = np.empty(n, dtype=np.int64)
+    order[start] = np.arange(n)
+    return order, start, start + size
+
+
+def load_index(index_class, nc_file, *args):
+    """
+    Build the index_class index of nc_file, or reuse the one persisted in the
+    indexes cache when the file has been indexed before. The cache key is the
+    identity of the file, see file_identity, and args, which are passed to
+    index_class.from_netcdf.
+    """
+    cache = FileCache.from_config("indexes")
+    if not cache:
+        return index_class.from_netcdf(nc_file, *args)
+
+    # Identify the file without reading it, so a cached index is found in
+    # milliseconds
+    digest = hash_file(nc_file, max_content=0)
+    digest.update(json.dumps([index_class.__name__, args], default=str).encode())
+    key = digest.hexdigest()
+    with cache.open(key) as entry:
+        if entry:
+            return index_class.load(entry)
+
+    index = index_class.from_netcdf(nc_file, *args)
+    with TemporaryDirectory() as tmpdir:
+        cache.put(key, index.save(tmpdir))
+    return index
+
+
+def pour_point_cells(header, rows, lats, lons):
+    """
+    Locate pour points on a routing grid.
+    Pour points are given either as (lons, lats) or as grid indices (x, y),
+    the same way RVIC reads them.
+    """
+    columns = {name: [row[i] for row in rows] for i, name in enumerate(header)}
+    if "x" in columns and "y" in columns:
+        ys = np.array(columns["y"], dtype=int)
+        if lats[-1] > lats[0]:
+            # RVIC flips the routing grid to descending latitudes before it
+            # looks up (x, y)
+            ys = len(lats) - 1 - ys
+        return ys, np.array(columns["x"], dtype=int)
+    elif "lons" in columns and "lats" in columns:
+        return nearest_index(lats, columns["lats"]), nearest_index(
+            lons, columns["lons"]
+        )
+    raise ValueError("Pour Points File must include variables (lons, lats) or (x, y)")
+
+
+def basin_groups(pour_points_file, routing_file, routing_config):
+    """
+    Split the pour points into groups that drain unconnected basins.
+    Parameters
+        1. pour_points_file (str): Path to the RVIC pour points file
+        2. routing_file (str): Path or url of the routing netCDF
+        3. routing_config (dict): ROUTING section of the parameters config
+    Returns the pour points header and an OrderedDict mapping each Basin_ID to
+    the pour point rows inside that basin.
+    """
+    header, rows = read_pour_points(pour_points_file)
+    with Dataset(routing_file) as routing:
+        lats = routing.variables[routing_config["LATITUDE_VAR"]][:]
+        lons = routing.variables[routing_config["LONGITUDE_VAR"]][:]
+        ys, xs = pour_point_cells(header, rows, lats, lons)
+        basin_ids = routing.variables[routing_config["BASIN_ID_VAR"]][:][ys, xs]
+
+    groups = OrderedDict()
+    for row, basin_id in zip(rows, np.ma.filled(basin_ids, -1)):
+        groups.setdefault(int(basin_id), []).append(row)
+    return header, groups
+
+
+def new_pour_points(pour_points_file, param_file, routing_file, routing_config):
+    """
+    Select the pour points that do not drain to an outlet of an existing
+    parameter file. Pour points and outlets are compared by the routing
+    cell they fall in.
+    Returns the pour points header and the rows of the new pour points.
+    """
+    header, rows = read_pour_points(pour_points_file)
+    with Dataset(routing_file) as routing:
+        lats = routing.variables[routing_config["LATITUDE_VAR"]][:]
+        lons = routing.variables[routing_config["LONGITUDE_VAR"]][:]
+    ys, xs = pour_point_cells(header, rows, lats, lons)
+
+    outlet_lats, outlet_lons = read_outlets(param_file)
+    existing = set(
+        zip(nearest_index(lats, outlet_lats), nearest_index(lons, outlet_lons))
+    )
+    return header, [row for row, y, x in zip(rows, ys, xs) if (y, x) not in existing]
+
+
+def write_pour_points(pour_points_file, header, rows):
+    with open(pour_points_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def grid_window(mask, pad=1):
+    """Return the row and column slices of the bounding box of mask, padded."""
+    ys, xs = np.nonzero(mask)
+    return (
+        slice(max(ys.min() - pad, 0), min(ys.max() + pad + 1, mask.shape[0])),
+        slice(max(xs.min() - pad, 0), min(xs.max() + pad + 1, mask.shape[1])),
+    )
+
+
+def covering_window(nc_file, lat_var, lon_var, lats, lons, pad=1):
+    """
+    Find the window of the grid of nc_file covering a set of coordinates.
+    Returns the row and column slices of the window, the shape of the grid
+    and whether its latitudes ascend.
+    """
+    with Dataset(nc_file) as ds:
+        grid_lats = ds.variables[lat_var][:]
+        grid_lons = ds.variables[lon_var][:]
+    ys = nearest_index(grid_lats, [np.min(lats), np.max(lats)])
+    xs = nearest_index(astronomical_lons(grid_lons), astronomical_lons(lons))
+    mask = np.zeros((len(grid_lats), len(grid_lons)), dtype=bool)
+    mask[ys.min() : ys.max() + 1, xs.min() : xs.max() + 1] = True
+    return grid_window(mask, pad), mask.shape, bool(grid_lats[-1] > grid_lats[0])
+
+
+def crop_pour_points(header, rows, ys, xs, lats, window):
+    """
+    Move the (x, y) grid indices of pour points onto a window of the routing
+    grid. ys and xs are the cells of the pour points in the routing file and
+    lats its latitudes.
+    """
+    y_col, x_col = header.index("y"), header.index("x")
+    if lats[-1] > lats[0]:
+        # RVIC counts rows from the north edge of the grid
+        ys = window[0].stop - 1 - ys
+    else:
+        ys = ys - window[0].start
+    cropped = []
+    for row, y, x in zip(rows, ys, xs - window[1].start):
+        row = list(row)
+        row[y_col], row[x_col] = str(y), str(x)
+        cropped.append(row)
+    return cropped
+
+
+def write_subset(nc_file, out_file, lat_var, lon_var, window=None, masked=None):
+    """
+    Copy a routing or domain file, optionally cropped to a window of
+    (row, column) slices. masked maps variable names to a grid mask of the
+    cells to keep; their other cells are written as the variable's
+    _FillValue, or netCDF's default fill value when it has none, so they
+    are read back masked. RVIC limits its catchment search and unit
+    hydrograph grids to the cells sharing the outlet's Basin_ID, and a
+    masked Basin_ID matches no basin, so masking it outside the catchments
+    spares RVIC the cells that never drain to the pour points.
+    """
+    with (
+        Dataset(nc_file) as ds,
+        Dataset(out_file, "w", format=ds.data_model) as out,
+    ):
+        window = window or (slice(None), slice(None))
+        masked = masked or {}
+        slices = {
+            ds.variables[lat_var].dimensions[0]: window[0],
+            ds.variables[lon_var].dimensions[0]: window[1],
+        }
+        out.setncatts({att: ds.getncattr(att) for att in ds.ncattrs()})
+        for name, dim in ds.dimensions.items():
+            out.createDimension(
+                name,
+                (
+                    None
+                    if dim.isunlimited()
+                    else len(range(len(dim))[slices.get(name, slice(None))])
+                ),
+            )
+        for name, var in ds.variables.items():
+            index = tuple(slices.get(dim, slice(None)) for dim in var.dimensions)
+            data = var[index] if index else var[...]
+            fill_value = None
+            if name in masked:
+                data = np.ma.masked_where(~masked[name][window], data)
+                fill_value = getattr(
+                    var, "_FillValue", default_fillvals[var.dtype.str[1:]]
+                )
+            copy_variable(out, var, data, fill_value=fill_value)
+    return out_file
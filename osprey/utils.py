@@ -1,15 +1,71 @@
+from pywps import FORMATS, configuration
 from pywps.app.exceptions import ProcessError
+from pywps.inout.outputs import MetaFile, MetaLink4
+import json
 import logging
+import math
 import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from configparser import ConfigParser
+from copy import deepcopy
 from urllib.parse import urlparse
-from urllib.request import urlretrieve
 from datetime import datetime, timedelta
 from collections import OrderedDict
 
 from wps_tools.file_handling import collect_output_files, is_opendap_url
 from wps_tools.io import collect_args
 from .config_templates import convolve_config_template, params_config_template
+from .engine import (
+    crop_params,
+    memory_budget,
+    numba_convolution,
+    numpy_convolution,
+    params_window,
+    read_params,
+    unsupported,
+)
+from .cache import FileCache, hash_inputs
+from .download import download
+from .forcing import file_rows, write_forcing_subset
+from .hist_file import (
+    concat_hist_files,
+    set_outlet_indices,
+    stack_hist_files,
+    unstack_hist_file,
+)
+from .param_file import (
+    copy_param_file,
+    crop_param_file,
+    densify_param_file,
+    is_sparse_param_file,
+    merge_param_files,
+    read_uh_length,
+    source_window,
+    sparsify_param_file,
+    uncrop_param_file,
+)
+from .routing import (
+    basin_groups,
+    covering_window,
+    crop_pour_points,
+    GridIndex,
+    grid_window,
+    load_index,
+    new_pour_points,
+    pour_point_cells,
+    read_pour_points,
+    UpstreamIndex,
+    write_pour_points,
+    write_subset,
+)
+from cftime import datetime as cfdatetime
+from netCDF4 import Dataset
+from rvic.convolution import convolution
 from rvic.core.config import read_config
+from rvic.parameters import parameters
 
 logger = logging.getLogger("PYWPS")
 logger.setLevel(logging.NOTSET)
@@ -22,19 +78,12 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
-def get_outfile(config, dir_name):
+def get_outfile_name(config, dir_name):
     """
-    This function returns the output filepath of RVIC processes.
-    Parameters
-        1. config (dict): Set of key-value pairs that contains the information of filename
-            parameters file: CASEID.rvic.prm.GRIDID.DATE.nc
-            convolution file: CASEID.rvic.h0a.ENDINGDATE.nc
-        2. dir_name (str): name of the directory that te output file will be stored.
-            parameters module   --->    dir_name == "params"
-            convoltion module   --->    dir_name == "hist"
+    This function returns the name RVIC gives to the output file of a process.
+    See get_outfile for the parameters.
     """
     case_id = config["OPTIONS"]["CASEID"]
-    case_dir = config["OPTIONS"]["CASE_DIR"]
     if dir_name == "params":
         grid_id = config["OPTIONS"]["GRIDID"]
         date = datetime.now().strftime("%Y%m%d")
@@ -47,21 +96,73 @@ def get_outfile(config, dir_name):
         )
         filename = ".".join([case_id, "rvic", "h0a", end_date, "nc"])
 
-    outdir = os.path.join(case_dir, dir_name)
+    return filename
+
+
+def get_outfile(config, dir_name):
+    """
+    This function returns the output filepath of RVIC processes.
+    Parameters
+        1. config (dict): Set of key-value pairs that contains the information of filename
+            parameters file: CASEID.rvic.prm.GRIDID.DATE.nc
+            convolution file: CASEID.rvic.h0a.ENDINGDATE.nc
+        2. dir_name (str): name of the directory that te output file will be stored.
+            parameters module   --->    dir_name == "params"
+            convoltion module   --->    dir_name == "hist"
+    """
+    filename = get_outfile_name(config, dir_name)
+    outdir = os.path.join(config["OPTIONS"]["CASE_DIR"], dir_name)
     (out_file,) = collect_output_files(filename, outdir)
 
     return os.path.join(outdir, out_file)
 
 
-def url_handler(workdir, url):
+# Downloads from the same host run at once while inputs are staged
+HOST_CONNECTIONS = 4
+
+
+def max_input_size():
+    """
+    Return the largest input file in bytes, as set by maxsingleinputsize in
+    the [server] section of the pywps configuration, or None without limit.
+    """
+    size = configuration.get_config_value("server", "maxsingleinputsize")
+    # pywps takes a size of 0 for no limit too
+    return (int(configuration.get_size_mb(size) * 1024**2) or None) if size else None
+
+
+def url_handler(workdir, url, progress=None):
     if is_opendap_url(url):
         # OPeNDAP
         return url
     elif urlparse(url).scheme and urlparse(url).netloc:
         # HTTP or other
-        local_file = os.path.join(workdir, url.split("/")[-1])
-        urlretrieve(url, local_file)
-        return local_file
+        local_file = os.path.join(workdir, url.split("#")[0].split("/")[-1])
+        # pywps refuses inputs larger than maxsingleinputsize, so do we
+        max_size = max_input_size()
+        cache = FileCache.from_config("downloads")
+        if cache:
+            return cache.fetch(url, local_file, progress, max_size)
+        return download(url, local_file, progress=progress, max_size=max_size)
+
+
+def download_status(response):
+    """
+    Return a download progress callback, see download, that reports the
+    transfers to the status of a pywps response.
+    """
+    lock = threading.Lock()
+
+    def report(url, done, total, rate):
+        size = f"{done / 2**20:.1f}" + (f" of {total / 2**20:.1f}" if total else "")
+        with lock:
+            response.update_status(
+                f"Downloading {url.split('#')[0].split('/')[-1]}: {size} MB "
+                f"at {rate / 2**20:.1f} MB/s",
+                response.status_percentage,
+            )
+
+    return report
 
 
 def optional_args_handler(args, identifier):
@@ -83,15 +184,91 @@ def optional_args_handler(args, identifier):
     return args
 
 
-def collect_args_wrapper(request, workdir, modules=[]):
-    args = collect_args(request.inputs, workdir)
+def stage_inputs(inputs, workdir, progress=None):
+    """
+    Download the remote files of a list of pywps inputs with url_handler at
+    once, at most HOST_CONNECTIONS at a time from the same host, and point
+    the inputs to the local copies. Every input gets its own directory in
+    workdir since files on different hosts may share a name. OPeNDAP
+    resources are left to be read remotely. progress is handed to download.
+    """
+    remote = [
+        inpt
+        for inpt in inputs
+        if getattr(inpt, "prop", None) == "url" and not is_opendap_url(inpt.url)
+    ]
+    if not remote:
+        return
+
+    hosts = {
+        urlparse(inpt.url).netloc: threading.Semaphore(HOST_CONNECTIONS)
+        for inpt in remote
+    }
+
+    def fetch(i, inpt):
+        input_dir = os.path.join(workdir, "inputs", str(i))
+        os.makedirs(input_dir, exist_ok=True)
+        with hosts[urlparse(inpt.url).netloc]:
+            return url_handler(input_dir, inpt.url, progress)
+
+    with ThreadPoolExecutor(max_workers=len(remote)) as executor:
+        local_files = list(executor.map(fetch, range(len(remote)), remote))
+    for inpt, local_file in zip(remote, local_files):
+        inpt.file = local_file
+
+
+def collect_args_wrapper(request, workdir, modules=[], response=None, deferred=()):
+    # The inputs named in deferred are left out of the arguments, for the
+    # process to resolve every occurrence itself, see stage_forcings
+    inputs = OrderedDict(
+        (identifier, occurrences)
+        for identifier, occurrences in request.inputs.items()
+        if identifier not in deferred
+    )
+    # collect_args resolves the first occurrence of every input in turn, so
+    # the remote ones are downloaded together beforehand
+    stage_inputs(
+        [occurrences[0] for occurrences in inputs.values()],
+        os.path.join(workdir, "staged"),
+        download_status(response) if response else None,
+    )
+    args = collect_args(inputs, workdir)
 
     if "parameters" in modules:
         optional_args_handler(args, "params")
     if "convolution" in modules:
         optional_args_handler(args, "convolve")
 
-    return [arg if arg != None else arg for arg in args.values()]
+    # pywps links file:// references into the work directory, read them in
+    # place instead
+    return [
+        os.path.realpath(arg) if isinstance(arg, str) and os.path.islink(arg) else arg
+        for arg in args.values()
+    ]
+
+
+def input_fingerprints(paths):
+    """
+    Record the size and modification time of the local files among paths,
+    which are read in place, for check_unmodified.
+    """
+    fingerprints = {}
+    for path in paths:
+        if isinstance(path, str) and os.path.isfile(path):
+            stat = os.stat(path)
+            fingerprints[path] = (stat.st_size, stat.st_mtime_ns)
+    return fingerprints
+
+
+def check_unmodified(fingerprints):
+    """Raise a ValueError when a file recorded by input_fingerprints changed."""
+    for path, fingerprint in fingerprints.items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise ValueError(f"Input {path} was removed during the run")
+        if (stat.st_size, stat.st_mtime_ns) != fingerprint:
+            raise ValueError(f"Input {path} was modified during the run")
 
 
 def params_config_handler(
@@ -189,6 +366,64 @@ def convolve_config_handler(
         raise ProcessError("Invalid config key provided in convolve file ")
 
 
+def snap_pour_points(config):
+    """
+    Check the pour points of a parameters config against the routing and
+    domain masks before RVIC runs. Pour points on cells without a flow
+    direction are moved to the nearest valid channel cell and all pour points
+    with no valid cell nearby are reported at once.
+    """
+    try:
+        header, rows = read_pour_points(config["POUR_POINTS"]["FILE_NAME"])
+    except ValueError as e:
+        raise ProcessError(f"{type(e).__name__}: {e}")
+    if "lons" not in header or "lats" not in header:
+        # (x, y) pour points already name their routing cell
+        return
+    lat_col, lon_col = header.index("lats"), header.index("lons")
+    plats = [float(row[lat_col]) for row in rows]
+    plons = [float(row[lon_col]) for row in rows]
+
+    routing = config["ROUTING"]
+    routing_index = load_index(
+        GridIndex,
+        routing["FILE_NAME"],
+        routing["LATITUDE_VAR"],
+        routing["LONGITUDE_VAR"],
+        routing["FLOW_DIRECTION_VAR"],
+    )
+    ys, xs, rejected = routing_index.snap(plats, plons)
+    lats, lons = routing_index.lats[ys], routing_index.lons[xs]
+
+    if not config["OPTIONS"]["REMAP"]:
+        domain = config["DOMAIN"]
+        domain_index = load_index(
+            GridIndex,
+            domain["FILE_NAME"],
+            domain["LATITUDE_VAR"],
+            domain["LONGITUDE_VAR"],
+            domain["LAND_MASK_VAR"],
+        )
+        rejected |= domain_index.snap(lats, lons, max_cells=0.75)[2]
+
+    if rejected.any():
+        outside = [f"{plons[i]} {plats[i]}" for i in rejected.nonzero()[0]]
+        raise ProcessError(
+            f"{len(outside)} pour points are outside the routing or domain mask: "
+            + ", ".join(outside[:10])
+        )
+
+    cell_ys, cell_xs = routing_index.cells(plats, plons)
+    moved = (ys != cell_ys) | (xs != cell_xs)
+    if moved.any():
+        for i in moved.nonzero()[0]:
+            logger.info(
+                f"Snapped pour point {plons[i]} {plats[i]} to {lons[i]} {lats[i]}"
+            )
+            rows[i][lat_col], rows[i][lon_col] = str(lats[i]), str(lons[i])
+        write_pour_points(config["POUR_POINTS"]["FILE_NAME"], header, rows)
+
+
 def rvic_config_validator(cfg):
     return {
         section: {
@@ -213,3 +448,1029 @@ def prep_csv(csv):
         pass
 
     return csv_content
+
+
+PARAMS_INPUT_SECTIONS = ("POUR_POINTS", "UH_BOX", "ROUTING", "DOMAIN")
+
+# Options that change where RVIC writes or how much it logs but not the content
+# of the parameter file
+PARAMS_CACHE_IGNORED_OPTIONS = ("CASE_DIR", "TEMP_DIR", "LOG_LEVEL", "VERBOSE", "CLEAN")
+
+
+def params_cache_key(config):
+    """
+    Hash the input files and the merged configuration of a parameters run.
+    File paths are left out of the configuration since the temporary csv
+    files get a new name on every request; their content is hashed instead.
+    """
+    files = [config[section]["FILE_NAME"] for section in PARAMS_INPUT_SECTIONS]
+    settings = {
+        section: {
+            key: value
+            for key, value in config[section].items()
+            if key != "FILE_NAME" and key not in PARAMS_CACHE_IGNORED_OPTIONS
+        }
+        for section in config.keys()
+    }
+    return hash_inputs(files, settings)
+
+
+def subset_routing():
+    """
+    Whether parameters are developed on the catchments of the pour points
+    only, set with subset_routing in the [osprey] section.
+    """
+    return configuration.get_config_value("osprey", "subset_routing", True) is not False
+
+
+def subset_config(config):
+    """
+    Return a copy of a parameters config that only covers the cells draining
+    to its pour points, and the window its domain was cropped to (None when
+    the domain is used as is).
+
+    The catchments are read from the upstream index of the routing file,
+    which is built once per routing file and kept in the indexes cache. The
+    routing file is cropped to the bounding box of the catchments and keeps
+    the Basin_ID of the catchment cells only. Without REMAP the domain is
+    cropped to the same extent; the indices RVIC writes for it are moved
+    back with uncrop_param_file.
+    """
+    options, routing, domain = config["OPTIONS"], config["ROUTING"], config["DOMAIN"]
+    if options["SEARCH_FOR_CHANNEL"]:
+        # RVIC may move the pour points onto another cell
+        return config, None
+
+    pour_points = config["POUR_POINTS"]["FILE_NAME"]
+    header, rows = read_pour_points(pour_points)
+    with Dataset(routing["FILE_NAME"]) as ds:
+        lats = ds.variables[routing["LATITUDE_VAR"]][:]
+        lons = ds.variables[routing["LONGITUDE_VAR"]][:]
+    ys, xs = pour_point_cells(header, rows, lats, lons)
+
+    index = load_index(
+        UpstreamIndex,
+        routing["FILE_NAME"],
+        routing["LATITUDE_VAR"],
+        routing["FLOW_DIRECTION_VAR"],
+        routing["BASIN_ID_VAR"],
+    )
+    mask = index.catchment_mask(ys, xs)
+    if not mask.any():
+        return config, None
+    window = grid_window(mask)
+    logger.info(f"Routing {mask.sum()} of {mask.size} cells to the pour points")
+
+    subset = deepcopy(config)
+    subset_dir = os.path.join(options["CASE_DIR"], "subset")
+    # Keep the file names, RVIC records them in the parameter file
+    routing_file = os.path.join(
+        subset_dir, "routing", os.path.basename(routing["FILE_NAME"])
+    )
+    os.makedirs(os.path.dirname(routing_file), exist_ok=True)
+    subset["ROUTING"]["FILE_NAME"] = write_subset(
+        routing["FILE_NAME"],
+        routing_file,
+        routing["LATITUDE_VAR"],
+        routing["LONGITUDE_VAR"],
+        window,
+        masked={routing["BASIN_ID_VAR"]: mask},
+    )
+
+    if "x" in header and "y" in header:
+        subset["POUR_POINTS"]["FILE_NAME"] = os.path.join(
+            subset_dir, "pour_points", os.path.basename(pour_points)
+        )
+        os.makedirs(os.path.dirname(subset["POUR_POINTS"]["FILE_NAME"]), exist_ok=True)
+        write_pour_points(
+            subset["POUR_POINTS"]["FILE_NAME"],
+            header,
+            crop_pour_points(header, rows, ys, xs, lats, window),
+        )
+
+    if options["REMAP"]:
+        # The remapped unit hydrographs depend on the extent of the domain
+        return subset, None
+
+    dom_window, dom_shape, dom_ascending = covering_window(
+        domain["FILE_NAME"],
+        domain["LATITUDE_VAR"],
+        domain["LONGITUDE_VAR"],
+        lats[window[0]],
+        lons[window[1]],
+    )
+    domain_file = os.path.join(
+        subset_dir, "domain", os.path.basename(domain["FILE_NAME"])
+    )
+    os.makedirs(os.path.dirname(domain_file), exist_ok=True)
+    subset["DOMAIN"]["FILE_NAME"] = write_subset(
+        domain["FILE_NAME"],
+        domain_file,
+        domain["LATITUDE_VAR"],
+        domain["LONGITUDE_VAR"],
+        dom_window,
+    )
+    return subset, (dom_window, dom_shape, dom_ascending)
+
+
+def develop_parameters(config, np, split_basins=False):
+    """
+    Develop the parameter file of config on the subset of the routing and
+    domain files covering its catchments. With split_basins the outlets are
+    developed per basin on np workers.
+    """
+    develop = run_basin_parameters if split_basins else parameters
+    subset, domain_crop = subset_config(config) if subset_routing() else (config, None)
+    develop(subset, np)
+    if domain_crop:
+        uncrop_param_file(get_outfile(config, "params"), *domain_crop)
+
+
+def write_param_layout(param_file, out_file, sparse):
+    """
+    Write param_file to out_file storing its unit hydrographs sparsely, or
+    padded the way RVIC reads them. out_file may be param_file itself.
+    """
+    convert = sparsify_param_file if sparse else densify_param_file
+    temp_file = f"{out_file}.tmp"
+    convert(param_file, temp_file)
+    os.replace(temp_file, out_file)
+    return out_file
+
+
+def run_parameters(config, np, split_basins=False, sparse=False):
+    """
+    Run RVIC parameters with config, serving the parameter file from the
+    parameters cache when an identical run has been done before.
+    With split_basins the outlets are developed per basin on np workers.
+    With sparse the parameter file stores only the non-zero span of every
+    unit hydrograph. Cached parameter files are always stored sparsely.
+    """
+    cache = FileCache.from_config("parameters")
+    if not cache:
+        develop_parameters(config, np, split_basins)
+        if sparse:
+            param_file = get_outfile(config, "params")
+            write_param_layout(param_file, param_file, sparse)
+        return
+
+    key = params_cache_key(config)
+    outdir = os.path.join(config["OPTIONS"]["CASE_DIR"], "params")
+    with cache.open(key) as entry:
+        if entry:
+            logger.info(f"Using cached parameter file {key}")
+            (cached,) = os.listdir(entry)
+            os.makedirs(outdir, exist_ok=True)
+            write_param_layout(
+                os.path.join(entry, cached),
+                os.path.join(outdir, get_outfile_name(config, "params")),
+                sparse,
+            )
+            return
+
+    develop_parameters(config, np, split_basins)
+    param_file = get_outfile(config, "params")
+    sparse_dir = os.path.join(config["OPTIONS"]["CASE_DIR"], "sparse")
+    os.makedirs(sparse_dir, exist_ok=True)
+    sparse_file = sparsify_param_file(
+        param_file, os.path.join(sparse_dir, os.path.basename(param_file))
+    )
+    cache.put(key, [sparse_file])
+    if sparse:
+        os.replace(sparse_file, param_file)
+
+
+def run_basin_parameters(config, np):
+    """
+    Develop parameters separately for the pour points of every basin in the
+    routing file's Basin_ID and merge them into the parameter file RVIC
+    would have written for config. Unconnected basins share no source cells,
+    so the merged file matches a single run over all pour points.
+    """
+    header, groups = basin_groups(
+        config["POUR_POINTS"]["FILE_NAME"],
+        config["ROUTING"]["FILE_NAME"],
+        config["ROUTING"],
+    )
+    if len(groups) < 2:
+        parameters(config, np)
+        return
+
+    case_dir = config["OPTIONS"]["CASE_DIR"]
+    basin_configs = []
+    for basin_id, rows in groups.items():
+        basin_dir = os.path.join(case_dir, "basins", str(basin_id))
+        os.makedirs(basin_dir, exist_ok=True)
+
+        basin_config = deepcopy(config)
+        basin_config["OPTIONS"]["CASE_DIR"] = basin_dir
+        basin_config["OPTIONS"]["TEMP_DIR"] = os.path.join(basin_dir, "temp")
+        basin_config["POUR_POINTS"]["FILE_NAME"] = os.path.join(
+            basin_dir, "pour_points.csv"
+        )
+        write_pour_points(basin_config["POUR_POINTS"]["FILE_NAME"], header, rows)
+        basin_configs.append(basin_config)
+
+    logger.info(f"Developing parameters for {len(groups)} basins on {np} workers")
+    with ProcessPoolExecutor(max_workers=np) as executor:
+        # Consume the results so worker errors are raised here
+        list(executor.map(parameters, basin_configs, [1] * len(groups)))
+
+    outdir = os.path.join(case_dir, "params")
+    os.makedirs(outdir, exist_ok=True)
+    merge_param_files(
+        [get_outfile(basin_config, "params") for basin_config in basin_configs],
+        os.path.join(outdir, get_outfile_name(config, "params")),
+        RvicPourPointsFile=os.path.basename(config["POUR_POINTS"]["FILE_NAME"]),
+    )
+
+
+def extend_parameters(config, np, param_file, split_basins=False, sparse=False):
+    """
+    Add the outlets of config's pour points that are missing from an
+    existing parameter file. Only the new outlets are developed; they are
+    merged after the outlets already in param_file. With sparse the
+    extended file stores its unit hydrographs sparsely.
+    """
+    header, rows = new_pour_points(
+        config["POUR_POINTS"]["FILE_NAME"],
+        param_file,
+        config["ROUTING"]["FILE_NAME"],
+        config["ROUTING"],
+    )
+    outdir = os.path.join(config["OPTIONS"]["CASE_DIR"], "params")
+    os.makedirs(outdir, exist_ok=True)
+    out_file = os.path.join(outdir, get_outfile_name(config, "params"))
+
+    if not rows:
+        logger.info("All pour points are already outlets of the parameter file")
+        write_param_layout(param_file, out_file, sparse)
+        return
+
+    logger.info(f"Developing parameters for {len(rows)} new outlets")
+    new_dir = os.path.join(config["OPTIONS"]["CASE_DIR"], "new_outlets")
+    new_config = deepcopy(config)
+    new_config["OPTIONS"]["CASE_DIR"] = new_dir
+    new_config["OPTIONS"]["TEMP_DIR"] = os.path.join(new_dir, "temp")
+    new_config["POUR_POINTS"]["FILE_NAME"] = os.path.join(
+        new_dir, "new_pour_points.csv"
+    )
+    os.makedirs(new_dir, exist_ok=True)
+    write_pour_points(new_config["POUR_POINTS"]["FILE_NAME"], header, rows)
+
+    # Develop the new outlets in the layout of param_file to merge them
+    param_file_sparse = is_sparse_param_file(param_file)
+    run_parameters(new_config, np, split_basins, param_file_sparse)
+    merge_param_files([param_file, get_outfile(new_config, "params")], out_file)
+    if sparse != param_file_sparse:
+        write_param_layout(out_file, out_file, sparse)
+
+
+def convolution_chunks(config, chunk_days):
+    """
+    Split the run of a convolution config into periods of chunk_days days.
+    Returns a config for every chunk. Apart from the first, chunks start the
+    length of the unit hydrographs early from an empty state, so that by the
+    chunk's own start date they route the same flow as an uninterrupted run.
+    Returns None when the run cannot be split.
+    """
+    options, history = config["OPTIONS"], config["HISTORY"]
+    if (
+        options["RUN_TYPE"] == "restart"
+        or options["STOP_OPTION"] != "date"
+        or int(history["RVICHIST_NTAPES"]) != 1
+        or int(history["RVICHIST_NHTFRQ"]) != 1
+    ):
+        return None
+
+    spin_up = timedelta(
+        days=math.ceil(read_uh_length(config["PARAM_FILE"]["FILE_NAME"]) / 86400) + 1
+    )
+    # Chunks must outlast the spin up so the initial state has drained
+    # before the second chunk starts
+    chunk = timedelta(days=max(chunk_days, spin_up.days))
+    calendar = options["CALENDAR"]
+    start = cfdatetime.strptime(
+        options["RUN_STARTDATE"], "%Y-%m-%d-%H", calendar=calendar
+    )
+    stop = cfdatetime.strptime(options["STOP_DATE"], "%Y-%m-%d", calendar=calendar)
+
+    configs = []
+    chunk_start = start
+    while chunk_start <= stop:
+        chunk_stop = min(chunk_start + chunk - timedelta(days=1), stop)
+        chunk_dir = os.path.join(options["CASE_DIR"], "chunks", str(len(configs)))
+        chunk_config = deepcopy(config)
+        chunk_options = chunk_config["OPTIONS"]
+        chunk_options["CASE_DIR"] = chunk_dir
+        chunk_options["STOP_DATE"] = chunk_stop.strftime("%Y-%m-%d")
+        chunk_options["REST_DATE"] = chunk_options["STOP_DATE"]
+        if configs:
+            chunk_options["RUN_TYPE"] = "drystart"
+            chunk_options["RUN_STARTDATE"] = (chunk_start - spin_up).strftime(
+                "%Y-%m-%d-%H"
+            )
+        configs.append(chunk_config)
+        chunk_start = chunk_start + chunk
+    return configs
+
+
+def run_bounds(options):
+    """
+    Return the first and last date of the forcings a run reads from the
+    OPTIONS of its config, either being None when the config leaves it open.
+    """
+    return (
+        options["RUN_STARTDATE"] if options["RUN_TYPE"] != "restart" else None,
+        options["STOP_DATE"] if options["STOP_OPTION"] == "date" else None,
+    )
+
+
+def stage_grid_inputs():
+    """
+    Whether the OPeNDAP inputs of convolutions with grid history output are
+    copied locally before the run, set with stage_grid_inputs in the [osprey]
+    section.
+    """
+    return (
+        configuration.get_config_value("osprey", "stage_grid_inputs", True) is not False
+    )
+
+
+def stage_grid_config(config):
+    """
+    Return a copy of a convolution config with grid history output that
+    reads local copies of its OPeNDAP forcing and domain files, or config
+    when both are local. The output covers the whole grid, so only the
+    timesteps of the run and the forcing fields are requested from the
+    server; the grid is not cut down. Forcings kept local are read as they
+    are.
+    """
+    options, forcings, domain = (
+        config["OPTIONS"],
+        config["INPUT_FORCINGS"],
+        config["DOMAIN"],
+    )
+    forcing_file = os.path.join(forcings["DATL_PATH"], forcings["DATL_FILE"])
+    remote_forcing = is_opendap_url(forcing_file)
+    remote_domain = is_opendap_url(domain["FILE_NAME"])
+    if not (remote_forcing or remote_domain):
+        return config
+
+    subset_dir = os.path.join(options["CASE_DIR"], "subset")
+    subset = deepcopy(config)
+    if remote_forcing:
+        os.makedirs(os.path.join(subset_dir, "forcings"), exist_ok=True)
+        fields = forcings["DATL_LIQ_FLDS"]
+        subset["INPUT_FORCINGS"]["DATL_PATH"] = os.path.join(subset_dir, "forcings")
+        write_forcing_subset(
+            forcing_file,
+            os.path.join(subset_dir, "forcings", forcings["DATL_FILE"]),
+            fields if isinstance(fields, list) else [fields],
+            forcings["TIME_VAR"],
+            forcings["LATITUDE_VAR"],
+            None,
+            *run_bounds(options),
+            memory_budget(),
+        )
+    if remote_domain:
+        os.makedirs(os.path.join(subset_dir, "domain"), exist_ok=True)
+        subset["DOMAIN"]["FILE_NAME"] = write_subset(
+            domain["FILE_NAME"],
+            os.path.join(subset_dir, "domain", os.path.basename(domain["FILE_NAME"])),
+            domain["LATITUDE_VAR"],
+            domain["LONGITUDE_VAR"],
+        )
+    return subset
+
+
+def subset_forcing_config(config, params=None):
+    """
+    Return a copy of a convolution config that reads only the forcing cells
+    its parameter file routes and the timesteps of its run, the outlet
+    indices the history file of config would have, and params cropped to
+    the subset. Returns config, None and params when the inputs are used as
+    they are.
+
+    The forcing, domain and parameter files are cut down to the window of the
+    grid holding the sources and outlets of the parameter file. OPeNDAP
+    forcings are subset on the server. With grid history output only the
+    OPeNDAP inputs are copied, see stage_grid_config, unless
+    stage_grid_inputs is off. When params, the arrays of the parameter file
+    read by read_params, are given they are cropped instead of the parameter
+    file.
+    """
+    options, forcings = config["OPTIONS"], config["INPUT_FORCINGS"]
+    if forcings["START"]:
+        # Forcings split over several files
+        return config, None, params
+    if config["HISTORY"]["RVICHIST_OUTTYPE"] != "array":
+        # Grids in the output cover the whole forcing grid
+        staged = stage_grid_config(config) if stage_grid_inputs() else config
+        return staged, None, params
+
+    forcing_file = os.path.join(forcings["DATL_PATH"], forcings["DATL_FILE"])
+    param_file = config["PARAM_FILE"]["FILE_NAME"]
+    domain = config["DOMAIN"]
+    rows, cols = window = params_window(params) if params else source_window(param_file)
+    with Dataset(domain["FILE_NAME"]) as ds:
+        dom_lats = ds.variables[domain["LATITUDE_VAR"]][:]
+        dom_lons = ds.variables[domain["LONGITUDE_VAR"]][:]
+    whole_grid = (rows.stop - rows.start, cols.stop - cols.start) == (
+        len(dom_lats),
+        len(dom_lons),
+    )
+    if whole_grid and not is_opendap_url(forcing_file):
+        return config, None, params
+
+    with Dataset(forcing_file) as ds:
+        forcing_lats = ds.variables[forcings["LATITUDE_VAR"]][:]
+    if params:
+        outlet_y_ind, outlet_x_ind = params["outlet_y_ind"], params["outlet_x_ind"]
+    else:
+        with Dataset(param_file) as ds:
+            outlet_y_ind = ds.variables["outlet_y_ind"][:]
+            outlet_x_ind = ds.variables["outlet_x_ind"][:]
+    if forcing_lats[-1] > forcing_lats[0]:
+        # RVIC flips the indices to the order of the forcing grid
+        outlet_y_ind = len(forcing_lats) - 1 - outlet_y_ind
+
+    subset_dir = os.path.join(options["CASE_DIR"], "subset")
+    for name in ("forcings", "domain"):
+        os.makedirs(os.path.join(subset_dir, name), exist_ok=True)
+    fields = forcings["DATL_LIQ_FLDS"]
+    subset = deepcopy(config)
+    subset["INPUT_FORCINGS"]["DATL_PATH"] = os.path.join(subset_dir, "forcings")
+    write_forcing_subset(
+        forcing_file,
+        os.path.join(subset_dir, "forcings", forcings["DATL_FILE"]),
+        fields if isinstance(fields, list) else [fields],
+        forcings["TIME_VAR"],
+        forcings["LATITUDE_VAR"],
+        window,
+        *run_bounds(options),
+        memory_budget(),
+    )
+    # Keep the file names, RVIC records them in the history file
+    subset["DOMAIN"]["FILE_NAME"] = write_subset(
+        domain["FILE_NAME"],
+        os.path.join(subset_dir, "domain", os.path.basename(domain["FILE_NAME"])),
+        domain["LATITUDE_VAR"],
+        domain["LONGITUDE_VAR"],
+        (file_rows(rows, dom_lats), cols),
+    )
+    if params:
+        return subset, (outlet_y_ind, outlet_x_ind), crop_params(params, window)
+
+    os.makedirs(os.path.join(subset_dir, "params"), exist_ok=True)
+    subset["PARAM_FILE"]["FILE_NAME"] = crop_param_file(
+        param_file,
+        os.path.join(subset_dir, "params", os.path.basename(param_file)),
+        window,
+    )
+    return subset, (outlet_y_ind, outlet_x_ind), None
+
+
+CONVOLUTION_ENGINES = {
+    "rvic": convolution,
+    "numpy": numpy_convolution,
+    "numba": numba_convolution,
+}
+
+
+def convolve(config, engine="rvic", params=None):
+    """
+    Run the convolution of config with one of CONVOLUTION_ENGINES on the
+    subset of the inputs it reads. Configs other engines do not cover are
+    run by RVIC, which is given a padded copy of sparse parameter files.
+    The other engines take params, the arrays of the parameter file of
+    config, from memory when they are given.
+    """
+    if engine != "rvic":
+        reason = unsupported(config)
+        if reason:
+            logger.warning(
+                f"Convolving with rvic, the {engine} engine does not support {reason}"
+            )
+            engine = "rvic"
+    subset, outlet_indices, params = subset_forcing_config(
+        config, params if engine != "rvic" else None
+    )
+    param_file = subset["PARAM_FILE"]["FILE_NAME"]
+    if engine == "rvic" and is_sparse_param_file(param_file):
+        # RVIC reads the padded unit hydrograph array
+        dense_dir = os.path.join(config["OPTIONS"]["CASE_DIR"], "dense")
+        os.makedirs(dense_dir, exist_ok=True)
+        subset = deepcopy(subset)
+        subset["PARAM_FILE"]["FILE_NAME"] = densify_param_file(
+            param_file, os.path.join(dense_dir, os.path.basename(param_file))
+        )
+    if params:
+        CONVOLUTION_ENGINES[engine](subset, params)
+    else:
+        CONVOLUTION_ENGINES[engine](subset)
+    if outlet_indices:
+        # Report the outlets on the full grid, as a run on the whole
+        # forcing grid would
+        set_outlet_indices(get_outfile(config, "hist"), *outlet_indices)
+
+
+def checkpoint_key(run_key, config, member=None):
+    """
+    Key of the checkpoint of one run of a convolution request: a chunk,
+    told apart by its period and run type, of the ensemble member with index
+    member, or of the request itself without an ensemble. run_key is the
+    convolution_cache_key of the request, so the inputs are hashed once
+    rather than for every run.
+    """
+    options = config["OPTIONS"]
+    return hash_inputs(
+        [],
+        {
+            "run": run_key,
+            "member": member,
+            **{
+                option: options[option]
+                for option in ("RUN_TYPE", "RUN_STARTDATE", "STOP_DATE")
+            },
+        },
+    )
+
+
+def convolve_run(config, engine="rvic", params=None, resume=True, key=None):
+    """
+    Run convolve and, given the checkpoint_key of the run, checkpoint its
+    history and restart files in the checkpoints cache. With resume, a run
+    whose files were checkpointed by an earlier request, e.g. a chunk or
+    ensemble member of a request that failed later on, is restored from
+    them instead of convolved again.
+    """
+    checkpoints = FileCache.from_config("checkpoints") if key else None
+    if not checkpoints:
+        convolve(config, engine, params)
+        return
+
+    case_dir = config["OPTIONS"]["CASE_DIR"]
+    hist_dir, restart_dir = (os.path.join(case_dir, d) for d in ("hist", "restarts"))
+    hist_name = get_outfile_name(config, "hist")
+    key = f"convolution-{key}"
+    with checkpoints.open(key) if resume else nullcontext() as entry:
+        if entry:
+            logger.info(f"Resuming from checkpoint {key}")
+            for d in (hist_dir, restart_dir):
+                os.makedirs(d, exist_ok=True)
+            for name in os.listdir(entry):
+                shutil.copy2(
+                    os.path.join(entry, name),
+                    os.path.join(hist_dir if name == hist_name else restart_dir, name),
+                )
+            return
+
+    convolve(config, engine, params)
+    restarts = [
+        os.path.join(restart_dir, name)
+        for name in (os.listdir(restart_dir) if os.path.isdir(restart_dir) else [])
+        if os.path.isfile(os.path.join(restart_dir, name))
+    ]
+    checkpoints.put(key, [get_outfile(config, "hist"), *restarts], replace=True)
+
+
+# Arrays of the parameter file of the runs of a convolution worker process,
+# set once per worker by share_params
+_worker_params = None
+
+
+def share_params(params):
+    """Initializer of the convolution workers, keeps params for convolve_shared."""
+    global _worker_params
+    _worker_params = params
+
+
+def convolve_shared(config, engine="rvic", resume=True, key=None):
+    """Run convolve_run in a worker with the params given to share_params."""
+    convolve_run(config, engine, _worker_params, resume, key)
+
+
+def input_paths(inputs, workdir=None, progress=None):
+    """
+    Return the local path, or the url of OPeNDAP resources, of every
+    occurrence of a ComplexInput. Linked local files are resolved to the
+    files they link to. With workdir the remote occurrences are
+    downloaded into it at once, see stage_inputs.
+    """
+    if workdir:
+        stage_inputs(inputs, workdir, progress)
+    return [
+        (
+            inpt.url
+            if inpt.prop == "url" and is_opendap_url(inpt.url)
+            # Read file:// references in place, see collect_args_wrapper
+            else os.path.realpath(inpt.file)
+        )
+        for inpt in inputs
+    ]
+
+
+def stage_forcings(inputs, workdir, progress=None):
+    """
+    Start resolving every occurrence of a ComplexInput on a background
+    thread, see input_paths, and return a future of the paths. Remote files
+    are downloaded into workdir while the caller carries on, reporting to
+    progress, see download. The files are not opened here since the netCDF
+    library cannot be used from two threads at once.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    staged = executor.submit(input_paths, inputs, workdir, progress)
+    # Let the download finish without holding up the caller
+    executor.shutdown(wait=False)
+    return staged
+
+
+def ensemble_configs(config, input_forcings):
+    """
+    Return a convolution config for every forcing dataset of an ensemble.
+    Members share config's parameter file; a remote parameter file is copied
+    to the case directory once instead of being read by every member.
+    Returns the member configs and the names of the members.
+    """
+    case_dir = config["OPTIONS"]["CASE_DIR"]
+    param_file = config["PARAM_FILE"]["FILE_NAME"]
+    if is_opendap_url(param_file):
+        local_param_file = os.path.join(case_dir, os.path.basename(param_file))
+        os.makedirs(case_dir, exist_ok=True)
+        copy_param_file(param_file, local_param_file)
+        param_file = local_param_file
+
+    configs, members = [], []
+    for i, forcing in enumerate(input_forcings):
+        name = os.path.splitext(forcing.split("/")[-1])[0]
+        members.append(name if name not in members else f"{name}_{i}")
+
+        member_config = deepcopy(config)
+        member_config["OPTIONS"]["CASE_DIR"] = os.path.join(case_dir, "members", str(i))
+        member_config["PARAM_FILE"]["FILE_NAME"] = param_file
+        member_config["INPUT_FORCINGS"]["DATL_PATH"] = "/".join(forcing.split("/")[:-1])
+        member_config["INPUT_FORCINGS"]["DATL_FILE"] = forcing.split("/")[-1]
+        configs.append(member_config)
+    return configs, members
+
+
+def join_chunks(config, chunk_configs):
+    """
+    Join the history files of the chunks of a convolution run into the
+    history file of config and keep the state at the end of the run.
+    """
+    outdir = os.path.join(config["OPTIONS"]["CASE_DIR"], "hist")
+    os.makedirs(outdir, exist_ok=True)
+    concat_hist_files(
+        [get_outfile(chunk_config, "hist") for chunk_config in chunk_configs],
+        os.path.join(outdir, get_outfile_name(config, "hist")),
+        memory_budget(),
+    )
+
+    # The state at the end of the last chunk is the state of the whole run
+    restarts = os.path.join(chunk_configs[-1]["OPTIONS"]["CASE_DIR"], "restarts")
+    if os.path.isdir(restarts):
+        shutil.copytree(
+            restarts,
+            os.path.join(config["OPTIONS"]["CASE_DIR"], "restarts"),
+            dirs_exist_ok=True,
+        )
+
+
+RESTART_STATE_FILE = "restart.json"
+
+
+def restart_key(config):
+    """
+    Key of the restart state kept for a convolution case. A state only fits
+    runs with the parameter file it was written with and continues the
+    forcings it routed. Forcings are extended between runs, so they are told
+    apart by their url, or by their file name when they are read locally
+    from a path that changes with every request.
+    """
+    forcings = config["INPUT_FORCINGS"]
+    forcing = os.path.join(forcings["DATL_PATH"], forcings["DATL_FILE"])
+    return hash_inputs(
+        [config["PARAM_FILE"]["FILE_NAME"]],
+        {
+            "CASEID": config["OPTIONS"]["CASEID"],
+            "FORCING": forcing if is_opendap_url(forcing) else forcings["DATL_FILE"],
+        },
+    )
+
+
+def keep_restart(config):
+    """
+    Keep the state RVIC wrote at the end of a convolution run, with the
+    history file of the run, as the latest state of its case in the restarts
+    cache.
+    """
+    cache = FileCache.from_config("restarts")
+    options = config["OPTIONS"]
+    rpointer = os.path.join(options["CASE_DIR"], "restarts", "rpointer")
+    if (
+        not cache
+        or options["REST_OPTION"] != "date"
+        or options["REST_DATE"] != options["STOP_DATE"]
+        or not os.path.isfile(rpointer)
+    ):
+        # Only a state at the end of the run continues its history
+        return
+
+    pointer = ConfigParser()
+    pointer.optionxform = str
+    pointer.read(rpointer)
+    # The pointer holds the path RVIC wrote to, which is a chunk directory
+    # for chunked runs
+    restart_file = os.path.join(
+        os.path.dirname(rpointer), os.path.basename(pointer["RESTART"]["FILE_NAME"])
+    )
+    hist_file = get_outfile(config, "hist")
+    state_file = os.path.join(os.path.dirname(rpointer), RESTART_STATE_FILE)
+    with open(state_file, "w") as f:
+        json.dump(
+            {
+                "timestamp": pointer["RESTART"]["TIMESTAMP"],
+                "restart": os.path.basename(restart_file),
+                "history": os.path.basename(hist_file),
+            },
+            f,
+        )
+    cache.put(restart_key(config), [restart_file, hist_file, state_file], replace=True)
+
+
+def continue_config(config):
+    """
+    Return a copy of a convolution config that starts from the latest state
+    kept for its case, and the history file of the runs it continues.
+    Returns config and None when no state is kept.
+    """
+    cache = FileCache.from_config("restarts")
+    options = config["OPTIONS"]
+    previous = os.path.join(options["CASE_DIR"], "previous")
+    with cache.open(restart_key(config)) if cache else nullcontext() as entry:
+        if not entry:
+            logger.warning(
+                "No restart state is kept for this case, running from the start"
+            )
+            return config, None
+        # The entry can be evicted or replaced once the lock is released
+        shutil.copytree(entry, previous, dirs_exist_ok=True)
+    with open(os.path.join(previous, RESTART_STATE_FILE)) as f:
+        state = json.load(f)
+
+    stop = datetime.strptime(options["STOP_DATE"], "%Y-%m-%d")
+    if datetime.strptime(state["timestamp"], "%Y-%m-%d-%H") > stop:
+        raise ValueError(
+            f"The history of {options['CASEID']} already runs to {options['STOP_DATE']}"
+        )
+    logger.info(f"Continuing {options['CASEID']} from {state['timestamp']}")
+
+    continued = deepcopy(config)
+    continued["OPTIONS"]["RUN_TYPE"] = "startup"
+    continued["OPTIONS"]["RUN_STARTDATE"] = state["timestamp"]
+    continued["INITIAL_STATE"]["FILE_NAME"] = os.path.join(previous, state["restart"])
+    return continued, os.path.join(previous, state["history"])
+
+
+# Options that change where RVIC reads, writes or how much it logs but not
+# the history; the content of the files is hashed instead
+CONVOLVE_CACHE_IGNORED_OPTIONS = (
+    "CASE_DIR",
+    "LOG_LEVEL",
+    "VERBOSE",
+    "FILE_NAME",
+    "DATL_PATH",
+    "DATL_FILE",
+    "SLAB_STEPS",
+)
+
+
+def read_in_place(path):
+    """
+    Whether path is a local input read where it lies, outside the work
+    directories pywps makes for its jobs, rather than a copy made for the job.
+    """
+    workdir = os.path.realpath(configuration.get_config_value("server", "workdir"))
+    return (
+        os.path.isfile(path)
+        and os.path.commonpath([workdir, os.path.realpath(path)]) != workdir
+    )
+
+
+def convolution_cache_key(config, input_forcings, engine):
+    """
+    Hash the parameter, domain, initial state and forcing files of a
+    convolution run, its merged configuration, which holds the period of the
+    run, and the engine. Files read in place are identified by their real
+    path, size and modification time without reading them; copies in the
+    work directory of the job, which get a new path every request, by their
+    content. OPeNDAP forcings are identified by their url and the version
+    the server reports.
+    """
+    forcings = config["INPUT_FORCINGS"]
+    files = [
+        config["PARAM_FILE"]["FILE_NAME"],
+        config["DOMAIN"]["FILE_NAME"],
+        *(
+            input_forcings
+            or [os.path.join(forcings["DATL_PATH"], forcings["DATL_FILE"])]
+        ),
+    ]
+    if config["INITIAL_STATE"]["FILE_NAME"]:
+        files.append(config["INITIAL_STATE"]["FILE_NAME"])
+    settings = {
+        section: {
+            key: value
+            for key, value in config[section].items()
+            if key not in CONVOLVE_CACHE_IGNORED_OPTIONS
+        }
+        for section in config.keys()
+    }
+    settings["engine"] = engine
+    in_place = [path for path in files if read_in_place(path)]
+    settings["in_place"] = [
+        [os.path.realpath(path), *fingerprint]
+        for path, fingerprint in input_fingerprints(in_place).items()
+    ]
+    return hash_inputs([path for path in files if path not in in_place], settings)
+
+
+def run_convolution(
+    config,
+    np=1,
+    chunk_days=0,
+    input_forcings=None,
+    continue_run=False,
+    engine="rvic",
+    bypass_cache=False,
+    params=None,
+    progress=None,
+):
+    """
+    Run RVIC convolution with config on np workers.
+    Parameters
+        1. config (dict): Convolution config
+        2. np (int): Number of worker processes
+        3. chunk_days (int): Split the run into chunks of this many days,
+            convolved in parallel and joined into the history file of a single
+            run. Routing is linear, so the joined output matches the single run.
+        4. input_forcings (list): Forcing datasets to route as an ensemble
+            instead of the one in config. The history files of the members are
+            stacked along an ensemble dimension.
+        5. continue_run (bool): Start from the latest restart state kept for
+            the case and join the new period onto the history it ended.
+        6. engine (str): Name of the convolution engine, see
+            CONVOLUTION_ENGINES
+        7. bypass_cache (bool): Convolve even when the history file of an
+            identical run is in the convolutions cache, and replace it
+        8. params (dict): Arrays of the parameter file of config, see
+            read_params, handed to the numpy and numba engines so chunks and
+            ensemble members do not read the file again
+        9. progress (callable): Called as progress(done, total, name) when
+            the runs of each ensemble member are convolved, name being the
+            member name or None without an ensemble
+    Without an ensemble, the state at the end of the run is kept for later
+    continuation. Continued runs are not cached.
+    """
+    cache = None if continue_run else FileCache.from_config("convolutions")
+    if cache:
+        key = convolution_cache_key(config, input_forcings, engine)
+        with nullcontext() if bypass_cache else cache.open(key) as entry:
+            if entry:
+                logger.info(f"Using cached history file {key}")
+                (cached,) = os.listdir(entry)
+                outdir = os.path.join(config["OPTIONS"]["CASE_DIR"], "hist")
+                os.makedirs(outdir, exist_ok=True)
+                shutil.copyfile(
+                    os.path.join(entry, cached),
+                    os.path.join(outdir, get_outfile_name(config, "hist")),
+                )
+                return
+
+    ensemble = input_forcings and len(input_forcings) > 1
+    previous_hist = None
+    if continue_run:
+        if ensemble:
+            raise ValueError("Ensemble runs cannot be continued from a restart")
+        config, previous_hist = continue_config(config)
+
+    if ensemble:
+        members, names = ensemble_configs(config, input_forcings)
+    else:
+        members, names = [config], None
+
+    # Runs are checkpointed under keys derived from the key of the request,
+    # so its inputs are hashed once
+    run_key = None
+    if FileCache.from_config("checkpoints"):
+        run_key = (
+            key if cache else convolution_cache_key(config, input_forcings, engine)
+        )
+
+    runs = []
+    for member in members:
+        chunks = convolution_chunks(member, chunk_days) if chunk_days > 0 else []
+        if chunks is None:
+            logger.warning(
+                "Only date stopped, single tape runs without restart can be chunked"
+            )
+        runs.append(chunks if chunks and len(chunks) > 1 else [member])
+
+    configs = [run for member_runs in runs for run in member_runs]
+    names_or_none = names or [None]
+    if len(configs) == 1:
+        if cache:
+            # The history file is kept in the convolutions cache instead
+            convolve(config, engine, params)
+        else:
+            convolve_run(
+                config,
+                engine,
+                params,
+                not bypass_cache,
+                run_key and checkpoint_key(run_key, config),
+            )
+        if progress:
+            progress(1, 1, names_or_none[0])
+    else:
+        logger.info(f"Convolving {len(configs)} runs on {np} workers")
+        # params are sent once to every worker rather than with every run
+        with ProcessPoolExecutor(
+            max_workers=np, initializer=share_params, initargs=(params,)
+        ) as executor:
+            futures = {
+                executor.submit(
+                    convolve_shared,
+                    run,
+                    engine,
+                    not bypass_cache,
+                    run_key and checkpoint_key(run_key, run, m if names else None),
+                ): m
+                for m, member_runs in enumerate(runs)
+                for run in member_runs
+            }
+            pending = [len(member_runs) for member_runs in runs]
+            done = 0
+            for future in as_completed(futures):
+                # Raise worker errors here
+                future.result()
+                m = futures[future]
+                pending[m] -= 1
+                if not pending[m]:
+                    done += 1
+                    if progress:
+                        progress(done, len(runs), names_or_none[m])
+
+        for member, member_runs in zip(members, runs):
+            if len(member_runs) > 1:
+                join_chunks(member, member_runs)
+
+    if names:
+        outdir = os.path.join(config["OPTIONS"]["CASE_DIR"], "hist")
+        os.makedirs(outdir, exist_ok=True)
+        stack_hist_files(
+            [get_outfile(member, "hist") for member in members],
+            os.path.join(outdir, get_outfile_name(config, "hist")),
+            names,
+            memory_budget(),
+        )
+    else:
+        if previous_hist:
+            hist_file = get_outfile(config, "hist")
+            concat_hist_files(
+                [previous_hist, hist_file], hist_file + ".joined", memory_budget()
+            )
+            os.replace(hist_file + ".joined", hist_file)
+        keep_restart(config)
+
+    if cache:
+        cache.put(key, [get_outfile(config, "hist")], replace=bypass_cache)
+
+
+def scenario_meta_link(workdir, hist_file, n_scenarios):
+    """
+    Return a metalink document with the history file of every forcing
+    scenario routed by run_convolution into hist_file. With several
+    scenarios the stacked file is split into one file per scenario.
+    """
+    if n_scenarios > 1:
+        hist_files = unstack_hist_file(
+            hist_file, os.path.join(workdir, "scenarios"), memory_budget()
+        )
+    else:
+        hist_files = [hist_file]
+
+    meta_link = MetaLink4(
+        "scenarios",
+        "History files of the forcing scenarios",
+        workdir=workdir,
+    )
+    for path in hist_files:
+        meta_file = MetaFile(
+            os.path.basename(path), "Streamflow of one scenario", fmt=FORMATS.NETCDF
+        )
+        meta_file.file = path
+        meta_link.append(meta_file)
+    return meta_link.xml
@@ -0,0 +1,187 @@
+import os
+import pytest
+from pathlib import Path
+
+from osprey.cache import FileCache, hash_file, hash_inputs, parse_age
+
+
+def make_file(directory, name, size):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return path
+
+
+def test_cache_hit_miss(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"), 1024)
+    src = make_file(tmp_path, "params.nc", 100)
+
+    assert cache.get("key") is None
+    entry = cache.put("key", [src])
+    assert cache.get("key") == entry
+    assert os.listdir(entry) == ["params.nc"]
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_cache_lru_eviction(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"), 250)
+    for key in ["a", "b"]:
+        cache.put(key, [make_file(tmp_path, f"{key}.nc", 100)])
+        os.utime(cache.entry(key), (0, 0) if key == "a" else None)
+
+    # "a" is the oldest entry, reading it makes "b" the least recently used
+    cache.get("a")
+    cache.put("c", [make_file(tmp_path, "c.nc", 100)])
+
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_open_entry_not_evicted(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"), 250)
+    cache.put("a", [make_file(tmp_path, "a.nc", 200)])
+    os.utime(cache.entry("a"), (0, 0))
+
+    # "a" is the least recently used entry but is being read
+    with cache.open("a") as entry:
+        cache.put("b", [make_file(tmp_path, "b.nc", 200)])
+        assert os.listdir(entry) == ["a.nc"]
+    cache.put("c", [make_file(tmp_path, "c.nc", 200)])
+
+    assert cache.get("a") is None and cache.get("b") is None
+    assert cache.get("c")
+
+
+def test_cache_lock_files_removed(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"), 250)
+    cache.put("a", [make_file(tmp_path, "a.nc", 200)])
+    with cache.open("a"), cache.open("missed") as entry:
+        assert entry is None
+        # Lock files of entries being read stay
+        cache.put("b", [make_file(tmp_path, "b.nc", 200)])
+        assert {".lock-a", ".lock-missed"} <= set(os.listdir(cache.cache_dir))
+    cache.put("c", [make_file(tmp_path, "c.nc", 200)])
+
+    # The lock files of the evicted entry and of the miss are gone
+    assert {name for name in os.listdir(cache.cache_dir) if name[0] == "."} == {".lock"}
+    with cache.open("a") as entry:
+        assert entry is None
+
+
+@pytest.mark.parametrize(
+    ("config", "other", "same"),
+    [
+        (
+            {"OPTIONS": {"GRIDID": "COLUMBIA"}},
+            {"OPTIONS": {"GRIDID": "COLUMBIA"}},
+            True,
+        ),
+        ({"OPTIONS": {"GRIDID": "COLUMBIA"}}, {"OPTIONS": {"GRIDID": "FRASER"}}, False),
+    ],
+)
+def test_hash_inputs(tmp_path, config, other, same):
+    src = make_file(tmp_path, "routing.nc", 100)
+    assert (hash_inputs([src], config) == hash_inputs([src], other)) == same
+
+
+def test_cache_put_replace(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"), 1024)
+    cache.put("key", [make_file(tmp_path, "old.nc", 100)])
+
+    entry = cache.put("key", [make_file(tmp_path, "new.nc", 100)])
+    assert os.listdir(entry) == ["old.nc"]
+
+    entry = cache.put("key", [make_file(tmp_path, "new.nc", 100)], replace=True)
+    assert os.listdir(entry) == ["new.nc"]
+    assert cache.stats()["entries"] == 1
+
+
+def test_cache_expiry(tmp_path):
+    assert [parse_age(age) for age in ("90", "90s", "2h", "7d")] == [
+        90,
+        90,
+        7200,
+        604800,
+    ]
+    cache = FileCache(str(tmp_path / "cache"), 1024, max_age=60)
+    for key in ["old", "new"]:
+        entry = cache.put(key, [make_file(tmp_path, f"{key}.nc", 100)])
+        if key == "old":
+            os.utime(os.path.join(entry, "old.nc"), (0, 0))
+
+    # Using an entry does not make it younger
+    assert cache.get("old") is None
+    assert cache.get("new")
+    assert cache.stats()["expirations"] == 1
+
+
+def test_cache_fetch(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"), 1024)
+    src = make_file(tmp_path, "routing.nc", 100)
+    url = Path(src).as_uri()
+    workdirs = [tmp_path / "job1", tmp_path / "job2"]
+    for workdir in workdirs:
+        workdir.mkdir()
+        cache.fetch(url, str(workdir / "routing.nc"))
+
+    # The second job is served from the cache and shares the first one's file
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    job1, job2 = (os.stat(workdir / "routing.nc") for workdir in workdirs)
+    assert job1.st_ino == job2.st_ino
+    with open(src, "rb") as f:
+        assert (workdirs[1] / "routing.nc").read_bytes() == f.read()
+
+    # A new version of the resource is downloaded again
+    os.utime(src, (0, 0))
+    cache.fetch(url, str(workdirs[1] / "routing.nc"))
+    assert cache.stats()["entries"] == 2
+
+
+def test_hash_file_identity(tmp_path):
+    src = make_file(tmp_path, "routing.nc", 100)
+    link = str(tmp_path / "link.nc")
+    os.link(src, link)
+
+    by_content = hash_file(src).hexdigest()
+    identity = hash_file(src, max_content=0).hexdigest()
+    assert identity != by_content
+    assert hash_file(link, max_content=0).hexdigest() == identity
+    assert hash_file(src, max_content=100).hexdigest() == by_content
+
+    # Rewriting the file changes its identity
+    os.utime(src, (0, 0))
+    assert hash_file(link, max_content=0).hexdigest() != identity
+
+
+def test_convolution_cache_key_in_place(tmp_path, monkeypatch):
+    from osprey import utils
+
+    jobs = tmp_path / "jobs"
+    os.makedirs(jobs / "job" / "forcings")
+    monkeypatch.setattr(
+        utils.configuration, "get_config_value", lambda *args: str(jobs)
+    )
+    params = make_file(tmp_path, "params.nc", 100)
+    domain = make_file(tmp_path, "domain.nc", 100)
+    forcing = make_file(jobs / "job" / "forcings", "forcing.nc", 100)
+    config = {
+        "PARAM_FILE": {"FILE_NAME": params},
+        "DOMAIN": {"FILE_NAME": domain},
+        "INPUT_FORCINGS": {
+            "DATL_PATH": str(jobs / "job" / "forcings"),
+            "DATL_FILE": "forcing.nc",
+        },
+        "INITIAL_STATE": {"FILE_NAME": None},
+    }
+    key = utils.convolution_cache_key(config, None, "numpy")
+
+    # The copy in the job's directory is identified by its content
+    os.utime(forcing, ns=(0, 0))
+    assert utils.convolution_cache_key(config, None, "numpy") == key
+    # Files read in place by their modification time, without reading them
+    os.utime(params, ns=(0, 0))
+    assert utils.convolution_cache_key(config, None, "numpy") != key
@@ -0,0 +1,81 @@
+import hashlib
+import os
+import pytest
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from osprey import download as download_module
+from osprey.download import download
+
+CONTENT = os.urandom(10000)
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Serves CONTENT with Range support, dropping the first transfer halfway."""
+
+    dropped = False
+
+    def do_GET(self):
+        start = 0
+        if "Range" in self.headers:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(CONTENT) - start))
+        self.end_headers()
+
+        if not FlakyHandler.dropped:
+            FlakyHandler.dropped = True
+            self.wfile.write(CONTENT[start : len(CONTENT) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(CONTENT[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(download_module, "BACKOFF", 0)
+    FlakyHandler.dropped = False
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}/forcing.nc"
+    httpd.shutdown()
+
+
+def test_download_resumes(tmp_path, server):
+    reports = []
+    digest = hashlib.sha256(CONTENT).hexdigest()
+    path = download(
+        f"{server}#sha256={digest}",
+        str(tmp_path / "forcing.nc"),
+        progress=lambda *report: reports.append(report),
+    )
+
+    with open(path, "rb") as f:
+        assert f.read() == CONTENT
+    assert reports[-1][1:3] == (len(CONTENT), len(CONTENT))
+    assert not os.path.exists(path + ".part")
+
+
+def test_download_checksum_mismatch(tmp_path, server):
+    with pytest.raises(ValueError):
+        download(f"{server}#md5={'0' * 32}", str(tmp_path / "forcing.nc"))
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("size_reported", [True, False])
+def test_download_max_size(tmp_path, server, monkeypatch, size_reported):
+    if not size_reported:
+        # The transfer is aborted once the limit is passed
+        monkeypatch.setattr(download_module, "expected_size", lambda *args: None)
+        monkeypatch.setattr(download_module, "CHUNK_SIZE", 1000)
+    with pytest.raises(ValueError, match="larger than the limit"):
+        download(server, str(tmp_path / "forcing.nc"), max_size=len(CONTENT) // 4)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,356 @@
+from importlib.resources import files
+from configparser import ConfigParser
+from functools import partial
+from netCDF4 import Dataset, chartostring
+from pytest import mark, raises
+import json
+import numpy as np
+import os
+
+from wps_tools.testing import url_path
+from osprey.engine import (
+    direct_convolve,
+    fft_convolve,
+    numba_convolution,
+    numpy_convolution,
+    read_params,
+    route,
+    slab_bounds,
+    unit_hydrographs,
+)
+from osprey import utils
+from osprey.cache import FileCache
+from osprey.utils import (
+    convolve_config_handler,
+    get_outfile,
+    restart_key,
+    run_convolution,
+    scenario_meta_link,
+)
+
+
+def rvic_ring_loop(runoff, sub_uh, offsets, outlets, n_outlets, length):
+    """RVIC's convolution: roll the ring and add every source's runoff"""
+    ring = np.zeros((length, n_outlets))
+    flows, rings = [], []
+    for step_runoff in runoff:
+        ring[0, :] = 0.0
+        ring = np.roll(ring, -1, axis=0)
+        for s, outlet in enumerate(outlets):
+            for i in range(sub_uh.shape[0]):
+                ring[i + offsets[s], outlet] += sub_uh[i, s] * step_runoff[s]
+        flows.append(ring[0].copy())
+        rings.append(ring.copy())
+    return np.array(flows), rings
+
+
+def test_convolution_kernels():
+    rng = np.random.default_rng(0)
+    n_sources, n_outlets, subset_length, full_length = 7, 3, 5, 9
+    params = {
+        "unit_hydrograph": rng.random((subset_length, n_sources)),
+        "full_time_length": full_length,
+        "source_time_offset": rng.integers(0, full_length - subset_length, n_sources),
+    }
+    outlets = rng.integers(0, n_outlets, n_sources)
+    runoff = rng.random((30, n_sources))
+
+    expected, rings = rvic_ring_loop(
+        runoff,
+        params["unit_hydrograph"],
+        params["source_time_offset"],
+        outlets,
+        n_outlets,
+        full_length,
+    )
+    uh = unit_hydrographs(params)
+    # Spectra of one source at a time when the memory budget leaves no room
+    for kernel in (fft_convolve, partial(fft_convolve, max_bytes=0), direct_convolve):
+        np.testing.assert_allclose(
+            kernel(runoff, uh, outlets, n_outlets), expected, atol=1e-12
+        )
+    for slab_steps, step in ((0, 5), (4, 5), (7, 29), (30, 29)):
+        bounds = slab_bounds(len(runoff), slab_steps, [step + 1])
+        slabs = list(
+            route(
+                ((first, runoff[first:stop]) for first, stop in bounds),
+                uh,
+                outlets,
+                n_outlets,
+                fft_convolve,
+                step,
+            )
+        )
+        flows = np.concatenate([flows for _, flows, _ in slabs])
+        (ring,) = [ring for _, _, ring in slabs if ring is not None]
+        np.testing.assert_allclose(flows, expected, atol=1e-12)
+        np.testing.assert_allclose(ring, rings[step], atol=1e-12)
+
+
+def convolve_config(workdir, forcing):
+    return convolve_config_handler(
+        workdir,
+        "sample",
+        "2012-12-01-00",
+        "2012-12-31",
+        str(files("tests") / "data/samples/sample_routing_domain.nc"),
+        str(files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"),
+        forcing,
+        str(files("tests") / "data/configs/convolve.cfg"),
+        None,
+    )
+
+
+@mark.slow
+@mark.online
+def test_numpy_convolution_matches_rvic(tmp_path):
+    from rvic.convolution import convolution
+
+    forcing = url_path("columbia_vicset2.nc", "opendap", "climate_explorer_data_prep")
+    outputs = []
+    for name, engine in (("rvic", convolution), ("numpy", numpy_convolution)):
+        config = convolve_config(str(tmp_path), forcing)
+        config["OPTIONS"]["CASE_DIR"] = str(tmp_path / name)
+        engine(config)
+        outputs.append(get_outfile(config, "hist"))
+
+    with Dataset(outputs[0]) as rvic, Dataset(outputs[1]) as ds:
+        assert ds["streamflow"].shape == rvic["streamflow"].shape
+        np.testing.assert_allclose(
+            ds["streamflow"][:], rvic["streamflow"][:], rtol=1e-5
+        )
+        for name in ("time", "time_bnds", "outlet_y_ind", "outlet_decomp_ind"):
+            assert (ds[name][:] == rvic[name][:]).all()
+    assert os.path.isfile(str(tmp_path / "numpy" / "restarts" / "rpointer"))
+
+
+def write_forcing_file(path, param_file, n_days, seed=0):
+    """
+    Random RUNOFF and BASEFLOW from 2012-11-20 around the sources of
+    param_file on the sample domain grid. The rest of the grid is left
+    unwritten, so the file stays small.
+    """
+    rng = np.random.default_rng(seed)
+    with Dataset(param_file) as params:
+        source_lat, source_lon = params["source_lat"][0], params["source_lon"][0]
+    with Dataset(str(files("tests") / "data/samples/sample_routing_domain.nc")) as dom:
+        lats, lons = dom["lat"][:], dom["lon"][:]
+    y, x = np.abs(lats - source_lat).argmin(), np.abs(lons - source_lon).argmin()
+    block = (slice(None), slice(y - 2, y + 3), slice(x - 2, x + 3))
+    with Dataset(path, "w") as ds:
+        ds.createDimension("time", n_days)
+        ds.createDimension("lat", len(lats))
+        ds.createDimension("lon", len(lons))
+        time = ds.createVariable("time", "f8", ("time",))
+        time.units = "days since 2012-11-20"
+        time.calendar = "standard"
+        time[:] = np.arange(n_days)
+        ds.createVariable("lat", "f8", ("lat",))[:] = lats
+        ds.createVariable("lon", "f8", ("lon",))[:] = lons
+        for name in ("RUNOFF", "BASEFLOW"):
+            var = ds.createVariable(
+                name, "f4", ("time", "lat", "lon"), chunksizes=(n_days, 8, 8)
+            )
+            var.units = "mm"
+            var[block] = rng.random((n_days, 5, 5), dtype="f4")
+    return path
+
+
+def restart_ring(config):
+    """The LIQ_ring of the restart file the rpointer of a run points to."""
+    restarts = os.path.join(config["OPTIONS"]["CASE_DIR"], "restarts")
+    pointer = ConfigParser()
+    pointer.read(os.path.join(restarts, "rpointer"))
+    restart_file = os.path.basename(pointer["RESTART"]["FILE_NAME"])
+    with Dataset(os.path.join(restarts, restart_file)) as ds:
+        return ds["LIQ_ring"][:]
+
+
+@mark.parametrize("engine", (numpy_convolution, numba_convolution))
+def test_convolution_engine_matches_rvic(tmp_path, engine):
+    from rvic.convolution import convolution
+
+    param_file = str(
+        files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"
+    )
+    forcing = write_forcing_file(str(tmp_path / "forcing.nc"), param_file, 140)
+    configs = []
+    for name, run in (("rvic", convolution), ("engine", engine)):
+        config = convolve_config(str(tmp_path), forcing)
+        options = config["OPTIONS"]
+        options["CASE_DIR"] = str(tmp_path / name)
+        options["STOP_DATE"] = options["REST_DATE"] = "2013-03-31"
+        run(config)
+        configs.append(config)
+
+    rvic, config = configs
+    with Dataset(get_outfile(rvic, "hist")) as expected:
+        with Dataset(get_outfile(config, "hist")) as ds:
+            assert ds["streamflow"].shape == expected["streamflow"].shape
+            np.testing.assert_allclose(
+                ds["streamflow"][:], expected["streamflow"][:], rtol=1e-5
+            )
+            for name in ("time", "time_bnds"):
+                assert (ds[name][:] == expected[name][:]).all()
+    # The state at the end of the run continues it the same way, up to the
+    # round-off of the FFT where the ring has drained
+    np.testing.assert_allclose(
+        restart_ring(config), restart_ring(rvic), rtol=1e-5, atol=1e-12
+    )
+
+
+# Chunks of the numpy engine get the parameters from memory in their workers
+# or read the file
+@mark.parametrize(
+    ("engine", "in_memory"), [("rvic", False), ("numpy", False), ("numpy", True)]
+)
+def test_chunked_convolution_matches_single_run(tmp_path, engine, in_memory):
+    param_file = str(
+        files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"
+    )
+    forcing = write_forcing_file(str(tmp_path / "forcing.nc"), param_file, 420)
+    params = read_params(param_file) if in_memory else None
+    outputs = []
+    # The unit hydrographs last 100 days, chunks must be longer
+    for chunk_days in (0, 120):
+        config = convolve_config(str(tmp_path), forcing)
+        options = config["OPTIONS"]
+        options["CASE_DIR"] = str(tmp_path / f"chunks_{chunk_days}")
+        options["STOP_DATE"] = options["REST_DATE"] = "2013-12-31"
+        run_convolution(
+            config, np=2, chunk_days=chunk_days, engine=engine, params=params
+        )
+        outputs.append(get_outfile(config, "hist"))
+    assert len(os.listdir(str(tmp_path / "chunks_120" / "chunks"))) == 4
+
+    with Dataset(outputs[0]) as single, Dataset(outputs[1]) as ds:
+        assert ds["streamflow"].shape == single["streamflow"].shape
+        np.testing.assert_allclose(
+            ds["streamflow"][:], single["streamflow"][:], rtol=1e-5
+        )
+        for name in ("time", "time_bnds"):
+            assert (ds[name][:] == single[name][:]).all()
+
+
+def test_chunked_convolution_resumes_from_checkpoints(tmp_path, monkeypatch):
+    param_file = str(
+        files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"
+    )
+    forcing = write_forcing_file(str(tmp_path / "forcing.nc"), param_file, 420)
+    monkeypatch.setattr(
+        FileCache,
+        "from_config",
+        lambda name: (
+            FileCache(str(tmp_path / "cache" / name), 2**30)
+            if name == "checkpoints"
+            else None
+        ),
+    )
+    outputs = []
+    for attempt in range(2):
+        config = convolve_config(str(tmp_path), forcing)
+        options = config["OPTIONS"]
+        options["CASE_DIR"] = str(tmp_path / f"attempt_{attempt}")
+        options["STOP_DATE"] = options["REST_DATE"] = "2013-12-31"
+        run_convolution(config, np=2, chunk_days=120, engine="numpy")
+        outputs.append(get_outfile(config, "hist"))
+
+        def convolve(*args):
+            raise AssertionError("Convolved a checkpointed chunk again")
+
+        # The chunks of the resubmitted run are restored
+        monkeypatch.setattr(utils, "convolve", convolve)
+
+    with Dataset(outputs[0]) as first, Dataset(outputs[1]) as ds:
+        for name in ("streamflow", "time", "time_bnds"):
+            assert (ds[name][:] == first[name][:]).all()
+    assert os.path.isfile(str(tmp_path / "attempt_1" / "restarts" / "rpointer"))
+
+
+def test_ensemble_convolution_stacks_members(tmp_path):
+    param_file = str(
+        files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"
+    )
+    # Members named after the same file are told apart by their index
+    forcings = []
+    for seed, path in enumerate(("a/forcing.nc", "b/forcing.nc", "c/other.nc")):
+        os.makedirs(os.path.dirname(str(tmp_path / path)), exist_ok=True)
+        forcings.append(write_forcing_file(str(tmp_path / path), param_file, 60, seed))
+
+    singles = []
+    for i, forcing in enumerate(forcings):
+        config = convolve_config(str(tmp_path), forcing)
+        config["OPTIONS"]["CASE_DIR"] = str(tmp_path / f"single_{i}")
+        run_convolution(config, engine="numpy")
+        singles.append(get_outfile(config, "hist"))
+
+    config = convolve_config(str(tmp_path), forcings[0])
+    config["OPTIONS"]["CASE_DIR"] = str(tmp_path / "ensemble")
+    run_convolution(config, np=2, input_forcings=forcings, engine="numpy")
+    hist_file = get_outfile(config, "hist")
+
+    names = ["forcing", "forcing_1", "other"]
+    with Dataset(hist_file) as ds:
+        assert list(chartostring(ds["ensemble_member"][:])) == names
+        assert ds["streamflow"].dimensions[0] == "ensemble"
+        for i, single_file in enumerate(singles):
+            with Dataset(single_file) as single:
+                assert (ds["streamflow"][i] == single["streamflow"][:]).all()
+                for name in ("time", "time_bnds"):
+                    assert (ds[name][:] == single[name][:]).all()
+
+    # Every scenario is handed out as a history file of its own
+    workdir = str(tmp_path / "ensemble")
+    meta_link = scenario_meta_link(workdir, hist_file, len(forcings))
+    stem = os.path.splitext(os.path.basename(hist_file))[0]
+    for name, single_file in zip(names, singles):
+        scenario_file = os.path.join(workdir, "scenarios", f"{stem}.{name}.nc")
+        assert os.path.basename(scenario_file) in meta_link
+        with Dataset(scenario_file) as ds, Dataset(single_file) as single:
+            assert ds.variables.keys() == single.variables.keys()
+            for var in ("streamflow", "time", "time_bnds"):
+                assert (ds[var][:] == single[var][:]).all()
+
+
+def test_continued_convolution_matches_single_run(tmp_path, monkeypatch):
+    param_file = str(
+        files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"
+    )
+    forcing = write_forcing_file(str(tmp_path / "forcing.nc"), param_file, 420)
+    caches = {}
+    monkeypatch.setattr(FileCache, "from_config", lambda name: caches.get(name))
+
+    def run(case_dir, stop_date, continue_run=False):
+        config = convolve_config(str(tmp_path), forcing)
+        options = config["OPTIONS"]
+        options["CASE_DIR"] = str(tmp_path / case_dir)
+        options["STOP_DATE"] = options["REST_DATE"] = stop_date
+        run_convolution(config, continue_run=continue_run, engine="numpy")
+        return config
+
+    single = get_outfile(run("single", "2013-12-31"), "hist")
+
+    cache = caches["restarts"] = FileCache(str(tmp_path / "restarts"), 2**30)
+    timestamps = []
+    for case_dir, stop_date, continue_run in (
+        ("first", "2013-06-30", False),
+        ("continued", "2013-12-31", True),
+    ):
+        config = run(case_dir, stop_date, continue_run)
+        # The state of the case is replaced by the one the run ended with
+        assert cache.stats()["entries"] == 1
+        with open(os.path.join(cache.get(restart_key(config)), "restart.json")) as f:
+            timestamps.append(json.load(f)["timestamp"])
+    assert timestamps == ["2013-07-01-00", "2014-01-01-00"]
+
+    with Dataset(single) as ds, Dataset(get_outfile(config, "hist")) as continued:
+        assert continued["streamflow"].shape == ds["streamflow"].shape
+        np.testing.assert_allclose(
+            continued["streamflow"][:], ds["streamflow"][:], rtol=1e-5
+        )
+        for name in ("time", "time_bnds"):
+            assert (continued[name][:] == ds[name][:]).all()
+
+    # The kept state is past the end of the requested run
+    with raises(ValueError):
+        run("again", "2013-06-30", continue_run=True)
@@ -0,0 +1,83 @@
+from netCDF4 import Dataset
+import numpy as np
+import pytest
+
+from osprey import utils
+from osprey.forcing import write_forcing_subset
+
+
+def write_forcing_file(path):
+    with Dataset(path, "w") as ds:
+        ds.createDimension("time", None)
+        ds.createDimension("lat", 3)
+        ds.createDimension("lon", 4)
+        time = ds.createVariable("time", "f8", ("time",))
+        time.units = "days since 2012-11-28"
+        time.calendar = "standard"
+        time[:] = np.arange(10)
+        ds.createVariable("lat", "f8", ("lat",))[:] = [49.0, 50.0, 51.0]
+        ds.createVariable("lon", "f8", ("lon",))[:] = [-120.0, -119.0, -118.0, -117.0]
+        runoff = ds.createVariable("RUNOFF", "f4", ("time", "lat", "lon"))
+        runoff.units = "mm"
+        runoff[:] = np.arange(10 * 3 * 4).reshape(10, 3, 4)
+        ds.createVariable("prec", "f4", ("time", "lat", "lon"))[:] = 0
+    return path
+
+
+@pytest.mark.parametrize("max_bytes", [None, 8])
+def test_write_forcing_subset(tmp_path, max_bytes):
+    forcing_file = write_forcing_file(str(tmp_path / "forcing.nc"))
+    # The northern row, counted first as RVIC does, and two columns
+    window = (slice(0, 1), slice(1, 3))
+    subset = write_forcing_subset(
+        forcing_file,
+        str(tmp_path / "subset.nc"),
+        ["RUNOFF"],
+        "time",
+        "lat",
+        window,
+        "2012-12-01-00",
+        "2012-12-02",
+        max_bytes,
+    )
+
+    with Dataset(forcing_file) as full, Dataset(subset) as ds:
+        assert list(ds["time"][:]) == [3.0, 4.0, 5.0]
+        assert list(ds["lat"][:]) == [51.0]
+        assert list(ds["lon"][:]) == [-119.0, -118.0]
+        assert (ds["RUNOFF"][:] == full["RUNOFF"][3:6, 2:3, 1:3]).all()
+        assert ds["RUNOFF"].units == "mm"
+        assert "prec" not in ds.variables
+
+
+def test_write_forcing_subset_whole_grid(tmp_path):
+    forcing_file = write_forcing_file(str(tmp_path / "forcing.nc"))
+    subset = write_forcing_subset(
+        forcing_file,
+        str(tmp_path / "subset.nc"),
+        ["RUNOFF"],
+        "time",
+        "lat",
+        None,
+        "2012-12-01-00",
+    )
+
+    with Dataset(forcing_file) as full, Dataset(subset) as ds:
+        assert list(ds["time"][:]) == list(range(3, 10))
+        assert (ds["RUNOFF"][:] == full["RUNOFF"][3:]).all()
+        assert "prec" not in ds.variables
+
+
+@pytest.mark.parametrize("stage", [True, False])
+def test_grid_output_staging(monkeypatch, stage):
+    monkeypatch.setattr(utils, "stage_grid_inputs", lambda: stage)
+    monkeypatch.setattr(utils, "stage_grid_config", lambda config: "staged")
+    config = {
+        "OPTIONS": {},
+        "INPUT_FORCINGS": {"START": None},
+        "HISTORY": {"RVICHIST_OUTTYPE": "grid"},
+    }
+
+    subset, outlet_indices, params = utils.subset_forcing_config(config)
+    assert subset == ("staged" if stage else config)
+    assert outlet_indices is None
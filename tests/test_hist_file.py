@@ -0,0 +1,77 @@
+from netCDF4 import Dataset, chartostring
+import numpy as np
+import os
+import pytest
+
+from osprey.hist_file import concat_hist_files, stack_hist_files, unstack_hist_file
+
+
+def write_hist_file(path, times):
+    with Dataset(path, "w") as ds:
+        ds.createDimension("time", None)
+        ds.createDimension("outlets", 1)
+        ds.createVariable("time", "f8", ("time",))[:] = times
+        ds.createVariable("lon", "f8", ("outlets",))[:] = -118.0938
+        ds.createVariable("streamflow", "f4", ("time", "outlets"))[:] = np.reshape(
+            times, (-1, 1)
+        )
+    return path
+
+
+@pytest.mark.parametrize("max_bytes", [None, 4, 12])
+def test_concat_hist_files(tmp_path, max_bytes):
+    # The second file spins up over the last two days of the first one
+    hist_files = [
+        write_hist_file(str(tmp_path / "0.nc"), [1.0, 2.0, 3.0, 4.0]),
+        write_hist_file(str(tmp_path / "1.nc"), [3.0, 4.0, 5.0, 6.0]),
+    ]
+    joined = concat_hist_files(hist_files, str(tmp_path / "joined.nc"), max_bytes)
+
+    with Dataset(joined) as ds:
+        assert list(ds["time"][:]) == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+        assert list(ds["streamflow"][:, 0]) == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+        assert ds["lon"].shape == (1,)
+
+
+@pytest.mark.parametrize("max_bytes", [None, 4])
+def test_stack_hist_files(tmp_path, max_bytes):
+    hist_files = [
+        write_hist_file(str(tmp_path / f"{member}.nc"), [1.0, 2.0])
+        for member in ["CanESM2", "ACCESS1-0"]
+    ]
+    stacked = stack_hist_files(
+        hist_files, str(tmp_path / "stacked.nc"), ["CanESM2", "ACCESS1-0"], max_bytes
+    )
+
+    with Dataset(stacked) as ds:
+        assert ds["streamflow"].dimensions == ("ensemble", "time", "outlets")
+        assert ds["streamflow"].shape == (2, 2, 1)
+        assert (ds["streamflow"][:, :, 0] == [[1.0, 2.0], [1.0, 2.0]]).all()
+        assert ds["time"].shape == (2,)
+        assert list(chartostring(ds["ensemble_member"][:])) == [
+            "CanESM2",
+            "ACCESS1-0",
+        ]
+
+
+@pytest.mark.parametrize("max_bytes", [None, 4])
+def test_unstack_hist_file(tmp_path, max_bytes):
+    hist_files = [
+        write_hist_file(str(tmp_path / f"{member}.nc"), [1.0, 2.0])
+        for member in ["CanESM2", "ACCESS1-0"]
+    ]
+    stacked = stack_hist_files(
+        hist_files, str(tmp_path / "stacked.nc"), ["CanESM2", "ACCESS1-0"]
+    )
+    members = unstack_hist_file(stacked, str(tmp_path / "members"), max_bytes)
+
+    assert [os.path.basename(member) for member in members] == [
+        "stacked.CanESM2.nc",
+        "stacked.ACCESS1-0.nc",
+    ]
+    for hist_file, member in zip(hist_files, members):
+        with Dataset(hist_file) as expected, Dataset(member) as ds:
+            assert set(ds.variables) == set(expected.variables)
+            assert set(ds.dimensions) == set(expected.dimensions)
+            for name in expected.variables:
+                assert (ds[name][:] == expected[name][:]).all()
@@ -0,0 +1,123 @@
+from importlib.resources import files
+from netCDF4 import Dataset
+import numpy as np
+import shutil
+
+from osprey.param_file import (
+    SPARSE_DIM,
+    copy_param_file,
+    crop_param_file,
+    densify_param_file,
+    merge_param_files,
+    read_unit_hydrograph,
+    source_window,
+    sparsify_param_file,
+    uncrop_param_file,
+)
+from osprey.routing import covering_window, nearest_index, write_subset
+
+
+def test_merge_param_files(tmp_path):
+    param_file = str(
+        files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"
+    )
+    merged = merge_param_files(
+        [param_file, param_file],
+        str(tmp_path / "merged.nc"),
+        RvicPourPointsFile="all.csv",
+    )
+
+    with Dataset(param_file) as single, Dataset(merged) as ds:
+        n_outlets = len(single.dimensions["outlets"])
+        n_sources = len(single.dimensions["sources"])
+        assert len(ds.dimensions["outlets"]) == 2 * n_outlets
+        assert len(ds.dimensions["sources"]) == 2 * n_sources
+        assert (ds["source2outlet_ind"][n_sources:] >= n_outlets).all()
+        assert ds["unit_hydrograph"].shape[0] == single["unit_hydrograph"].shape[0]
+        assert ds.RvicPourPointsFile == "all.csv"
+
+
+def test_copy_param_file(tmp_path):
+    param_file = str(
+        files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"
+    )
+    copied = copy_param_file(param_file, str(tmp_path / "copy.nc"))
+
+    with Dataset(param_file) as expected, Dataset(copied) as ds:
+        assert ds.__dict__ == expected.__dict__
+        assert ds.dimensions.keys() == expected.dimensions.keys()
+        for name, var in expected.variables.items():
+            assert ds[name].dimensions == var.dimensions
+            assert ds[name].__dict__ == var.__dict__
+            assert (ds[name][...] == var[...]).all()
+
+
+def test_uncrop_param_file(tmp_path):
+    param_file = str(
+        files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"
+    )
+    domain_file = str(files("tests") / "data/samples/sample_routing_domain.nc")
+    cropped_file = str(tmp_path / "cropped.nc")
+    shutil.copyfile(param_file, cropped_file)
+
+    with Dataset(param_file) as ds:
+        lats, lons = ds["outlet_lat"][:], ds["outlet_lon"][:]
+    window, shape, ascending = covering_window(domain_file, "lat", "lon", lats, lons)
+    cropped_domain = write_subset(
+        domain_file, str(tmp_path / "domain.nc"), "lat", "lon", window
+    )
+
+    # Index the outlet on the cropped domain the way RVIC does
+    with Dataset(cropped_domain) as domain, Dataset(cropped_file, "a") as ds:
+        dom_lats = domain["lat"][::-1] if ascending else domain["lat"][:]
+        ys = nearest_index(dom_lats, lats)
+        xs = nearest_index(domain["lon"][:], lons)
+        file_ys = len(dom_lats) - 1 - ys if ascending else ys
+        for point in ("source", "outlet"):
+            ds[f"{point}_y_ind"][:] = ys
+            ds[f"{point}_x_ind"][:] = xs
+            ds[f"{point}_decomp_ind"][:] = file_ys * len(domain["lon"]) + xs
+
+    uncrop_param_file(cropped_file, window, shape, ascending)
+
+    with Dataset(param_file) as expected, Dataset(cropped_file) as ds:
+        for point in ("source", "outlet"):
+            for ind in ("y_ind", "x_ind", "decomp_ind"):
+                name = f"{point}_{ind}"
+                assert (ds[name][:] == expected[name][:]).all()
+
+
+def test_crop_param_file(tmp_path):
+    param_file = str(
+        files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"
+    )
+    window = source_window(param_file)
+    cropped = crop_param_file(param_file, str(tmp_path / "cropped.nc"), window)
+
+    with Dataset(param_file) as full, Dataset(cropped) as ds:
+        assert (
+            ds["source_y_ind"][:] == full["source_y_ind"][:] - window[0].start
+        ).all()
+        assert (
+            ds["source_x_ind"][:] == full["source_x_ind"][:] - window[1].start
+        ).all()
+        assert ds["outlet_y_ind"][:].min() >= 0 and ds["outlet_x_ind"][:].min() >= 0
+        assert (ds["outlet_decomp_ind"][:] == full["outlet_decomp_ind"][:]).all()
+
+
+def test_sparse_param_file(tmp_path):
+    param_file = str(
+        files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"
+    )
+    sparse = sparsify_param_file(param_file, str(tmp_path / "sparse.nc"))
+    merged = merge_param_files([sparse, sparse], str(tmp_path / "merged.nc"))
+    dense = densify_param_file(merged, str(tmp_path / "dense.nc"))
+
+    with Dataset(param_file) as full, Dataset(sparse) as ds:
+        uh = full["unit_hydrograph"][:]
+        assert "unit_hydrograph" not in ds.variables
+        assert len(ds.dimensions[SPARSE_DIM]) == (uh != 0).sum()
+        assert (read_unit_hydrograph(ds) == uh).all()
+
+    with Dataset(dense) as ds:
+        assert (ds["unit_hydrograph"][:] == np.concatenate([uh, uh], axis=1)).all()
@@ -0,0 +1,146 @@
+from importlib.resources import files
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+from osprey.config_templates import params_config_template
+from osprey.routing import (
+    GridIndex,
+    UpstreamIndex,
+    basin_groups,
+    new_pour_points,
+    write_subset,
+)
+
+
+@pytest.mark.parametrize(
+    ("pour_points", "expected"),
+    [
+        ("lons,lats\n-118.0938,51.09375\n", {49: 1}),
+        ("lons,lats\n-116.21875,41.21875\n-124.09375,41.96875\n", {49: 1, 3: 1}),
+        ("# comment\nx,y\n0,0\n", {-1: 1}),
+    ],
+)
+def test_basin_groups(tmp_path, pour_points, expected):
+    pour_points_file = tmp_path / "pour_points.csv"
+    pour_points_file.write_text(pour_points)
+
+    header, groups = basin_groups(
+        str(pour_points_file),
+        str(files("tests") / "data/samples/sample_flow_parameters.nc"),
+        params_config_template["ROUTING"],
+    )
+    assert {basin: len(rows) for basin, rows in groups.items()} == expected
+
+
+@pytest.mark.parametrize(
+    ("pour_points", "expected"),
+    [
+        ("lons,lats,names\n-118.0938,51.09375,sample\n", []),
+        (
+            "lons,lats,names\n-118.0938,51.09375,sample\n-116.21875,41.21875,new\n",
+            [["-116.21875", "41.21875", "new"]],
+        ),
+    ],
+)
+def test_new_pour_points(tmp_path, pour_points, expected):
+    pour_points_file = tmp_path / "pour_points.csv"
+    pour_points_file.write_text(pour_points)
+
+    header, rows = new_pour_points(
+        str(pour_points_file),
+        str(files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"),
+        str(files("tests") / "data/samples/sample_flow_parameters.nc"),
+        params_config_template["ROUTING"],
+    )
+    assert rows == expected
+
+
+@pytest.mark.parametrize(
+    ("lats", "lons", "expected_ys", "expected_xs", "expected_rejected"),
+    [
+        # valid cell, invalid cell next to a valid one, far outside the grid
+        ([1.0, 1.0, 50.0], [1.0, 2.0, 50.0], [1, 1, 1], [1, 1, 1], [0, 0, 1]),
+    ],
+)
+def test_grid_index_snap(
+    tmp_path, lats, lons, expected_ys, expected_xs, expected_rejected
+):
+    valid = np.zeros((3, 3), dtype=bool)
+    valid[1, 1] = True
+    index = GridIndex([0.0, 1.0, 2.0], [0.0, 1.0, 2.0], valid)
+    index.save(str(tmp_path))
+    index = GridIndex.load(str(tmp_path))
+
+    ys, xs, rejected = index.snap(lats, lons)
+    assert list(ys) == expected_ys
+    assert list(xs) == expected_xs
+    assert list(rejected) == list(map(bool, expected_rejected))
+
+
+@pytest.mark.parametrize(
+    ("lons", "lats", "expected"),
+    [
+        ([-118.0938], [51.09375], 1),
+        ([-123.40625], [46.21875], 19597),
+        ([-123.40625, -118.0938], [46.21875, 51.09375], 19597),
+    ],
+)
+def test_upstream_index(tmp_path, lons, lats, expected):
+    routing = params_config_template["ROUTING"]
+    routing_file = str(files("tests") / "data/samples/sample_flow_parameters.nc")
+    index = UpstreamIndex.from_netcdf(
+        routing_file,
+        routing["LATITUDE_VAR"],
+        routing["FLOW_DIRECTION_VAR"],
+        routing["BASIN_ID_VAR"],
+    )
+    index.save(str(tmp_path))
+    index = UpstreamIndex.load(str(tmp_path))
+
+    grid = GridIndex.from_netcdf(
+        routing_file,
+        routing["LATITUDE_VAR"],
+        routing["LONGITUDE_VAR"],
+        routing["FLOW_DIRECTION_VAR"],
+    )
+    ys, xs = grid.cells(lats, lons)
+    mask = index.catchment_mask(ys, xs)
+    assert mask.sum() == expected
+    assert index.upstream_count(ys[:1], xs[:1])[0] == len(
+        index.upstream(ys[0], xs[0])[0]
+    )
+    assert set(index.basin[mask.ravel()]) == {49}
+
+
+@pytest.mark.parametrize("fill_value", [None, -1.0])
+def test_write_subset_masked(tmp_path, fill_value):
+    nc_file, out_file = str(tmp_path / "routing.nc"), str(tmp_path / "subset.nc")
+    with Dataset(nc_file, "w") as ds:
+        ds.createDimension("lat", 3)
+        ds.createDimension("lon", 4)
+        ds.createVariable("lat", "f8", ("lat",))[:] = [50, 51, 52]
+        ds.createVariable("lon", "f8", ("lon",))[:] = [-120, -119, -118, -117]
+        basin = ds.createVariable(
+            "Basin_ID", "f4", ("lat", "lon"), fill_value=fill_value
+        )
+        basin[:] = np.arange(12).reshape(3, 4)
+
+    mask = np.zeros((3, 4), dtype=bool)
+    mask[1, 1:3] = True
+    write_subset(
+        nc_file,
+        out_file,
+        "lat",
+        "lon",
+        (slice(0, 2), slice(1, 4)),
+        masked={"Basin_ID": mask},
+    )
+
+    with Dataset(out_file) as ds:
+        basin = ds.variables["Basin_ID"]
+        assert "_FillValue" in basin.ncattrs()
+        if fill_value is not None:
+            assert basin._FillValue == fill_value
+        assert basin[:].mask.tolist() == [[True] * 3, [False, False, True]]
+        assert basin[1, :2].tolist() == [5, 6]
@@ -12,6 +12,7 @@ def test_wps_caps():
     assert sorted(names.split()) == [
         "convert",
         "convolution",
+        "extend_parameters",
         "full_rvic",
         "parameters",
     ]
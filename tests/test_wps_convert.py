@@ -1,5 +1,7 @@
 import configparser
+import os
 from pytest import mark
+from urllib.parse import urlparse
 from rvic.core.config import read_config
 
 
@@ -30,8 +32,18 @@ def build_params(uhs_files, station_file, domain, config_file):
 )
 def test_wps_convert_local(uhs_files, station_file, domain, config_file):
     params = build_params(uhs_files, station_file, domain, config_file)
+    station_path, config_path = (
+        urlparse(url).path for url in (station_file, config_file)
+    )
+    with open(station_path) as f:
+        stations = f.read()
     run_wps_process(Convert(), params)
 
+    # The inputs are read in place and edited as copies
+    with open(station_path) as f:
+        assert f.read() == stations
+    assert not os.path.exists(config_path.replace(".cfg", "_edited.cfg"))
+
 
 @mark.online
 @mark.parametrize(
@@ -0,0 +1,83 @@
+from importlib.resources import files
+from netCDF4 import Dataset
+import pytest
+
+from wps_tools.testing import run_wps_process, local_path
+from osprey.processes.wps_extend_parameters import ExtendParameters
+from .utils import process_output_file
+
+
+@pytest.mark.parametrize(
+    (
+        "case_id",
+        "grid_id",
+        "param_file",
+        "pour_points",
+        "uh_box",
+        "routing",
+        "domain",
+    ),
+    [
+        (
+            "sample",
+            "COLUMBIA",
+            local_path("samples/sample.rvic.prm.COLUMBIA.20180516.nc"),
+            str(files("tests") / "data/samples/sample_pour.txt"),
+            str(files("tests") / "data/samples/uhbox.csv"),
+            local_path("samples/sample_flow_parameters.nc"),
+            local_path("samples/sample_routing_domain.nc"),
+        ),
+    ],
+)
+def test_extend_parameters_local(
+    case_id,
+    grid_id,
+    param_file,
+    pour_points,
+    uh_box,
+    routing,
+    domain,
+):
+    with open(pour_points, "r") as pour_points_csv:
+        params = (
+            f"case_id={case_id};"
+            f"grid_id={grid_id};"
+            f"param_file=@xlink:href={param_file};"
+            f"pour_points_csv={pour_points_csv.read()};"
+            f"uh_box_csv=@xlink:href=file://{uh_box};"
+            f"routing=@xlink:href={routing};"
+            f"domain=@xlink:href={domain};"
+        )
+        run_wps_process(ExtendParameters(), params)
+
+
+def test_extend_parameters_new_outlet():
+    param_file = str(
+        files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"
+    )
+    # The outlet of the parameter file and a new pour point next to it
+    pour_points = (
+        "lons,lats,names\n-118.0938,51.09375,sample\n-118.15625,51.03125,new\n"
+    )
+    params = (
+        "case_id=sample;"
+        "grid_id=COLUMBIA;"
+        f"param_file=@xlink:href=file://{param_file};"
+        f"pour_points_csv={pour_points};"
+        f"uh_box_csv=@xlink:href=file://{files('tests') / 'data/samples/uhbox.csv'};"
+        f"routing=@xlink:href={local_path('samples/sample_flow_parameters.nc')};"
+        f"domain=@xlink:href={local_path('samples/sample_routing_domain.nc')};"
+    )
+    extended = process_output_file(ExtendParameters(), params)
+
+    with Dataset(param_file) as original, Dataset(extended) as ds:
+        n_outlets = len(original.dimensions["outlets"])
+        n_sources = len(original.dimensions["sources"])
+        assert len(ds.dimensions["outlets"]) == n_outlets + 1
+        for name in ("outlet_x_ind", "outlet_y_ind", "outlet_lon", "outlet_lat"):
+            assert (ds[name][:n_outlets] == original[name][:]).all()
+
+        uh = ds["unit_hydrograph"]
+        assert uh.shape[0] == original["unit_hydrograph"].shape[0]
+        assert uh.shape[1] > n_sources
+        assert (uh[:, :n_sources] == original["unit_hydrograph"][:]).all()
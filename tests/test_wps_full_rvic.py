@@ -1,9 +1,11 @@
 from pytest import mark
 from importlib.resources import files
+from netCDF4 import Dataset, chartostring
 
 from wps_tools.testing import run_wps_process, local_path, url_path
 from osprey.processes.wps_full_rvic import FullRVIC
-from .utils import process_err_test
+from .test_engine import write_forcing_file
+from .utils import process_err_test, process_output_file
 
 
 @mark.slow
@@ -243,3 +245,29 @@ def test_full_rvic_date_err(
             f"convolve_config_dict={convolve_config_dict};"
         )
         assert process_err_test(FullRVIC(), params)
+
+
+def test_full_rvic_scenarios(tmp_path):
+    param_file = str(
+        files("tests") / "data/samples/sample.rvic.prm.COLUMBIA.20180516.nc"
+    )
+    uh_box = files("tests") / "data/samples/uhbox.csv"
+    params = (
+        "case_id=sample;"
+        "grid_id=COLUMBIA;"
+        "run_startdate=2012-12-01-00;"
+        "stop_date=2012-12-31;"
+        "pour_points_csv=lons,lats,names\n-118.0938,51.09375,sample\n;"
+        f"uh_box_csv=@xlink:href=file://{uh_box};"
+        f"routing=@xlink:href={local_path('samples/sample_flow_parameters.nc')};"
+        f"domain=@xlink:href={local_path('samples/sample_routing_domain.nc')};"
+    )
+    # Every occurrence of input_forcings is a scenario
+    for seed, name in enumerate(("historical", "future")):
+        forcing = write_forcing_file(str(tmp_path / f"{name}.nc"), param_file, 60, seed)
+        params += f"input_forcings=@xlink:href=file://{forcing};"
+
+    with Dataset(process_output_file(FullRVIC(), params)) as ds:
+        assert list(chartostring(ds["ensemble_member"][:])) == ["historical", "future"]
+        assert ds["streamflow"].shape[0] == 2
+        assert (ds["streamflow"][0] != ds["streamflow"][1]).any()
@@ -1,11 +1,16 @@
 from importlib.resources import files
+import numpy as np
 import os
 import pytest
+import shutil
+from netCDF4 import Dataset, chartostring
 from tempfile import NamedTemporaryFile
 
 from wps_tools.testing import run_wps_process, local_path, url_path
+from osprey import utils
+from osprey.cache import FileCache
 from osprey.processes.wps_parameters import Parameters
-from .utils import process_err_test
+from .utils import process_err_test, process_output_file
 
 
 @pytest.mark.parametrize(
@@ -84,6 +89,117 @@ def test_parameters_local(
         run_wps_process(Parameters(), params)
 
 
+def outlet_parameters(param_file):
+    """
+    Map the names of the outlets of a parameter file to the values of every
+    variable for the outlet and its sources, with the sources sorted by cell.
+    Variables without an outlets or sources dimension are kept under None.
+    """
+    with Dataset(param_file) as ds:
+        names = list(chartostring(ds["outlet_name"][:]))
+        source_outlets = ds["source2outlet_ind"][:]
+        cells = np.lexsort((ds["source_x_ind"][:], ds["source_y_ind"][:]))
+        params = {None: {}, **{name: {} for name in names}}
+        for var_name, var in ds.variables.items():
+            if var_name == "source2outlet_ind":
+                continue
+            for i, name in enumerate(names):
+                if "outlets" in var.dimensions:
+                    axis, index = var.dimensions.index("outlets"), i
+                elif "sources" in var.dimensions:
+                    axis = var.dimensions.index("sources")
+                    index = cells[source_outlets[cells] == i]
+                else:
+                    params[None][var_name] = var[...]
+                    break
+                params[name][var_name] = np.take(var[...], index, axis=axis)
+    return names, params
+
+
+@pytest.mark.parametrize(
+    "pour_points",
+    [
+        # Two pour points in one basin, one draining to the other, and one in
+        # another basin
+        (
+            "lons,lats,names\n"
+            "-118.0938,51.09375,sample\n"
+            "-118.15625,51.03125,upstream\n"
+            "-121.90625,46.84375,other\n"
+        ),
+        # Catchments of some 40 cells each, far apart on the grid
+        "lons,lats,names\n-116.40625,41.65625,east\n-123.78125,42.28125,west\n",
+    ],
+)
+@pytest.mark.parametrize("split_basins", [False, True])
+def test_parameters_subset_matches_full(
+    monkeypatch, tmp_path, pour_points, split_basins
+):
+    uh_box = files("tests") / "data/samples/uhbox.csv"
+    params = (
+        "case_id=sample;"
+        "grid_id=COLUMBIA;"
+        f"pour_points_csv={pour_points};"
+        f"uh_box_csv=@xlink:href=file://{uh_box};"
+        f"routing=@xlink:href={local_path('samples/sample_flow_parameters.nc')};"
+        f"domain=@xlink:href={local_path('samples/sample_routing_domain.nc')};"
+    )
+
+    param_files = []
+    # The reference run hands RVIC the full files in one piece
+    for subset, options in (
+        (False, ""),
+        (True, "np=2;split_basins=True;" if split_basins else ""),
+    ):
+        monkeypatch.setattr(utils, "subset_routing", lambda: subset)
+        param_files.append(tmp_path / f"subset_{subset}.nc")
+        shutil.copyfile(
+            process_output_file(Parameters(), params + options), param_files[-1]
+        )
+
+    (full_names, full), (names, subset) = map(outlet_parameters, param_files)
+    if not split_basins:
+        assert names == full_names
+    # Merged basins keep the outlet order of their basin, not of a single run
+    assert full.keys() == subset.keys()
+    for name, variables in full.items():
+        assert variables.keys() == subset[name].keys()
+        for var_name, values in variables.items():
+            np.testing.assert_array_equal(values, subset[name][var_name])
+
+
+def test_parameters_cache_hit(monkeypatch, tmp_path):
+    cache = FileCache(str(tmp_path / "cache"), 2**30)
+    monkeypatch.setattr(
+        FileCache,
+        "from_config",
+        lambda name: cache if name == "parameters" else None,
+    )
+    uh_box = files("tests") / "data/samples/uhbox.csv"
+    params = (
+        "case_id=sample;"
+        "grid_id=COLUMBIA;"
+        "pour_points_csv=lons,lats,names\n-118.0938,51.09375,sample\n;"
+        f"uh_box_csv=@xlink:href=file://{uh_box};"
+        f"routing=@xlink:href={local_path('samples/sample_flow_parameters.nc')};"
+        f"domain=@xlink:href={local_path('samples/sample_routing_domain.nc')};"
+    )
+
+    param_files = []
+    for run in ("developed", "cached"):
+        param_files.append(tmp_path / f"{run}.nc")
+        shutil.copyfile(process_output_file(Parameters(), params), param_files[-1])
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+    # The cached copy is stored sparsely and written out densely again
+    with Dataset(param_files[0]) as developed, Dataset(param_files[1]) as cached:
+        assert cached.variables.keys() == developed.variables.keys()
+        for name, var in developed.variables.items():
+            assert cached[name].dimensions == var.dimensions
+            np.testing.assert_array_equal(cached[name][...], var[...])
+
+
 @pytest.mark.online
 @pytest.mark.parametrize(
     (
@@ -1,5 +1,6 @@
 from wps_tools.testing import client_for
-from pywps import Service
+from pywps import Service, configuration
+from pywps.tests import assert_response_success
 
 
 def process_err_test(process, params):
@@ -24,3 +25,27 @@ def process_err_test(process, params):
         if "Process error" in elem.text:
             return True
     return False
+
+
+def process_output_file(process, params, identifier="output"):
+    """Run a process and return the local path of one of its file outputs."""
+    client = client_for(Service(processes=[process]))
+    resp = client.get(
+        service="wps",
+        request="Execute",
+        version="1.0.0",
+        identifier=process.identifier,
+        datainputs=params,
+    )
+    assert_response_success(resp)
+
+    (href,) = resp.xpath(
+        "/wps:ExecuteResponse/wps:ProcessOutputs/wps:Output"
+        f"[ows:Identifier='{identifier}']/wps:Reference/@href"
+    )
+    # Outputs are published under outputurl from outputpath
+    return href.replace(
+        configuration.get_config_value("server", "outputurl"),
+        configuration.get_config_value("server", "outputpath"),
+        1,
+    )